@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: per-recipient regex rewriting (the pre-compilation renderer,
+frozen below) vs the precompiled campaign template on a ~100 KB HTML body.
+
+Run from the backend directory:
+    python benchmarks/bench_email_template.py [recipients]
+"""
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from routes.campaigns import compile_email_html
+from routes.tracking import encode_recipient_token, link_token_prefix, OPEN_LINK_INDEX
+from routes.unsubscribe import generate_unsubscribe_token
+
+BASE_URL = "https://links.example.com"
+CAMPAIGN_ID = 42
+
+
+def prepare_email_html(html: str, campaign_id: int, contact_email: str, base_url: str) -> str:
+    """
+    Frozen copy of the renderer campaigns used before compile_email_html(),
+    kept here as the baseline. Prepare email HTML by:
+    1. Injecting open tracking pixel
+    2. Rewriting links for click tracking
+    """
+    # Signed campaign + recipient token, shared by the pixel and every link
+    recipient_token = encode_recipient_token(campaign_id, contact_email)
+
+    # 1) Inject open tracking pixel
+    tracking_pixel = (
+        f'<img src="{base_url}/api/t/o/{link_token_prefix(OPEN_LINK_INDEX)}{recipient_token}" '
+        f'width="1" height="1" style="display:none;" />'
+    )
+    
+    if '</body>' in html.lower():
+        html = re.sub(r'</body>', f'{tracking_pixel}\n</body>', html, flags=re.IGNORECASE)
+    else:
+        html += f'\n{tracking_pixel}'
+    
+    # 2) Rewrite links for click tracking (link index = position in the HTML)
+    link_index = 0
+
+    def replace_link(match):
+        nonlocal link_index
+        # The target URL lives in campaign_links, keyed by (campaign, link index)
+        tracking_url = f"{base_url}/api/t/c/{link_token_prefix(link_index)}{recipient_token}"
+        link_index += 1
+        return f'href="{tracking_url}"'
+    
+    html = re.sub(r'href="(https?://[^"]+)"', replace_link, html, flags=re.IGNORECASE)
+    
+    # 3) Inject unsubscribe link
+    token = generate_unsubscribe_token(contact_email, campaign_id)
+    unsubscribe_link = (
+        f'<div style="text-align:center;margin-top:20px;padding:10px;color:#999;font-size:12px;">'
+        f'<a href="{base_url}/unsubscribe/{token}?email={contact_email}" style="color:#999;">Unsubscribe</a>'
+        f'</div>'
+    )
+    
+    if '</body>' in html.lower():
+        html = re.sub(r'</body>', f'{unsubscribe_link}\n</body>', html, flags=re.IGNORECASE)
+    else:
+        html += f'\n{unsubscribe_link}'
+    
+    return html
+
+
+def build_html(target_size: int = 100 * 1024) -> str:
+    """Newsletter-like HTML: paragraphs with a tracked link every block"""
+    blocks = []
+    size = 0
+    i = 0
+    while size < target_size:
+        block = (
+            f'<tr><td style="padding:16px;font-family:Arial,sans-serif;">'
+            f'<h2>Story {i}</h2>'
+            f'<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod '
+            f'tempor incididunt ut labore et dolore magna aliqua. Ut enim ad minim veniam.</p>'
+            f'<a href="https://www.example.com/articles/{i}?utm_source=newsletter&utm_medium=email">Read more</a>'
+            f'</td></tr>\n'
+        )
+        blocks.append(block)
+        size += len(block)
+        i += 1
+    return f"<html><head><title>Newsletter</title></head><body><table>{''.join(blocks)}</table></body></html>"
+
+
+def main():
+    recipients = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    html = build_html()
+    emails = [f"user{i}@example.com" for i in range(recipients)]
+
+    print("\n" + "="*60)
+    print("EMAIL TEMPLATE RENDER BENCHMARK")
+    print("="*60)
+    print(f"   HTML size: {len(html) / 1024:.1f} KB")
+    print(f"   Links: {html.count('href=')}")
+    print(f"   Recipients: {recipients}\n")
+
+    # Same output, or the comparison is meaningless
+    compiled = compile_email_html(html, CAMPAIGN_ID, BASE_URL)
+    assert compiled.render(emails[0]) == prepare_email_html(html, CAMPAIGN_ID, emails[0], BASE_URL)
+
+    start = time.perf_counter()
+    for email in emails:
+        prepare_email_html(html, CAMPAIGN_ID, email, BASE_URL)
+    legacy = time.perf_counter() - start
+
+    start = time.perf_counter()
+    compiled = compile_email_html(html, CAMPAIGN_ID, BASE_URL)
+    compile_time = time.perf_counter() - start
+    for email in emails:
+        compiled.render(email)
+    precompiled = time.perf_counter() - start
+
+    print(f"   prepare_email_html: {legacy:.3f}s  ({legacy / recipients * 1e6:.0f} µs/recipient)")
+    print(f"   compiled template:  {precompiled:.3f}s  ({precompiled / recipients * 1e6:.0f} µs/recipient, compile {compile_time * 1e3:.1f} ms)")
+    print(f"   Speedup: {legacy / precompiled:.1f}x\n")
+
+
+if __name__ == "__main__":
+    main()
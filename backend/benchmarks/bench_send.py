@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Send-throughput benchmark against the local SES stand-in.
+
+Seeds N contacts into a scratch database, runs a full campaign send job
+through campaign_sender.run_campaign_send() with SES pointed at
+benchmarks/fake_ses.py, and reports emails/sec, p50/p99 per-call SES
+latency and campaign_sends write cost.
+
+The database is TRUNCATED between runs, so it refuses to run unless
+DB_NAME contains "bench":
+    createdb email_system_bench
+    DB_NAME=email_system_bench python benchmarks/bench_send.py 1000,100000,1000000
+
+Fake SES behaviour is set with BENCH_SES_LATENCY_MS, BENCH_SES_MAX_RATE
+and BENCH_SES_ERROR_RATE; send settings (SEND_CONCURRENCY, SEND_MODE,
+SEND_WRITE_BATCH_SIZE, ...) are read from the environment as usual.
+"""
+import contextlib
+import io
+import os
+import sys
+import time
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from dotenv import load_dotenv
+
+load_dotenv(os.path.join(BACKEND_DIR, ".env"))
+
+from fake_ses import FakeSESConfig, start_fake_ses
+
+SENDER = "bench@example.com"
+DEFAULT_SIZES = [1000, 100000, 1000000]
+SEED_CHUNK = 100000
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def seed_contacts(conn, count: int):
+    cur = conn.cursor()
+    cur.execute("TRUNCATE contacts, campaigns, suppressions CASCADE")
+    for start in range(0, count, SEED_CHUNK):
+        rows = "".join(f"user{i:08d}@bench.example.com\n" for i in range(start, min(count, start + SEED_CHUNK)))
+        cur.copy_expert("COPY contacts (email) FROM STDIN", io.StringIO(rows))
+    cur.execute("ANALYZE contacts")
+    cur.execute(
+        "INSERT INTO campaigns (subject, sender, html) VALUES (%s, %s, %s) RETURNING id",
+        ("Benchmark", SENDER, "<html><body><p>Hello</p><a href=\"https://example.com/a\">A</a></body></html>")
+    )
+    campaign_id = cur.fetchone()[0]
+    conn.commit()
+    cur.close()
+    return campaign_id
+
+
+def run(size: int) -> dict:
+    import campaign_sender
+    from database import get_db
+    from send_jobs import enqueue_job, claim_shard
+    from ses import ses
+
+    conn = get_db()
+    campaign_id = seed_contacts(conn, size)
+    conn.close()
+
+    # Per-call SES latency, measured at the client
+    latencies = []
+    for name in ("send_email", "send_bulk_templated_email"):
+        original = getattr(ses, name)
+
+        def timed(*args, _original=original, **kwargs):
+            start = time.perf_counter()
+            try:
+                return _original(*args, **kwargs)
+            finally:
+                latencies.append(time.perf_counter() - start)
+        setattr(ses, name, timed)
+
+    # campaign_sends write cost
+    flushes = {"count": 0, "rows": 0, "seconds": 0.0}
+    original_flush = campaign_sender.SendResultWriter.flush
+
+    def timed_flush(writer):
+        rows = len(writer.rows)
+        start = time.perf_counter()
+        flushed = original_flush(writer)
+        if flushed:
+            flushes["count"] += 1
+            flushes["rows"] += rows
+            flushes["seconds"] += time.perf_counter() - start
+        return flushed
+    campaign_sender.SendResultWriter.flush = timed_flush
+
+    try:
+        enqueue_job(campaign_id, 1)
+        shard = claim_shard("bench")
+        start = time.perf_counter()
+        # The send path logs every recipient; keep that out of the measurement
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = campaign_sender.run_campaign_send(shard)
+        elapsed = time.perf_counter() - start
+    finally:
+        campaign_sender.SendResultWriter.flush = original_flush
+        for name in ("send_email", "send_bulk_templated_email"):
+            delattr(ses, name)
+
+    return {
+        "size": size,
+        "status": result["status"],
+        "sent": result["total_sent"],
+        "failed": result["total_failed"],
+        "elapsed": elapsed,
+        "rate": (result["total_sent"] + result["total_failed"]) / elapsed if elapsed else 0,
+        "calls": len(latencies),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "flushes": flushes["count"],
+        "db_seconds": flushes["seconds"],
+        "db_ms_per_1k": flushes["seconds"] / flushes["rows"] * 1e6 if flushes["rows"] else 0
+    }
+
+
+def main():
+    sizes = [int(s) for s in sys.argv[1].split(",")] if len(sys.argv) > 1 else DEFAULT_SIZES
+
+    db_name = os.getenv("DB_NAME", "email_system")
+    if "bench" not in db_name:
+        print(f"❌ Refusing to run against DB_NAME={db_name}: the benchmark truncates contacts and campaigns.")
+        print("   Use a scratch database, e.g. DB_NAME=email_system_bench")
+        sys.exit(1)
+
+    config = FakeSESConfig(
+        latency_ms=float(os.getenv("BENCH_SES_LATENCY_MS", "20")),
+        jitter_ms=float(os.getenv("BENCH_SES_JITTER_MS", "5")),
+        max_rate=float(os.getenv("BENCH_SES_MAX_RATE", "0")),
+        error_rate=float(os.getenv("BENCH_SES_ERROR_RATE", "0")),
+        verified_emails=[SENDER]
+    )
+    server = start_fake_ses(config)
+    os.environ["SES_ENDPOINT_URL"] = f"http://127.0.0.1:{server.server_port}"
+    os.environ["AWS_ACCESS_KEY_ID"] = "bench"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "bench"
+
+    from database import get_db
+    conn = get_db()
+    cur = conn.cursor()
+    with open(os.path.join(BACKEND_DIR, "schema.sql")) as f:
+        cur.execute(f.read())
+    conn.commit()
+    cur.close()
+    conn.close()
+
+    print("\n" + "="*96)
+    print("CAMPAIGN SEND BENCHMARK (fake SES)")
+    print("="*96)
+    print(f"   SES latency: {config.latency_ms}±{config.jitter_ms} ms, max rate: {config.max_rate or 'unlimited'}/s, error rate: {config.error_rate}")
+    print(f"   Concurrency: {os.getenv('SEND_CONCURRENCY', '20')}, mode: {os.getenv('SEND_MODE', 'single')}, "
+          f"write batch: {os.getenv('SEND_WRITE_BATCH_SIZE', '500')}\n")
+    print(f"{'contacts':>10} {'status':>16} {'elapsed s':>10} {'emails/s':>10} {'SES calls':>10} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'flushes':>8} {'DB s':>8} {'DB ms/1k':>9}")
+
+    for size in sizes:
+        r = run(size)
+        print(f"{r['size']:>10} {r['status']:>16} {r['elapsed']:>10.1f} {r['rate']:>10.0f} {r['calls']:>10} "
+              f"{r['p50_ms']:>8.1f} {r['p99_ms']:>8.1f} {r['flushes']:>8} {r['db_seconds']:>8.2f} {r['db_ms_per_1k']:>9.1f}")
+
+    print(f"\n   Fake SES totals: {config.stats()}\n")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Local SES stand-in for offline testing and benchmarks.
+
+Speaks enough of the SES (v1) Query API for the send path: SendEmail,
+SendBulkTemplatedEmail, GetSendQuota, identity listing and templates.
+Latency, throttling and error injection are configurable.
+
+Point the backend at it with SES_ENDPOINT_URL:
+    python benchmarks/fake_ses.py --port 4579 --latency-ms 20 --max-rate 200
+    SES_ENDPOINT_URL=http://127.0.0.1:4579 python send_worker.py
+"""
+import argparse
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+from xml.sax.saxutils import escape
+
+NAMESPACE = "http://ses.amazonaws.com/doc/2010-12-01/"
+
+
+class FakeSESConfig:
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0, max_rate: float = 0,
+                 error_rate: float = 0, max_24h: int = -1,
+                 verified_emails: list = None, verified_domains: list = None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.max_rate = max_rate          # recipients/sec before Throttling (0 = unlimited)
+        self.error_rate = error_rate      # fraction of recipients rejected with MessageRejected
+        self.max_24h = max_24h            # -1 = unlimited
+        self.verified_emails = verified_emails if verified_emails is not None else []
+        self.verified_domains = verified_domains if verified_domains is not None else []
+
+        self.sent = 0
+        self.throttled = 0
+        self.rejected = 0
+        self.api_calls = 0
+        self.templates = {}
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._lock = threading.Lock()
+
+    def admit(self, recipients: int) -> str:
+        """Count a send against the rate and daily limits; returns an error code or None"""
+        with self._lock:
+            self.api_calls += 1
+            now = time.monotonic()
+            if now - self._window_start >= 1.0:
+                self._window_start = now
+                self._window_count = 0
+
+            if self.max_24h >= 0 and self.sent + recipients > self.max_24h:
+                self.throttled += recipients
+                return "DailyQuota"
+            if self.max_rate and self._window_count + recipients > self.max_rate:
+                self.throttled += recipients
+                return "Throttling"
+
+            self._window_count += recipients
+            self.sent += recipients
+            return None
+
+    def stats(self) -> dict:
+        return {
+            "api_calls": self.api_calls,
+            "sent": self.sent,
+            "throttled": self.throttled,
+            "rejected": self.rejected
+        }
+
+
+def _members(params: dict, prefix: str) -> list:
+    values = []
+    i = 1
+    while f"{prefix}.member.{i}" in params:
+        values.append(params[f"{prefix}.member.{i}"])
+        i += 1
+    return values
+
+
+def _member_xml(values) -> str:
+    return "".join(f"<member>{escape(v)}</member>" for v in values)
+
+
+class FakeSESHandler(BaseHTTPRequestHandler):
+    config: FakeSESConfig = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, body: str):
+        data = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "text/xml")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _result(self, action: str, inner: str = ""):
+        self._reply(200, (
+            f'<{action}Response xmlns="{NAMESPACE}">'
+            f'<{action}Result>{inner}</{action}Result>'
+            f'<ResponseMetadata><RequestId>{uuid.uuid4()}</RequestId></ResponseMetadata>'
+            f'</{action}Response>'
+        ))
+
+    def _error(self, code: str, message: str):
+        self._reply(400, (
+            f'<ErrorResponse xmlns="{NAMESPACE}">'
+            f'<Error><Type>Sender</Type><Code>{code}</Code><Message>{escape(message)}</Message></Error>'
+            f'<RequestId>{uuid.uuid4()}</RequestId></ErrorResponse>'
+        ))
+
+    def _sleep(self):
+        config = self.config
+        delay = config.latency_ms + random.uniform(-config.jitter_ms, config.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    def _admit_error(self, recipients: int) -> bool:
+        limit = self.config.admit(recipients)
+        if limit == "Throttling":
+            self._error("Throttling", "Maximum sending rate exceeded.")
+            return True
+        if limit == "DailyQuota":
+            self._error("Throttling", "Daily message quota exceeded.")
+            return True
+        return False
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        params = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+        action = params.get("Action")
+        config = self.config
+
+        if action == "SendEmail":
+            self._sleep()
+            if self._admit_error(1):
+                return
+            if random.random() < config.error_rate:
+                config.rejected += 1
+                self._error("MessageRejected", "Email address is not verified.")
+                return
+            self._result(action, f"<MessageId>{uuid.uuid4()}</MessageId>")
+
+        elif action == "SendBulkTemplatedEmail":
+            self._sleep()
+            destinations = 0
+            while f"Destinations.member.{destinations + 1}.Destination.ToAddresses.member.1" in params:
+                destinations += 1
+            if params.get("Template") not in config.templates:
+                self._error("TemplateDoesNotExist", f"Template {params.get('Template')} does not exist")
+                return
+            if self._admit_error(destinations):
+                return
+            statuses = []
+            for _ in range(destinations):
+                if random.random() < config.error_rate:
+                    config.rejected += 1
+                    statuses.append("<member><Status>MessageRejected</Status><Error>Rejected</Error></member>")
+                else:
+                    statuses.append(f"<member><Status>Success</Status><MessageId>{uuid.uuid4()}</MessageId></member>")
+            self._result(action, f"<Status>{''.join(statuses)}</Status>")
+
+        elif action == "GetSendQuota":
+            self._result(action, (
+                f"<Max24HourSend>{config.max_24h}</Max24HourSend>"
+                f"<MaxSendRate>{config.max_rate or 1000000}</MaxSendRate>"
+                f"<SentLast24Hours>{config.sent}</SentLast24Hours>"
+            ))
+
+        elif action == "GetAccountSendingEnabled":
+            self._result(action, "<Enabled>true</Enabled>")
+
+        elif action == "ListVerifiedEmailAddresses":
+            self._result(action, f"<VerifiedEmailAddresses>{_member_xml(config.verified_emails)}</VerifiedEmailAddresses>")
+
+        elif action == "ListIdentities":
+            identities = config.verified_domains if params.get("IdentityType") == "Domain" else config.verified_emails + config.verified_domains
+            self._result(action, f"<Identities>{_member_xml(identities)}</Identities>")
+
+        elif action in ("CreateTemplate", "UpdateTemplate"):
+            name = params.get("Template.TemplateName")
+            if action == "CreateTemplate" and name in config.templates:
+                self._error("AlreadyExists", f"Template {name} already exists.")
+                return
+            config.templates[name] = params.get("Template.HtmlPart", "")
+            self._result(action)
+
+        elif action == "DeleteTemplate":
+            config.templates.pop(params.get("TemplateName"), None)
+            self._result(action)
+
+        else:
+            self._error("InvalidAction", f"Fake SES does not implement {action}")
+
+
+def start_fake_ses(config: FakeSESConfig, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Start the fake in a background thread. The endpoint is http://host:server.server_port"""
+    handler = type("ConfiguredFakeSESHandler", (FakeSESHandler,), {"config": config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local SES stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4579)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--jitter-ms", type=float, default=5)
+    parser.add_argument("--max-rate", type=float, default=0, help="recipients/sec before Throttling (0 = unlimited)")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of recipients rejected")
+    parser.add_argument("--max-24h", type=int, default=-1, help="daily quota (-1 = unlimited)")
+    parser.add_argument("--verified", default="", help="comma-separated verified sender emails")
+    args = parser.parse_args()
+
+    config = FakeSESConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        max_rate=args.max_rate,
+        error_rate=args.error_rate,
+        max_24h=args.max_24h,
+        verified_emails=[e for e in args.verified.split(",") if e]
+    )
+    server = start_fake_ses(config, args.host, args.port)
+
+    print(f"🧪 Fake SES listening on http://{args.host}:{server.server_port}")
+    print(f"   Latency: {args.latency_ms}±{args.jitter_ms} ms, max rate: {args.max_rate or 'unlimited'}/s, error rate: {args.error_rate}")
+    try:
+        while True:
+            time.sleep(10)
+            print(f"   {config.stats()}")
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
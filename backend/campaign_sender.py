@@ -0,0 +1,405 @@
+"""
+Campaign send pipeline, run by send_worker.py for each claimed send job.
+"""
+import os
+import time
+import json
+import hashlib
+from collections import deque
+from psycopg2.extras import execute_values
+from database import get_db
+from routes.campaigns import compile_email_html, register_campaign_links, BASE_URL
+from routes.unsubscribe import generate_unsubscribe_token
+from routes.tracking import encode_recipient_token
+from stats_cache import notify_stats_changed
+from stats_rollup import add_counts, add_bucket_counts
+from botocore.exceptions import ClientError
+from send_engine import SendEngine, get_send_limits, is_throttling_error, is_daily_quota_error, SEND_CONCURRENCY
+from send_jobs import set_shard_total, record_shard_progress, count_running_shards, finish_shard
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Rows fetched per round trip from the server-side audience cursor
+AUDIENCE_FETCH_SIZE = int(os.getenv("AUDIENCE_FETCH_SIZE", "2000"))
+
+# "single" makes one SendEmail call per recipient. "bulk" registers the
+# campaign HTML once as an SES template and sends up to 50 recipients per
+# SendBulkTemplatedEmail call, falling back to single sends on failure.
+SEND_MODE = os.getenv("SEND_MODE", "single")
+BULK_BATCH_SIZE = 50  # SES maximum destinations per bulk call
+
+# campaign_sends rows are committed in batches of this size, or after this
+# many seconds, whichever comes first
+SEND_WRITE_BATCH_SIZE = int(os.getenv("SEND_WRITE_BATCH_SIZE", "500"))
+SEND_WRITE_FLUSH_INTERVAL = float(os.getenv("SEND_WRITE_FLUSH_INTERVAL", "1.0"))
+
+# Active contacts (not unsubscribed, not suppressed) in one shard that
+# haven't been sent this campaign yet, as a single anti-join. Streamed
+# ordered by email so a resumed shard can continue after the last committed
+# recipient. Parameters: (after_email, shard_count, shard, campaign_id).
+AUDIENCE_SQL = """
+    SELECT c.email FROM contacts c
+    WHERE c.unsubscribed = FALSE
+    AND c.email > %s
+    AND mod(hashtext(c.email) & 2147483647, %s) = %s
+    AND NOT EXISTS (
+        SELECT 1 FROM suppressions s WHERE s.email = c.email
+    )
+    AND NOT EXISTS (
+        SELECT 1 FROM campaign_sends cs
+        WHERE cs.campaign_id = %s AND cs.contact_email = c.email
+    )
+"""
+
+
+class SendResultWriter:
+    """
+    Buffers campaign_sends rows and writes them as one multi-row INSERT per
+    batch, committed together with the job's progress (group commit instead
+    of one fsync per email). ON CONFLICT keeps re-sent rows idempotent.
+    """
+
+    def __init__(self, conn, campaign_id: int, job_id: int, shard: int, progress: dict,
+                 batch_size: int = None, flush_interval: float = None):
+        self.conn = conn
+        self.campaign_id = campaign_id
+        self.job_id = job_id
+        self.shard = shard
+        self.progress = progress
+        self.batch_size = batch_size or SEND_WRITE_BATCH_SIZE
+        self.flush_interval = flush_interval if flush_interval is not None else SEND_WRITE_FLUSH_INTERVAL
+        self.rows = []
+        self._last_flush = time.monotonic()
+
+    def add(self, email: str, message_id: str, delivered: bool, bounce_type: str):
+        self.rows.append((self.campaign_id, email, message_id, delivered, bounce_type))
+
+    def flush_if_due(self) -> bool:
+        if (len(self.rows) >= self.batch_size
+                or time.monotonic() - self._last_flush >= self.flush_interval):
+            return self.flush()
+        return False
+
+    def flush(self) -> bool:
+        if not self.rows:
+            return False
+
+        cur = self.conn.cursor()
+        try:
+            inserted = execute_values(
+                cur,
+                """
+                INSERT INTO campaign_sends (campaign_id, contact_email, message_id, delivered, bounce_type)
+                VALUES %s
+                ON CONFLICT (campaign_id, contact_email) DO NOTHING
+                RETURNING delivered, bounce_type, date_trunc('minute', sent_at)
+                """,
+                self.rows,
+                page_size=len(self.rows),
+                fetch=True
+            )
+            add_counts(cur, {self.campaign_id: {
+                "sent": len(inserted),
+                "delivered": sum(1 for delivered, bounce_type, _ in inserted if delivered or bounce_type is None),
+                "bounces": sum(1 for _, bounce_type, _ in inserted if bounce_type is not None)
+            }})
+            buckets = {}
+            for _, bounce_type, minute in inserted:
+                bucket = buckets.setdefault((self.campaign_id, minute), {"sends": 0, "bounces": 0})
+                bucket["sends"] += 1
+                if bounce_type is not None:
+                    bucket["bounces"] += 1
+            add_bucket_counts(cur, buckets)
+            record_shard_progress(
+                cur, self.job_id, self.shard,
+                self.progress["sent"], self.progress["failed"], self.progress["last_email"]
+            )
+            notify_stats_changed(cur, self.campaign_id)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+        self.rows = []
+        self._last_flush = time.monotonic()
+        return True
+
+
+def build_template_html(html: str, campaign_id: int, base_url: str) -> str:
+    """Tracked campaign HTML with {{email}}, {{unsubscribe_token}} and {{tracking_token}} SES placeholders"""
+    return compile_email_html(html, campaign_id, base_url).render(
+        "{{email}}", "{{unsubscribe_token}}", "{{tracking_token}}"
+    )
+
+
+def register_campaign_template(ses_client, campaign_id: int, subject: str, html: str) -> str:
+    """Register the campaign as an SES template once and return its name"""
+    digest = hashlib.sha256(f"{subject}\n{html}".encode()).hexdigest()[:16]
+    template_name = f"campaign-{campaign_id}-{digest}"
+    template = {
+        "TemplateName": template_name,
+        "SubjectPart": subject,
+        "HtmlPart": build_template_html(html, campaign_id, BASE_URL)
+    }
+
+    try:
+        ses_client.create_template(Template=template)
+    except ses_client.exceptions.AlreadyExistsException:
+        # Left over from an earlier run of this job
+        ses_client.update_template(Template=template)
+
+    return template_name
+
+
+def run_campaign_send(job: dict) -> dict:
+    """Send one claimed shard of a campaign send job, resuming after job['last_email']"""
+    from ses import ses
+
+    job_id = job["job_id"]
+    shard = job["shard"]
+    shard_count = job["shard_count"]
+    campaign_id = job["campaign_id"]
+
+    conn = get_db()
+    cur = conn.cursor()
+
+    try:
+        # Get campaign info
+        cur.execute(
+            "SELECT subject, sender, html FROM campaigns WHERE id = %s",
+            (campaign_id,)
+        )
+        camp = cur.fetchone()
+
+        if not camp:
+            finish_shard(job_id, shard, "failed", "Campaign not found")
+            return {"status": "failed", "error": "Campaign not found"}
+
+        subject, sender, html = camp
+
+        # Counters carry over from a previous (crashed) run of this shard
+        progress = {"sent": job["sent"] or 0, "failed": job["failed"] or 0, "last_email": job["last_email"]}
+        cur.execute(
+            f"SELECT COUNT(*) FROM ({AUDIENCE_SQL}) audience",
+            (job["last_email"] or "", shard_count, shard, campaign_id)
+        )
+        remaining = cur.fetchone()[0]
+        total = progress["sent"] + progress["failed"] + remaining
+        set_shard_total(cur, job_id, shard, total)
+        conn.commit()
+
+        # Every running shard (on any worker) gets an equal share of the account
+        # rate and of the remaining 24h quota, so N shards can't overshoot it N times
+        limits = get_send_limits(ses)
+        running_shards = max(1, count_running_shards(cur))
+        shard_rate = limits["rate"] / running_shards
+        shard_quota = None
+        if limits["remaining_24h"] is not None:
+            shard_quota = limits["remaining_24h"] // running_shards
+
+        print(f"\n📧 STARTING CAMPAIGN SEND (job {job_id}, shard {shard + 1}/{shard_count}):")
+        print(f"   Campaign ID: {campaign_id}")
+        print(f"   Subject: {subject}")
+        print(f"   From: {sender}")
+        print(f"   Total Contacts: {total}")
+        if job["last_email"]:
+            print(f"   Resuming after: {job['last_email']} ({progress['sent'] + progress['failed']} already processed)")
+        print(f"   Send Rate: {shard_rate:.1f} of {limits['rate']} emails/sec ({SEND_CONCURRENCY} workers)")
+        if shard_quota is not None:
+            print(f"   Remaining 24h Quota: {shard_quota} of {limits['remaining_24h']} for this shard")
+        else:
+            print(f"   Remaining 24h Quota: unlimited")
+        print(f"   AWS Region: {os.getenv('AWS_REGION')}\n")
+
+        # Results complete out of order; last_email only advances past a
+        # recipient once everything before it in the audience is committed
+        submitted = deque()
+        completed = set()
+
+        def pending_contacts(after_email):
+            # Stream the audience through a server-side cursor on its own
+            # connection, so commits on the write connection don't close it
+            audience_conn = get_db()
+            audience_cur = audience_conn.cursor(name=f"send_job_{job_id}_{shard}_audience")
+            audience_cur.itersize = AUDIENCE_FETCH_SIZE
+            try:
+                audience_cur.execute(AUDIENCE_SQL + " ORDER BY c.email", (after_email or "", shard_count, shard, campaign_id))
+                for (email,) in audience_cur:
+                    submitted.append(email)
+                    yield email
+            finally:
+                audience_cur.close()
+                audience_conn.close()
+
+        # Tracking pixel, links and unsubscribe footer are located once per campaign
+        template = compile_email_html(html, campaign_id, BASE_URL)
+        register_campaign_links(cur, campaign_id, template.links)
+        conn.commit()
+
+        def send_one(email):
+            # Fill the recipient into the precompiled tracked HTML
+            prepared_html = template.render(email)
+
+            # Send email via SES
+            response = ses.send_email(
+                Source=sender,
+                Destination={"ToAddresses": [email]},
+                Message={
+                    "Subject": {"Data": subject},
+                    "Body": {
+                        "Html": {"Data": prepared_html}
+                    }
+                }
+            )
+            return response.get("MessageId")
+
+        writer = SendResultWriter(conn, campaign_id, job_id, shard, progress)
+
+        def send_batch(batch):
+            # One SendBulkTemplatedEmail call for up to 50 recipients; only the
+            # replacement data is uploaded per recipient
+            try:
+                response = ses.send_bulk_templated_email(
+                    Source=sender,
+                    Template=template_name,
+                    DefaultTemplateData=json.dumps({"email": "", "unsubscribe_token": "", "tracking_token": ""}),
+                    Destinations=[
+                        {
+                            "Destination": {"ToAddresses": [email]},
+                            "ReplacementTemplateData": json.dumps({
+                                "email": email,
+                                "unsubscribe_token": generate_unsubscribe_token(email, campaign_id),
+                                "tracking_token": encode_recipient_token(campaign_id, email)
+                            })
+                        }
+                        for email in batch
+                    ]
+                )
+                statuses = response.get("Status", [])
+            except Exception as e:
+                if is_throttling_error(e) or is_daily_quota_error(e):
+                    # SES is pushing back: let the engine back off and retry the batch
+                    return [(None, e)] * len(batch)
+                print(f"⚠️ Bulk send of {len(batch)} failed, falling back to single sends: {str(e)}")
+                statuses = []
+
+            results = []
+            for i, email in enumerate(batch):
+                status = statuses[i] if i < len(statuses) else {}
+                if status.get("Status") == "Success":
+                    results.append((status.get("MessageId"), None))
+                    continue
+
+                error = ClientError(
+                    {"Error": {"Code": status.get("Status"), "Message": status.get("Error") or ""}},
+                    "SendBulkTemplatedEmail"
+                )
+                if is_throttling_error(error) or is_daily_quota_error(error):
+                    # Retried (or deferred) by the engine, not resent one by one
+                    results.append((None, error))
+                    continue
+
+                # Destination failed (or the whole call did): send it on its own
+                try:
+                    results.append((send_one(email), None))
+                except Exception as e:
+                    results.append((None, e))
+            return results
+
+        def record_result(email, message_id, error):
+            if error is None:
+                print(f"✅ Sent to {email} (MessageId: {message_id})")
+                progress["sent"] += 1
+                writer.add(email, message_id, True, None)
+            else:
+                print(f"❌ Failed to send to {email}: {str(error)} ({type(error).__name__})")
+                progress["failed"] += 1
+                writer.add(email, None, False, "soft" if "bounce" in str(error).lower() else None)
+
+            completed.add(email)
+            while submitted and submitted[0] in completed:
+                completed.discard(submitted[0])
+                progress["last_email"] = submitted.popleft()
+
+            if writer.flush_if_due():
+                # Rebalance the shared SES rate as shards start and finish
+                engine.set_max_rate(limits["rate"] / max(1, count_running_shards(cur)))
+
+        template_name = None
+        if SEND_MODE == "bulk":
+            try:
+                template_name = register_campaign_template(ses, campaign_id, subject, html)
+                print(f"📄 Using SES template {template_name} ({BULK_BATCH_SIZE} recipients per call)")
+            except Exception as e:
+                print(f"⚠️ Could not register SES template, using single sends: {str(e)}")
+
+        # Concurrent send, paced by a token bucket at the account's MaxSendRate
+        engine = SendEngine(
+            send_batch if template_name else send_one,
+            rate=shard_rate,
+            max_sends=shard_quota,
+            batch_size=BULK_BATCH_SIZE if template_name else 1
+        )
+        passes = 0
+        while True:
+            passes += 1
+            submitted.clear()
+            completed.clear()
+            audience = pending_contacts(progress["last_email"])
+            try:
+                result = engine.run(audience, record_result)
+            finally:
+                audience.close()
+                # Emails already went out; get their rows committed even if the run failed
+                writer.flush()
+
+            if engine.max_sends is not None:
+                engine.max_sends = max(0, engine.max_sends - result["sent"] - result["failed"])
+
+            # Recipients deferred after repeated SES throttling are still
+            # missing from campaign_sends; another pass over the audience
+            # picks them up as long as the previous pass made progress
+            if not result["deferred"] or result["quota_exhausted"]:
+                break
+            if result["sent"] + result["failed"] == 0:
+                break
+            print(f"🔁 {result['deferred']} throttled recipients deferred, starting pass {passes + 1}")
+
+        if result["quota_exhausted"]:
+            status, error = "quota_exhausted", None
+        elif result["deferred"]:
+            status, error = "failed", f"SES kept throttling; {result['deferred']} recipients not sent"
+        else:
+            status, error = "completed", None
+        job_status = finish_shard(job_id, shard, status, error)
+
+        # Other shards share the template; drop it once the whole job is done.
+        # A quota-limited job is sent again later and still needs it.
+        if template_name and job_status == "completed":
+            try:
+                ses.delete_template(TemplateName=template_name)
+            except Exception as e:
+                print(f"⚠️ Could not delete SES template {template_name}: {str(e)}")
+
+        print(f"\n📊 CAMPAIGN SEND COMPLETE (job {job_id}, shard {shard + 1}/{shard_count}):")
+        print(f"   Sent: {progress['sent']}/{total}")
+        print(f"   Failed: {progress['failed']}/{total}")
+        print(f"   Throttled: {result['throttles']} times (final rate {result['final_rate']:.1f}/s)")
+        if result["quota_exhausted"]:
+            print(f"   ⚠️ Stopped early: 24h SES sending quota exhausted")
+        elif error:
+            print(f"   ⚠️ {error}")
+        print()
+
+        return {
+            "status": status,
+            "total_sent": progress["sent"],
+            "total_failed": progress["failed"],
+            "total_contacts": total
+        }
+    finally:
+        cur.close()
+        conn.close()
@@ -0,0 +1,180 @@
+"""
+Streaming CSV import into contacts.
+
+The CSV is read in chunks of IMPORT_CHUNK_ROWS; each chunk is loaded into a
+temporary staging table with COPY FROM STDIN, and the staging table is
+merged into contacts with one INSERT ... SELECT ... ON CONFLICT DO NOTHING.
+Memory use depends on the chunk size, not the file size, and the merge's
+row count gives exact inserted/skipped figures.
+
+Each chunk goes through contact_validation.validate_chunk() first, so only
+normalized, syntactically valid addresses are staged; rejected rows are
+counted by reason.
+
+Chunks are cut on line boundaries of the raw file, so each committed chunk
+ends at a known byte offset and an interrupted import (import_jobs.py) can
+resume from there.
+"""
+import csv
+import io
+import os
+import pandas as pd
+from contact_validation import validate_chunk
+from dotenv import load_dotenv
+
+load_dotenv()
+
+IMPORT_CHUNK_ROWS = int(os.getenv("IMPORT_CHUNK_ROWS", "50000"))
+
+CREATE_STAGING_SQL = """
+    CREATE TEMP TABLE IF NOT EXISTS contacts_import (
+        email TEXT,
+        name TEXT
+    ) ON COMMIT DELETE ROWS
+"""
+
+# Rows are validated and deduplicated before staging; the WHERE clause and
+# DISTINCT ON only guard the table constraints. Existing contacts match
+# regardless of case (idx_contacts_email_lower), so a lowercased import
+# doesn't add foo@x.com next to an older Foo@x.com.
+MERGE_STAGING_SQL = """
+    INSERT INTO contacts (email, name)
+    SELECT DISTINCT ON (lower(email)) email, left(name, 255)
+    FROM contacts_import i
+    WHERE email IS NOT NULL AND email <> '' AND length(email) <= 255
+    AND NOT EXISTS (SELECT 1 FROM contacts c WHERE lower(c.email) = lower(i.email))
+    ORDER BY lower(email), email
+    ON CONFLICT DO NOTHING
+"""
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+def read_header(fileobj) -> tuple:
+    """Column positions of (email, name) from the header line; name is None if absent"""
+    fileobj.seek(0)
+    line = fileobj.readline().decode("utf-8-sig", errors="replace")
+    if not line.strip():
+        return None
+    columns = [c.strip().lower() for c in next(csv.reader([line]))]
+    if "email" not in columns:
+        raise ImportFormatError("CSV must have an 'email' column")
+    return columns.index("email"), columns.index("name") if "name" in columns else None
+
+
+def _read_lines(fileobj, chunk_rows: int) -> bytes:
+    """Next chunk_rows CSV records as raw bytes, never splitting a quoted field"""
+    lines = []
+    quotes = 0
+    while len(lines) < chunk_rows or quotes % 2:
+        line = fileobj.readline()
+        if not line:
+            break
+        lines.append(line)
+        # Quotes inside fields are doubled, so an odd count means an open quoted field
+        quotes += line.count(b'"')
+    return b"".join(lines)
+
+
+def read_csv_chunks(fileobj, chunk_rows: int = IMPORT_CHUNK_ROWS, start_offset: int = 0):
+    """
+    Yield (DataFrame, end offset) per chunk of a binary CSV file object. The
+    DataFrames have 'email' and 'name' columns (strings, None when empty);
+    end offset is where the next chunk starts, pass it back as start_offset
+    to resume.
+    """
+    header = read_header(fileobj)
+    if header is None:
+        return
+    if start_offset:
+        fileobj.seek(start_offset)
+    email_index, name_index = header
+    usecols = [email_index] if name_index is None else [email_index, name_index]
+
+    while True:
+        data = _read_lines(fileobj, chunk_rows)
+        if not data:
+            return
+        offset = fileobj.tell()
+        try:
+            chunk = pd.read_csv(
+                io.BytesIO(data),
+                header=None,
+                usecols=usecols,
+                dtype=str,
+                keep_default_na=False,
+                na_values=[""],
+                encoding="utf-8",
+                encoding_errors="replace"
+            )
+        except pd.errors.EmptyDataError:
+            # Only blank lines
+            yield pd.DataFrame(columns=["email", "name"]), offset
+            continue
+        chunk = chunk.rename(columns={email_index: "email", name_index: "name"})
+        if name_index is None:
+            chunk["name"] = None
+        yield chunk[["email", "name"]], offset
+
+
+def copy_chunk(cur, chunk: pd.DataFrame):
+    """Load a chunk into the staging table"""
+    buffer = io.StringIO()
+    chunk.to_csv(buffer, header=False, index=False)
+    buffer.seek(0)
+    cur.copy_expert("COPY contacts_import (email, name) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def merge_staging(cur) -> int:
+    """Merge the staging table into contacts. Returns rows inserted (staging empties on commit)."""
+    cur.execute(MERGE_STAGING_SQL)
+    return cur.rowcount
+
+
+def import_contacts_csv(conn, fileobj, chunk_rows: int = IMPORT_CHUNK_ROWS,
+                        start_offset: int = 0, on_chunk=None) -> dict:
+    """
+    Import a binary CSV file object into contacts, one transaction per chunk.
+
+    Skipped rows are broken down by reason in result["rejections"]
+    (contact_validation.REASONS; "duplicate" also covers addresses already
+    in contacts).
+
+    on_chunk(cur, result) is called inside each chunk's transaction, just
+    before it commits, with the running totals (e.g. to record job progress
+    atomically with the rows). If it returns False the import stops after
+    that chunk and the result has stopped=True.
+    """
+    cur = conn.cursor()
+    result = {"inserted": 0, "skipped": 0, "total": 0, "rejections": {}, "offset": start_offset, "stopped": False}
+    rejections = result["rejections"]
+    try:
+        cur.execute(CREATE_STAGING_SQL)
+        for chunk, offset in read_csv_chunks(fileobj, chunk_rows, start_offset):
+            valid, rejected = validate_chunk(chunk)
+            inserted = 0
+            if len(valid):
+                copy_chunk(cur, valid)
+                inserted = merge_staging(cur)
+            rejected["duplicate"] = rejected.get("duplicate", 0) + len(valid) - inserted
+            for reason, count in rejected.items():
+                if count:
+                    rejections[reason] = rejections.get(reason, 0) + count
+            result["inserted"] += inserted
+            result["skipped"] += len(chunk) - inserted
+            result["total"] += len(chunk)
+            result["offset"] = offset
+            keep_going = on_chunk(cur, result) if on_chunk else True
+            conn.commit()
+            if keep_going is False:
+                result["stopped"] = True
+                break
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+    return result
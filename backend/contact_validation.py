@@ -0,0 +1,185 @@
+"""
+Email validation and normalization for contact imports.
+
+validate_chunk() works on a whole DataFrame chunk at once with pandas string
+operations: trims addresses, lowercases the domain (and by default the
+local part, which mailbox providers treat case-insensitively), checks
+syntax and length, and drops duplicates within the chunk. Rejected rows are
+counted by reason and never reach the contacts table, so they can't use up
+SES quota at send time.
+
+Internationalized addresses fail the ASCII pattern and are retried one by
+one through email-validator, which converts IDN domains to punycode.
+
+With IMPORT_CHECK_MX=true each distinct domain is also looked up in DNS
+(MX, falling back to A/AAAA) and the answer cached per process, so a file
+with a million gmail.com addresses costs one lookup.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import dns.exception
+import dns.resolver
+import numpy as np
+import pandas as pd
+from email_validator import validate_email, EmailNotValidError
+from dotenv import load_dotenv
+
+load_dotenv()
+
+IMPORT_LOWERCASE_EMAILS = os.getenv("IMPORT_LOWERCASE_EMAILS", "true").lower() == "true"
+IMPORT_CHECK_MX = os.getenv("IMPORT_CHECK_MX", "false").lower() == "true"
+IMPORT_MX_CACHE_SIZE = int(os.getenv("IMPORT_MX_CACHE_SIZE", "100000"))
+IMPORT_MX_CACHE_TTL = float(os.getenv("IMPORT_MX_CACHE_TTL", "86400"))
+IMPORT_MX_TIMEOUT = float(os.getenv("IMPORT_MX_TIMEOUT", "3"))
+IMPORT_MX_CONCURRENCY = int(os.getenv("IMPORT_MX_CONCURRENCY", "16"))
+
+# Dot-atom local part @ hostname with an alphabetic (or punycode) TLD
+_ATOM = r"[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+"
+_LABEL = r"[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?"
+EMAIL_PATTERN = rf"{_ATOM}(?:\.{_ATOM})*@(?:{_LABEL}\.)+(?:[A-Za-z]{{2,63}}|xn--[A-Za-z0-9-]{{1,59}})"
+
+MAX_EMAIL_LENGTH = 254
+MAX_LOCAL_LENGTH = 64
+
+# Rejection reasons, in the order they're checked
+REASONS = ("missing", "invalid_syntax", "too_long", "no_domain", "no_mx", "duplicate")
+
+
+def _resolve_domain(domain: str):
+    """Rejection reason for a domain, '' if it accepts mail, None if DNS didn't answer"""
+    resolver = dns.resolver.Resolver()
+    resolver.lifetime = IMPORT_MX_TIMEOUT
+    try:
+        answer = resolver.resolve(domain, "MX")
+        # A lone "0 ." record is a null MX: the domain accepts no mail (RFC 7505)
+        if all(str(record.exchange) == "." for record in answer):
+            return "no_mx"
+        return ""
+    except dns.resolver.NXDOMAIN:
+        return "no_domain"
+    except dns.resolver.NoAnswer:
+        pass
+    except (dns.exception.Timeout, dns.resolver.NoNameservers):
+        return None
+
+    # No MX: mail goes to the address records (RFC 5321 implicit MX)
+    for rdtype in ("A", "AAAA"):
+        try:
+            resolver.resolve(domain, rdtype)
+            return ""
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+            continue
+        except (dns.exception.Timeout, dns.resolver.NoNameservers):
+            return None
+    return "no_mx"
+
+
+class DomainCache:
+    """Thread-safe LRU of domain -> rejection reason ('' = deliverable) with a TTL"""
+
+    def __init__(self, max_size: int = IMPORT_MX_CACHE_SIZE, ttl: float = IMPORT_MX_CACHE_TTL,
+                 resolve=_resolve_domain):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.resolve = resolve
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, domains) -> dict:
+        """{domain: reason or ''} for the given domains, resolving uncached ones in parallel"""
+        now = time.monotonic()
+        results = {}
+        missing = []
+        with self._lock:
+            for domain in domains:
+                entry = self._entries.get(domain)
+                if entry is not None and entry[0] > now:
+                    self._entries.move_to_end(domain)
+                    results[domain] = entry[1]
+                    self.hits += 1
+                else:
+                    missing.append(domain)
+            self.misses += len(missing)
+
+        if missing:
+            with ThreadPoolExecutor(max_workers=max(1, min(IMPORT_MX_CONCURRENCY, len(missing)))) as pool:
+                resolved = dict(zip(missing, pool.map(self.resolve, missing)))
+            with self._lock:
+                for domain, reason in resolved.items():
+                    if reason is None:
+                        # DNS failure: accept the address, and ask again next time
+                        results[domain] = ""
+                        continue
+                    results[domain] = reason
+                    self._entries[domain] = (now + self.ttl, reason)
+                    self._entries.move_to_end(domain)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return results
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"domains": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+domain_cache = DomainCache()
+
+
+def _normalize_unicode(email: str):
+    """ASCII form of an internationalized address, or None if it can't be sent"""
+    try:
+        return validate_email(email, check_deliverability=False).ascii_email
+    except EmailNotValidError:
+        return None
+
+
+def validate_chunk(chunk: pd.DataFrame, check_mx: bool = IMPORT_CHECK_MX,
+                   lowercase: bool = IMPORT_LOWERCASE_EMAILS) -> tuple[pd.DataFrame, dict]:
+    """
+    Validate and normalize a chunk's 'email' column. Returns (valid rows with
+    normalized emails, {reason: count} for the rejected ones).
+    """
+    if chunk.empty:
+        # A chunk of blank lines
+        return chunk.iloc[0:0], {}
+
+    emails = chunk["email"].astype(object).where(chunk["email"].notna(), "").astype(str).str.strip()
+    missing = emails == ""
+    syntax_ok = emails.str.fullmatch(EMAIL_PATTERN, na=False)
+
+    # Rare non-ASCII addresses go through email-validator individually
+    retry = ~missing & ~syntax_ok & emails.str.contains(r"[^\x00-\x7f]", regex=True, na=False)
+    if retry.any():
+        converted = emails[retry].map(_normalize_unicode)
+        emails = emails.where(~retry | converted.isna(), converted)
+        syntax_ok = syntax_ok | (retry & converted.notna())
+
+    parts = emails.str.rpartition("@")
+    local = parts[0].str.lower() if lowercase else parts[0]
+    domain = parts[2].str.lower()
+    emails = local + "@" + domain
+    too_long = (emails.str.len() > MAX_EMAIL_LENGTH) | (local.str.len() > MAX_LOCAL_LENGTH)
+
+    reason = pd.Series(
+        np.select([missing, ~syntax_ok, too_long], ["missing", "invalid_syntax", "too_long"], default=""),
+        index=chunk.index
+    )
+
+    if check_mx:
+        ok = reason == ""
+        domain_reasons = domain_cache.lookup(domain[ok].unique())
+        reason = reason.where(~ok, domain.map(domain_reasons).fillna(""))
+
+    ok = reason == ""
+    duplicate = ok & emails.where(ok).duplicated()
+    reason = reason.mask(duplicate, "duplicate")
+    ok = ok & ~duplicate
+
+    valid = chunk.loc[ok].assign(email=emails[ok])
+    rejected = {name: int(count) for name, count in reason[~ok].value_counts().items()}
+    return valid, rejected
@@ -1,14 +1,61 @@
 import os
+import threading
+from contextlib import contextmanager
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 from dotenv import load_dotenv
 
 load_dotenv()
 
-def get_db():
-    return psycopg2.connect(
+# Connections kept open for short lookups on the request path (pooled_db)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+
+def _connect_params():
+    return dict(
         host=os.getenv("DB_HOST", "localhost"),
         database=os.getenv("DB_NAME", "email_system"),
         user=os.getenv("DB_USER", "postgres"),
         password=os.getenv("DB_PASSWORD", "changeme"),
         port=os.getenv("DB_PORT", "5432")
     )
+
+def get_db():
+    return psycopg2.connect(**_connect_params())
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadedConnectionPool(0, DB_POOL_SIZE, **_connect_params())
+        return _pool
+
+@contextmanager
+def pooled_db():
+    """A pooled connection for short queries; falls back to a new connection when the pool is busy"""
+    pool = _get_pool()
+    try:
+        conn = pool.getconn()
+    except PoolError:
+        conn = None
+
+    if conn is None:
+        conn = get_db()
+        try:
+            yield conn
+        finally:
+            conn.close()
+        return
+
+    broken = False
+    try:
+        yield conn
+        conn.rollback()
+    except Exception:
+        broken = True
+        raise
+    finally:
+        pool.putconn(conn, close=broken or conn.closed != 0)
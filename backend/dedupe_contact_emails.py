@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Migration: Merge contacts whose emails differ only by case
+
+Imports lowercase addresses, and contacts are now unique on lower(email).
+Contacts created before that can exist twice (Foo@x.com and foo@x.com),
+and both would receive every campaign. For each such group this keeps one
+contact (the lowercase one if it exists, else the oldest), moves the
+others' sends, events and unsubscribe tokens to it, carries over an
+unsubscribe, deletes the others and then creates the unique index.
+
+Stats counters are not rebuilt, so sends dropped as duplicates of the kept
+contact's sends remain counted. Safe to run more than once.
+"""
+import os
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_NAME = os.getenv("DB_NAME", "email_system")
+DB_USER = os.getenv("DB_USER", "postgres")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "changeme")
+DB_PORT = os.getenv("DB_PORT", "5432")
+
+print(f"🔧 Database Migration: Merge contacts that differ only by email case")
+print(f"📌 Connecting to {DB_USER}@{DB_HOST}:{DB_PORT}/{DB_NAME}...")
+
+try:
+    conn = psycopg2.connect(
+        host=DB_HOST,
+        database=DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        port=DB_PORT
+    )
+    print("✅ Connected!\n")
+
+    cur = conn.cursor()
+
+    # Step 1: Each duplicate and the contact it's merged into
+    print("⏳ Step 1: Finding case duplicates...")
+    cur.execute("""
+        CREATE TEMP TABLE contact_dupes ON COMMIT DROP AS
+        SELECT email, keeper FROM (
+            SELECT email,
+                   FIRST_VALUE(email) OVER (
+                       PARTITION BY lower(email) ORDER BY email <> lower(email), created_at, email
+                   ) AS keeper,
+                   COUNT(*) OVER (PARTITION BY lower(email)) AS copies
+            FROM contacts
+        ) c
+        WHERE copies > 1 AND email <> keeper
+    """)
+    cur.execute("SELECT COUNT(*), COUNT(DISTINCT keeper) FROM contact_dupes")
+    dupes, keepers = cur.fetchone()
+    print(f"   ✅ {dupes} duplicates of {keepers} contacts")
+
+    # Step 2: Keep unsubscribes and names
+    print("\n⏳ Step 2: Carrying over unsubscribes and names...")
+    cur.execute("""
+        UPDATE contacts k
+        SET unsubscribed = k.unsubscribed OR m.unsubscribed,
+            name = COALESCE(k.name, m.name),
+            updated_at = CURRENT_TIMESTAMP
+        FROM (
+            SELECT d.keeper, bool_or(c.unsubscribed) AS unsubscribed, MIN(c.name) AS name
+            FROM contact_dupes d JOIN contacts c ON c.email = d.email
+            GROUP BY d.keeper
+        ) m
+        WHERE k.email = m.keeper
+    """)
+    print("   ✅ Done")
+
+    # Step 3: Move sends (one per campaign; the rest go with the duplicate), events and tokens
+    print("\n⏳ Step 3: Moving sends, events and unsubscribe tokens...")
+    cur.execute("""
+        UPDATE campaign_sends s SET contact_email = d.keeper
+        FROM contact_dupes d
+        WHERE s.contact_email = d.email
+        AND NOT EXISTS (
+            SELECT 1 FROM campaign_sends k WHERE k.campaign_id = s.campaign_id AND k.contact_email = d.keeper
+        )
+        AND s.id = (
+            SELECT MIN(o.id) FROM campaign_sends o JOIN contact_dupes od ON od.email = o.contact_email
+            WHERE od.keeper = d.keeper AND o.campaign_id = s.campaign_id
+        )
+    """)
+    sends = cur.rowcount
+    cur.execute("UPDATE events e SET contact_email = d.keeper FROM contact_dupes d WHERE e.contact_email = d.email")
+    events = cur.rowcount
+    cur.execute("""
+        UPDATE unsubscribe_tokens t SET contact_email = d.keeper
+        FROM contact_dupes d WHERE t.contact_email = d.email
+    """)
+    print(f"   ✅ {sends} sends, {events} events moved")
+
+    # Step 4: Drop the duplicates and enforce uniqueness from now on
+    print("\n⏳ Step 4: Deleting duplicates and creating the unique index...")
+    cur.execute("DELETE FROM contacts WHERE email IN (SELECT email FROM contact_dupes)")
+    deleted = cur.rowcount
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_contacts_email_lower ON contacts (lower(email))")
+    print(f"   ✅ {deleted} duplicates deleted")
+
+    conn.commit()
+    cur.close()
+    conn.close()
+
+    print("\n🎉 Migration complete!")
+    print("📝 Next steps:")
+    print("   1. Restart the backend\n")
+
+except psycopg2.OperationalError as e:
+    print(f"❌ Database connection failed: {e}")
+    exit(1)
+except Exception as e:
+    print(f"❌ Migration failed: {e}")
+    import traceback
+    traceback.print_exc()
+    exit(1)
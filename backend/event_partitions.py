@@ -0,0 +1,184 @@
+"""
+Monthly partitions of the events table.
+
+events is range-partitioned on created_at (see schema.sql). This module
+creates the upcoming monthly partitions and applies the retention policy,
+detaching or dropping partitions older than EVENT_RETENTION_MONTHS. It runs
+at API startup and then every EVENT_PARTITION_INTERVAL_HOURS in each API
+process (PartitionMaintainer), so a long-running process never outlives the
+partitions created ahead and starts filling events_default. Deployments
+without a long-running API process can run it from cron instead:
+
+    python event_partitions.py
+"""
+import os
+import re
+import threading
+from datetime import date
+from database import get_db
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Months of partitions created ahead of the current one
+EVENT_PARTITION_MONTHS_AHEAD = int(os.getenv("EVENT_PARTITION_MONTHS_AHEAD", "3"))
+
+# Months of events kept, counting the current month (0 = keep everything)
+EVENT_RETENTION_MONTHS = int(os.getenv("EVENT_RETENTION_MONTHS", "0"))
+
+# 'detach' keeps expired partitions as standalone tables (to archive and drop
+# by hand), 'drop' deletes them
+EVENT_RETENTION_MODE = os.getenv("EVENT_RETENTION_MODE", "detach")
+
+# How often each API process re-runs maintain_partitions() (0 = startup only)
+EVENT_PARTITION_INTERVAL_HOURS = float(os.getenv("EVENT_PARTITION_INTERVAL_HOURS", "24"))
+
+PARTITION_NAME = re.compile(r"^events_(\d{4})_(\d{2})$")
+
+
+def _add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _partition_name(month: date) -> str:
+    return f"events_{month.year:04d}_{month.month:02d}"
+
+
+def _is_partitioned(cur) -> bool:
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('events')")
+    row = cur.fetchone()
+    return row is not None and row[0] == "p"
+
+
+def list_partitions(cur) -> list:
+    """Monthly partitions as (name, first day of month), oldest first"""
+    cur.execute("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'events'::regclass
+    """)
+    partitions = []
+    for (name,) in cur.fetchall():
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions.append((name, date(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def _create_partition(cur, name: str, start: date, end: date):
+    # Rows that landed in the default partition while this month had no
+    # partition would block CREATE ... PARTITION OF; move them over
+    cur.execute("SELECT EXISTS (SELECT 1 FROM events_default WHERE created_at >= %s AND created_at < %s)", (start, end))
+    stranded = cur.fetchone()[0]
+    if stranded:
+        cur.execute(
+            "CREATE TEMP TABLE events_stranded ON COMMIT DROP AS "
+            "SELECT * FROM events_default WHERE created_at >= %s AND created_at < %s",
+            (start, end)
+        )
+        cur.execute("DELETE FROM events_default WHERE created_at >= %s AND created_at < %s", (start, end))
+
+    cur.execute(f"CREATE TABLE {name} PARTITION OF events FOR VALUES FROM (%s) TO (%s)", (start, end))
+
+    if stranded:
+        cur.execute("INSERT INTO events SELECT * FROM events_stranded")
+        cur.execute("DROP TABLE events_stranded")
+
+
+def ensure_partitions(cur, start: date = None, months_ahead: int = EVENT_PARTITION_MONTHS_AHEAD) -> list:
+    """Create the default partition and monthly partitions from start up to months_ahead. Returns names created."""
+    if not _is_partitioned(cur):
+        print("⚠️ events is not partitioned yet, run partition_events.py")
+        return []
+
+    # One process at a time (every API process runs this at startup)
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext('event_partitions'))")
+    cur.execute("CREATE TABLE IF NOT EXISTS events_default PARTITION OF events DEFAULT")
+
+    existing = {name for name, _ in list_partitions(cur)}
+    current = date.today().replace(day=1)
+    month = (start or current).replace(day=1)
+    created = []
+    while month <= _add_months(current, months_ahead):
+        name = _partition_name(month)
+        if name not in existing:
+            _create_partition(cur, name, month, _add_months(month, 1))
+            created.append(name)
+        month = _add_months(month, 1)
+    return created
+
+
+def apply_retention(cur, keep_months: int = EVENT_RETENTION_MONTHS, mode: str = EVENT_RETENTION_MODE) -> list:
+    """Detach or drop partitions entirely older than keep_months. Returns names removed."""
+    if keep_months <= 0 or not _is_partitioned(cur):
+        return []
+
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext('event_partitions'))")
+    cutoff = _add_months(date.today().replace(day=1), -(keep_months - 1))
+    removed = []
+    for name, month in list_partitions(cur):
+        if month >= cutoff:
+            break
+        if mode == "drop":
+            cur.execute(f"DROP TABLE {name}")
+        else:
+            cur.execute(f"ALTER TABLE events DETACH PARTITION {name}")
+        removed.append(name)
+    return removed
+
+
+def maintain_partitions() -> dict:
+    """Create upcoming partitions and apply retention in one transaction"""
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        created = ensure_partitions(cur)
+        removed = apply_retention(cur)
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+
+    if created:
+        print(f"🗂️ Created event partitions: {', '.join(created)}")
+    if removed:
+        action = "Dropped" if EVENT_RETENTION_MODE == "drop" else "Detached"
+        print(f"🧹 {action} expired event partitions: {', '.join(removed)}")
+    return {"created": created, "removed": removed}
+
+
+class PartitionMaintainer:
+    """Background thread that runs maintain_partitions() every interval"""
+
+    def __init__(self, interval_hours: float = EVENT_PARTITION_INTERVAL_HOURS):
+        self.interval = interval_hours * 3600
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="event-partitions", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        # The startup run happens in the lifespan, before events are written
+        while not self._stop.wait(self.interval):
+            try:
+                maintain_partitions()
+            except Exception as e:
+                print(f"⚠️ Event partition maintenance failed: {e}")
+
+
+partition_maintainer = PartitionMaintainer()
+
+
+if __name__ == "__main__":
+    maintain_partitions()
@@ -0,0 +1,449 @@
+"""
+Buffered ingestion of tracking events.
+
+Tracking hits are put on a bounded in-process queue and a background
+thread writes them to the events table in batches (one multi-row INSERT
+per batch over a persistent connection), so the pixel and redirect
+responses never wait on Postgres. Repeat opens only bump a per-recipient
+counter, which is summed in memory and applied with each flush.
+
+Events the database can't take (write errors, or a full queue) go to the
+on-disk spool (event_spool.py) and are replayed by the same thread once
+writes succeed again. A spooled chunk the database rejects is replayed in
+halves until the bad records are isolated; those are quarantined so they
+can't hold up the rest of the spool.
+
+Openers and clickers are also added to in-memory HyperLogLog sketches (per
+campaign and per hour), merged into campaign_sketches every
+EVENT_SKETCH_FLUSH_SECONDS.
+"""
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+import psycopg2
+from psycopg2.extras import execute_values
+from database import get_db
+from event_spool import EventSpool
+from stats_cache import notify_stats_changed
+from stats_rollup import add_counts, add_bucket_counts, merge_sketches
+from hll import HyperLogLog
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Flush when this many events are buffered, or after this many milliseconds
+EVENT_BATCH_SIZE = int(os.getenv("EVENT_BATCH_SIZE", "500"))
+EVENT_FLUSH_INTERVAL_MS = int(os.getenv("EVENT_FLUSH_INTERVAL_MS", "200"))
+
+# Events held in memory at most; beyond this new events are spooled to disk
+# (or dropped, with the spool disabled)
+EVENT_QUEUE_MAX = int(os.getenv("EVENT_QUEUE_MAX", "100000"))
+
+EVENT_SPOOL_ENABLED = os.getenv("EVENT_SPOOL_ENABLED", "true").lower() == "true"
+
+# After a failed write, batches go straight to the spool for this long
+# before the database is tried again
+EVENT_DB_RETRY_SECONDS = float(os.getenv("EVENT_DB_RETRY_SECONDS", "5"))
+
+# Errors caused by the rows in a batch rather than by the database being
+# unavailable (psycopg2 raises ValueError for strings with NUL characters)
+ROW_ERRORS = (ValueError, psycopg2.DataError, psycopg2.IntegrityError)
+
+# Keep a per-recipient count of every open in campaign_sends.open_count
+TRACK_OPEN_COUNTS = os.getenv("TRACK_OPEN_COUNTS", "true").lower() == "true"
+
+# Rows for unknown contacts/campaigns (forged or stale tracking links) are
+# filtered out in SQL instead of failing the whole batch on the foreign keys.
+# Only the first open per recipient is kept: the in-memory filter catches
+# nearly all repeats, this catches the rest (restarts, other API processes).
+# Returns, per campaign and per (campaign, minute), the recipients opening or
+# clicking for the first time and the clicks recorded (for campaign_stats and
+# campaign_stats_buckets); minute is NULL on the per-campaign rows.
+INSERT_EVENTS_SQL = """
+    WITH fresh AS (
+        SELECT v.*, NOT EXISTS (
+            SELECT 1 FROM events e
+            WHERE e.campaign_id = v.campaign_id AND e.contact_email = v.contact_email
+            AND e.event_type = v.event_type
+        ) AS first_of_kind
+        FROM (VALUES %s) AS v(campaign_id, contact_email, event_type, metadata, created_at)
+        WHERE EXISTS (SELECT 1 FROM contacts c WHERE c.email = v.contact_email)
+        AND EXISTS (SELECT 1 FROM campaigns ca WHERE ca.id = v.campaign_id)
+    ), inserted AS (
+        INSERT INTO events (campaign_id, contact_email, event_type, metadata, created_at)
+        SELECT campaign_id, contact_email, event_type, metadata, created_at FROM fresh
+        WHERE event_type <> 'open' OR first_of_kind
+    )
+    SELECT campaign_id,
+           CASE WHEN GROUPING(date_trunc('minute', created_at)) = 0 THEN date_trunc('minute', created_at) END,
+           COUNT(DISTINCT contact_email) FILTER (WHERE event_type = 'open' AND first_of_kind),
+           COUNT(DISTINCT contact_email) FILTER (WHERE event_type = 'click' AND first_of_kind),
+           COUNT(*) FILTER (WHERE event_type = 'click')
+    FROM fresh
+    GROUP BY GROUPING SETS ((campaign_id), (campaign_id, date_trunc('minute', created_at)))
+"""
+# created_at is the enqueue time as epoch seconds (so spooled events keep
+# theirs), converted by Postgres to local time like the CURRENT_TIMESTAMP and
+# LOCALTIMESTAMP stamps everywhere else: minute buckets, stats ranges and
+# partition routing all use the database's clock.
+INSERT_EVENTS_TEMPLATE = "(%s::integer, %s, %s, %s::jsonb, to_timestamp(%s)::timestamp)"
+
+# Approximate distinct openers/clickers (see hll.py), merged into the DB this often
+EVENT_SKETCHES_ENABLED = os.getenv("EVENT_SKETCHES_ENABLED", "true").lower() == "true"
+EVENT_SKETCH_FLUSH_SECONDS = float(os.getenv("EVENT_SKETCH_FLUSH_SECONDS", "10"))
+
+UPDATE_OPEN_COUNTS_SQL = """
+    UPDATE campaign_sends s SET open_count = s.open_count + v.opens
+    FROM (VALUES %s) AS v(campaign_id, contact_email, opens)
+    WHERE s.campaign_id = v.campaign_id AND s.contact_email = v.contact_email
+"""
+UPDATE_OPEN_COUNTS_TEMPLATE = "(%s::integer, %s, %s::integer)"
+
+# Limits of the events columns. One value Postgres rejects fails the whole
+# multi-row INSERT, so rows are checked before they're batched.
+MAX_CAMPAIGN_ID = 2 ** 31 - 1  # campaign_id INTEGER
+MAX_EMAIL_LENGTH = 255  # contact_email VARCHAR(255)
+
+
+def valid_event(campaign_id, contact_email) -> bool:
+    """Whether campaign_id and contact_email fit the events columns (text can't hold NUL)"""
+    return (
+        isinstance(campaign_id, int) and 0 < campaign_id <= MAX_CAMPAIGN_ID
+        and isinstance(contact_email, str) and 0 < len(contact_email) <= MAX_EMAIL_LENGTH
+        and "\x00" not in contact_email
+    )
+
+
+class EventBuffer:
+    def __init__(self, batch_size: int = EVENT_BATCH_SIZE,
+                 flush_interval_ms: int = EVENT_FLUSH_INTERVAL_MS,
+                 max_size: int = EVENT_QUEUE_MAX,
+                 spool: EventSpool = None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_size = max_size
+        self.queue = queue.Queue(maxsize=max_size)
+        self._open_counts = {}
+        self._counts_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._conn = None
+        self.spool = spool
+        # Events and open counts that didn't fit in memory, spooled by the writer
+        # thread so request handlers never wait on disk
+        self._overflow_events = []
+        self._overflow_counts = []
+        self._overflow_lock = threading.Lock()
+        self._retry_at = 0.0
+        # Offset of the database's local time from UTC, for the sketches' hour buckets
+        self._utc_offset = 0.0
+        # (campaign_id, event_type, hour or None) -> HyperLogLog, only touched by the writer thread
+        self._sketches = {}
+        self._sketch_flush_at = time.monotonic() + EVENT_SKETCH_FLUSH_SECONDS
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="event-buffer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Stop the flusher after writing everything still queued"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+        if self.spool is not None:
+            self.spool.close()
+
+    def enqueue(self, campaign_id: int, contact_email: str, event_type: str, metadata: dict = None) -> bool:
+        """Queue an event without blocking. Returns False if it was invalid or had to be dropped."""
+        metadata = json.dumps(metadata) if metadata else None
+        # jsonb rejects \u0000 as well
+        if not valid_event(campaign_id, contact_email) or (metadata and "\\u0000" in metadata):
+            self.rejected += 1
+            return False
+        row = (
+            campaign_id,
+            contact_email,
+            event_type,
+            metadata,
+            time.time()
+        )
+        try:
+            self.queue.put_nowait(row)
+            return True
+        except queue.Full:
+            return self._overflow([row], [])
+
+    def count_open(self, campaign_id: int, contact_email: str):
+        """Add one to the recipient's open counter (applied with the next flush)"""
+        if not TRACK_OPEN_COUNTS or not valid_event(campaign_id, contact_email):
+            return
+        key = (campaign_id, contact_email)
+        with self._counts_lock:
+            if key not in self._open_counts and len(self._open_counts) >= self.max_size:
+                self._overflow([], [(campaign_id, contact_email, 1)])
+                return
+            self._open_counts[key] = self._open_counts.get(key, 0) + 1
+
+    def _overflow(self, events: list, counts: list) -> bool:
+        """Hand rows to the writer thread for spooling. Returns False if they had to be dropped."""
+        with self._overflow_lock:
+            if self.spool is None or len(self._overflow_events) + len(self._overflow_counts) >= self.max_size:
+                self.dropped += len(events) + len(counts)
+                return False
+            self._overflow_events.extend(events)
+            self._overflow_counts.extend(counts)
+            return True
+
+    def _take_overflow(self) -> tuple:
+        with self._overflow_lock:
+            events, self._overflow_events = self._overflow_events, []
+            counts, self._overflow_counts = self._overflow_counts, []
+        return events, counts
+
+    def _take_open_counts(self) -> list:
+        with self._counts_lock:
+            counts, self._open_counts = self._open_counts, {}
+        # Sorted so concurrent writers lock campaign_sends rows in the same order
+        return sorted((campaign_id, email, n) for (campaign_id, email), n in counts.items())
+
+    def _collect(self) -> list:
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while (not self._stop.is_set() or not self.queue.empty() or self._open_counts
+               or self._overflow_events or self._overflow_counts):
+            overflow_events, overflow_counts = self._take_overflow()
+            if overflow_events or overflow_counts:
+                self._spool(overflow_events, overflow_counts)
+            batch = self._collect()
+            counts = self._take_open_counts()
+            db_down = time.monotonic() < self._retry_at
+            if batch or counts:
+                if db_down and self.spool is not None:
+                    self._spool(batch, counts)
+                else:
+                    self._write(batch, counts)
+            if self.spool is not None and time.monotonic() >= self._retry_at and not self._stop.is_set():
+                # One spool chunk per round, so live events keep flowing during a long replay
+                self._replay_spool()
+            if self._sketches and time.monotonic() >= self._sketch_flush_at:
+                self._flush_sketches()
+        if self._sketches:
+            self._flush_sketches()
+
+    def _execute(self, batch: list, counts: list):
+        try:
+            cur = self._connect().cursor()
+            if batch:
+                firsts = execute_values(cur, INSERT_EVENTS_SQL, batch, template=INSERT_EVENTS_TEMPLATE,
+                                        page_size=len(batch), fetch=True)
+                add_counts(cur, {
+                    campaign_id: {"unique_opens": opens, "unique_clicks": unique_clicks}
+                    for campaign_id, minute, opens, unique_clicks, _ in firsts if minute is None
+                })
+                add_bucket_counts(cur, {
+                    (campaign_id, minute): {"opens": opens, "clicks": clicks}
+                    for campaign_id, minute, opens, _, clicks in firsts if minute is not None
+                })
+                for campaign_id in {row[0] for row in batch}:
+                    notify_stats_changed(cur, campaign_id)
+            if counts:
+                execute_values(cur, UPDATE_OPEN_COUNTS_SQL, counts,
+                               template=UPDATE_OPEN_COUNTS_TEMPLATE, page_size=len(counts))
+            self._conn.commit()
+            cur.close()
+        except ROW_ERRORS:
+            # The connection is fine, so don't hold writes back
+            try:
+                self._conn.rollback()
+            except Exception:
+                self._reset_connection()
+            raise
+        except Exception:
+            self._reset_connection()
+            raise
+        if EVENT_SKETCHES_ENABLED:
+            self._add_to_sketches(batch)
+
+    def _connect(self):
+        if self._conn is None or self._conn.closed:
+            self._conn = get_db()
+            cur = self._conn.cursor()
+            self._read_utc_offset(cur)
+            cur.close()
+        return self._conn
+
+    def _read_utc_offset(self, cur):
+        cur.execute("SELECT EXTRACT(TIMEZONE FROM NOW())")
+        self._utc_offset = float(cur.fetchone()[0])
+
+    def _reset_connection(self):
+        try:
+            self._conn.close()
+        except Exception:
+            pass
+        self._conn = None
+        self._retry_at = time.monotonic() + EVENT_DB_RETRY_SECONDS
+
+    def _add_to_sketches(self, batch: list):
+        for campaign_id, email, event_type, _, created_at in batch:
+            if event_type not in ("open", "click"):
+                continue
+            # Same local hour as date_trunc('hour', created_at) in the database
+            local = datetime.fromtimestamp(created_at + self._utc_offset, timezone.utc)
+            hour = local.replace(minute=0, second=0, microsecond=0, tzinfo=None)
+            for bucket in (None, hour):
+                key = (campaign_id, event_type, bucket)
+                sketch = self._sketches.get(key)
+                if sketch is None:
+                    sketch = self._sketches[key] = HyperLogLog()
+                sketch.add(email)
+
+    def _flush_sketches(self):
+        self._sketch_flush_at = time.monotonic() + EVENT_SKETCH_FLUSH_SECONDS
+        if time.monotonic() < self._retry_at:
+            return
+        try:
+            cur = self._connect().cursor()
+            merge_sketches(cur, self._sketches)
+            for campaign_id in {key[0] for key in self._sketches}:
+                notify_stats_changed(cur, campaign_id)
+            # Read again each flush to follow DST changes
+            self._read_utc_offset(cur)
+            self._conn.commit()
+            cur.close()
+            self._sketches = {}
+        except Exception as e:
+            # Kept in memory and merged on the next flush (merging is idempotent)
+            print(f"Error writing {len(self._sketches)} event sketches: {e}")
+            self._reset_connection()
+
+    def _write(self, batch: list, counts: list = None):
+        counts = counts or []
+        try:
+            self._execute(batch, counts)
+            self.written += len(batch)
+        except Exception as e:
+            print(f"Error writing {len(batch)} tracking events: {e}")
+            if not self._spool(batch, counts):
+                self.failed += len(batch)
+
+    def _spool(self, batch: list, counts: list) -> bool:
+        """Append rows to the disk spool. Returns False if they had to be dropped."""
+        if self.spool is None:
+            self.dropped += len(batch) + len(counts)
+            return False
+        records = [["e", c, e, t, m, at] for c, e, t, m, at in batch]
+        records += [["c", c, e, n] for c, e, n in counts]
+        try:
+            self.spool.append(records)
+            return True
+        except Exception as e:
+            print(f"Error spooling {len(records)} tracking events: {e}")
+            self.dropped += len(records)
+            return False
+
+    def _replay_spool(self):
+        if not self.spool.has_pending():
+            return
+        try:
+            chunk = self.spool.read_chunk(self.batch_size)
+        except Exception as e:
+            print(f"Error reading event spool: {e}")
+            return
+        if chunk is None:
+            return
+
+        path, end, records, finished = chunk
+        batch, counts = self._from_records(records)
+        try:
+            if batch or counts:
+                self._execute(batch, counts)
+            self.written += len(batch)
+        except ROW_ERRORS as e:
+            print(f"⚠️ Database rejected {len(records)} spooled tracking events ({e}), isolating the bad ones")
+            if not self._replay_isolating(records):
+                return
+        except Exception as e:
+            print(f"Error replaying {len(records)} spooled tracking events: {e}")
+            return
+        self.spool.commit(path, end, finished, len(records))
+
+    @staticmethod
+    def _from_records(records: list) -> tuple:
+        batch = [tuple(r[1:]) for r in records if r[0] == "e"]
+        counts = sorted(tuple(r[1:]) for r in records if r[0] == "c")
+        return batch, counts
+
+    def _replay_isolating(self, records: list) -> bool:
+        """
+        Replay records in ever smaller parts, quarantining single records the
+        database rejects. Returns False if the chunk has to be replayed again.
+        """
+        pending = [records]
+        while pending:
+            part = pending.pop()
+            batch, counts = self._from_records(part)
+            try:
+                self._execute(batch, counts)
+                self.written += len(batch)
+            except ROW_ERRORS as e:
+                if len(part) == 1:
+                    self.spool.quarantine(part[0], str(e))
+                else:
+                    half = len(part) // 2
+                    pending += [part[half:], part[:half]]
+            except Exception as e:
+                # Database gone mid-way: re-spool what's left so the parts
+                # already written aren't replayed twice
+                print(f"Error replaying spooled tracking events: {e}")
+                rest = [r for p in [part] + pending[::-1] for r in p]
+                try:
+                    self.spool.append(rest)
+                except Exception as spool_error:
+                    print(f"Error spooling {len(rest)} tracking events: {spool_error}")
+                    return False
+                return True
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue.qsize(),
+            "pending_open_counts": len(self._open_counts),
+            "overflow": len(self._overflow_events) + len(self._overflow_counts),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "pending_sketches": len(self._sketches),
+            "spool": self.spool.stats() if self.spool is not None else None
+        }
+
+
+event_buffer = EventBuffer(spool=EventSpool() if EVENT_SPOOL_ENABLED else None)
@@ -0,0 +1,302 @@
+"""
+Local append-only spool for tracking events the database can't take.
+
+When the events insert fails (Postgres down or slow) or the in-memory
+queue is full, EventBuffer appends the rows here instead of dropping them,
+and replays them into Postgres once writes succeed again.
+
+The spool is a directory of segment files. Each record is
+    length (4 bytes, little endian) | crc32 (4 bytes) | JSON payload
+so segments can be read sequentially through mmap, and a record torn by a
+crash is detected by its length or checksum. Segments are sealed once they
+reach EVENT_SPOOL_SEGMENT_BYTES (or when replay starts on them); replay
+progress is kept in a .offset file next to the segment, and the segment is
+deleted once it's fully replayed.
+
+Records the database rejects on replay are moved to quarantine.jsonl in
+EVENT_SPOOL_DIR (one JSON line each, with the error) for inspection.
+
+Every process spools into its own subdirectory (host-pid) of
+EVENT_SPOOL_DIR and holds an flock on its .lock file while it runs, so API
+processes sharing the directory never append to or replay the same
+segment. Once its own spool is empty, a process adopts the spool of one
+that exited (its .lock is free again), replays it and removes it.
+"""
+import glob
+import json
+import mmap
+import os
+import shutil
+import socket
+import struct
+import threading
+import time
+import zlib
+from dotenv import load_dotenv
+
+try:
+    import fcntl
+except ImportError:  # Windows: no locking, spools of exited processes aren't adopted
+    fcntl = None
+
+load_dotenv()
+
+EVENT_SPOOL_DIR = os.getenv("EVENT_SPOOL_DIR", os.path.join(os.path.dirname(__file__), "spool", "events"))
+EVENT_SPOOL_SEGMENT_BYTES = int(os.getenv("EVENT_SPOOL_SEGMENT_BYTES", str(16 * 1024 * 1024)))
+
+# 'always': fsync after every append, 'interval': at most every
+# EVENT_SPOOL_FSYNC_INTERVAL_MS, 'off': leave it to the OS
+EVENT_SPOOL_FSYNC = os.getenv("EVENT_SPOOL_FSYNC", "interval")
+EVENT_SPOOL_FSYNC_INTERVAL_MS = int(os.getenv("EVENT_SPOOL_FSYNC_INTERVAL_MS", "1000"))
+
+# How often a process with an empty spool looks for spools left by exited processes
+EVENT_SPOOL_ORPHAN_SCAN_SECONDS = 30
+
+HEADER = struct.Struct("<II")
+
+
+def encode_record(record) -> bytes:
+    payload = json.dumps(record, separators=(",", ":"), default=str).encode()
+    return HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def decode_records(data, offset: int, max_records: int):
+    """Decode up to max_records starting at offset. Returns (records, end offset, torn)."""
+    records = []
+    size = len(data)
+    while len(records) < max_records and offset < size:
+        if offset + HEADER.size > size:
+            return records, offset, True
+        length, crc = HEADER.unpack_from(data, offset)
+        start = offset + HEADER.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            return records, offset, True
+        records.append(json.loads(payload))
+        offset = start + length
+    return records, offset, False
+
+
+class EventSpool:
+    def __init__(self, directory: str = EVENT_SPOOL_DIR,
+                 segment_bytes: int = EVENT_SPOOL_SEGMENT_BYTES,
+                 fsync: str = EVENT_SPOOL_FSYNC,
+                 fsync_interval_ms: int = EVENT_SPOOL_FSYNC_INTERVAL_MS):
+        self.root = directory
+        # Own subdirectory, created on first use (after any fork)
+        self.directory = None
+        self._lock_fd = None
+        # Directory and lock of an exited process's spool being replayed
+        self._adopted = None
+        self._adopted_fd = None
+        self._orphan_scan_at = 0.0
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval_ms / 1000
+        self._lock = threading.Lock()
+        self._file = None
+        self._path = None
+        self._size = 0
+        self._last_fsync = 0.0
+        self._next_seq = None
+        self.spooled = 0
+        self.replayed = 0
+        self.corrupt = 0
+        self.quarantined = 0
+
+    @staticmethod
+    def _segments(directory: str) -> list:
+        if directory is None:
+            return []
+        return sorted(glob.glob(os.path.join(directory, "segment-*.log")))
+
+    @staticmethod
+    def _try_lock(directory: str):
+        """flock the directory's .lock without waiting. Returns the fd, or None if it's held."""
+        fd = os.open(os.path.join(directory, ".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is None:
+            return fd
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return fd
+        except OSError:
+            os.close(fd)
+            return None
+
+    def _claim(self):
+        """Create and lock this process's subdirectory (lock held)"""
+        if self.directory is not None:
+            return
+        directory = os.path.join(self.root, f"{socket.gethostname()}-{os.getpid()}")
+        os.makedirs(directory, exist_ok=True)
+        fd = self._try_lock(directory)
+        if fd is None:
+            raise RuntimeError(f"Event spool {directory} is locked by another process")
+        self.directory, self._lock_fd = directory, fd
+
+    def _release_adopted(self, remove: bool):
+        if remove:
+            shutil.rmtree(self._adopted, ignore_errors=True)
+        os.close(self._adopted_fd)
+        self._adopted = self._adopted_fd = None
+
+    def _orphan_segments(self) -> list:
+        """Segments of an exited process's spool, adopting one if needed (lock held)"""
+        if self._adopted is not None:
+            segments = self._segments(self._adopted)
+            if segments:
+                return segments
+            print(f"✅ Replayed event spool {os.path.basename(self._adopted)} left by an exited process")
+            self._release_adopted(remove=True)
+
+        now = time.monotonic()
+        if fcntl is None or now < self._orphan_scan_at:
+            return []
+        self._orphan_scan_at = now + EVENT_SPOOL_ORPHAN_SCAN_SECONDS
+
+        for directory in sorted(glob.glob(os.path.join(self.root, "*", ""))):
+            directory = directory.rstrip(os.sep)
+            if directory == self.directory:
+                continue
+            fd = self._try_lock(directory)
+            if fd is None:
+                continue  # Its process is still running
+            self._adopted, self._adopted_fd = directory, fd
+            segments = self._segments(directory)
+            if segments:
+                print(f"🔄 Adopting event spool {os.path.basename(directory)} ({len(segments)} segments)")
+                return segments
+            self._release_adopted(remove=True)
+        return []
+
+    def _open_segment(self):
+        if self._next_seq is None:
+            # Continue numbering after segments left by a previous process
+            self._claim()
+            segments = self._segments(self.directory)
+            last = os.path.basename(segments[-1]) if segments else "segment-000000000000.log"
+            self._next_seq = int(last[len("segment-"):-len(".log")]) + 1
+        self._path = os.path.join(self.directory, f"segment-{self._next_seq:012d}.log")
+        self._next_seq += 1
+        self._file = open(self._path, "ab")
+        self._size = 0
+
+    def _seal(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+            self._path = None
+
+    def append(self, records: list):
+        """Append records (JSON-serializable lists) to the active segment"""
+        if not records:
+            return
+        data = b"".join(encode_record(r) for r in records)
+        with self._lock:
+            if self._file is None or self._size >= self.segment_bytes:
+                self._seal()
+                self._open_segment()
+            self._file.write(data)
+            self._file.flush()
+            self._size += len(data)
+            self.spooled += len(records)
+
+            now = time.monotonic()
+            if self.fsync == "always" or (self.fsync == "interval" and now - self._last_fsync >= self.fsync_interval):
+                os.fsync(self._file.fileno())
+                self._last_fsync = now
+
+    def has_pending(self) -> bool:
+        with self._lock:
+            return (self._file is not None or bool(self._segments(self.directory))
+                    or self._adopted is not None
+                    or (fcntl is not None and time.monotonic() >= self._orphan_scan_at))
+
+    def read_chunk(self, max_records: int):
+        """
+        Next records to replay, from the oldest segment: (segment, end offset,
+        records, finished). Returns None if the spool is empty. Call commit()
+        once the records are written.
+        """
+        with self._lock:
+            self._claim()
+            segments = self._segments(self.directory) or self._orphan_segments()
+            if not segments:
+                return None
+            path = segments[0]
+            if path == self._path:
+                # Replay never reads the segment being appended to
+                self._seal()
+
+        offset = self._read_offset(path)
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return path, 0, [], True
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                records, end, torn = decode_records(data, offset, max_records)
+                finished = torn or end >= len(data)
+
+        if torn:
+            # A crash mid-append leaves a partial last record; nothing valid follows it
+            self.corrupt += 1
+            print(f"⚠️ Event spool {os.path.basename(path)} ends in a torn record at byte {end}")
+        return path, end, records, finished
+
+    def commit(self, path: str, end: int, finished: bool, replayed: int):
+        """Record replay progress, deleting the segment when it's done"""
+        self.replayed += replayed
+        if finished:
+            for p in (path, path + ".offset"):
+                try:
+                    os.remove(p)
+                except FileNotFoundError:
+                    pass
+            return
+        tmp = path + ".offset.tmp"
+        with open(tmp, "w") as f:
+            f.write(str(end))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path + ".offset")
+
+    def quarantine(self, record, error: str):
+        """Set aside a record the database won't take"""
+        line = json.dumps({"record": record, "error": error}, default=str) + "\n"
+        with self._lock:
+            os.makedirs(self.root, exist_ok=True)
+            with open(os.path.join(self.root, "quarantine.jsonl"), "a") as f:
+                f.write(line)
+            self.quarantined += 1
+        print(f"⚠️ Quarantined spooled tracking event {record}: {error}")
+
+    def _read_offset(self, path: str) -> int:
+        try:
+            with open(path + ".offset") as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def close(self):
+        with self._lock:
+            self._seal()
+            if self._adopted is not None:
+                self._release_adopted(remove=False)
+            if self._lock_fd is not None:
+                if not self._segments(self.directory):
+                    shutil.rmtree(self.directory, ignore_errors=True)
+                os.close(self._lock_fd)
+                self.directory = self._lock_fd = None
+                self._next_seq = None
+
+    def stats(self) -> dict:
+        segments = self._segments(self.directory) + self._segments(self._adopted)
+        return {
+            "spooled": self.spooled,
+            "replayed": self.replayed,
+            "corrupt_segments": self.corrupt,
+            "quarantined": self.quarantined,
+            "segments": len(segments),
+            "bytes": sum(os.path.getsize(p) for p in segments if os.path.exists(p))
+        }
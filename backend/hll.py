@@ -0,0 +1,59 @@
+"""
+HyperLogLog sketches for approximate distinct counts.
+
+A sketch has 2^p one-byte registers (p=14: 16 KB, about 0.8% standard
+error). Adding a value is idempotent and two sketches merge by taking the
+register-wise max, so sketches for different time buckets, processes or
+batches can be combined in any order. Serialized sketches are zlib
+compressed, which keeps sparse (low cardinality) sketches small.
+"""
+import hashlib
+import math
+import zlib
+
+HLL_PRECISION = 14
+
+_INVERSE_POWERS = [2.0 ** -i for i in range(65)]
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    def __init__(self, precision: int = HLL_PRECISION, registers: bytearray = None):
+        self.p = precision
+        self.m = 1 << precision
+        self.registers = registers if registers is not None else bytearray(self.m)
+
+    def add(self, value: str):
+        h = _hash64(value)
+        index = h >> (64 - self.p)
+        rest = (h << self.p) & 0xFFFFFFFFFFFFFFFF
+        # Position of the first 1 bit in the remaining 64-p bits
+        rank = 64 - rest.bit_length() + 1 if rest else 64 - self.p + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog"):
+        if other.p != self.p:
+            raise ValueError("Cannot merge sketches with different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self) -> int:
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(_INVERSE_POWERS[r] for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Small range: linear counting is more accurate
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self) -> bytes:
+        return bytes([self.p]) + zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        data = bytes(data)
+        return cls(data[0], bytearray(zlib.decompress(data[1:])))
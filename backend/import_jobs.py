@@ -0,0 +1,433 @@
+"""
+Background contact import jobs backed by the import_jobs table.
+
+POST /contacts/upload copies the upload into IMPORT_SPOOL_DIR, queues a job
+and returns right away. Each API process runs an ImportWorker thread that
+claims queued jobs with FOR UPDATE SKIP LOCKED and imports them chunk by
+chunk (contact_import.py).
+
+The spooled file is only on the disk of the host that received the upload,
+so a job is only claimed by API processes on that host (spool_host), unless
+IMPORT_SPOOL_SHARED says IMPORT_SPOOL_DIR is storage every host mounts.
+
+Job progress (file offset, row counts) is written in the same transaction as
+each chunk's contacts, so a cancelled, failed or abandoned job resumes from
+the last committed chunk. Cancellation is checked between chunks. While a
+job runs, its heartbeat is also bumped from a background thread, so a chunk
+slowed down by MX lookups isn't taken for abandoned; progress and the final
+status are only written while this worker still owns the job.
+
+The spooled file is removed when a job completes. Cancelled and failed
+jobs keep theirs for IMPORT_SPOOL_KEEP_HOURS so they can be resumed; after
+that the worker sweeps it away.
+"""
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from psycopg2.extras import Json
+from database import get_db
+from job_queue import (
+    worker_identity, row_to_dict, claim_next, isoformat_fields, run_claimed, Heartbeat, JobLost
+)
+from contact_import import import_contacts_csv
+from dotenv import load_dotenv
+
+load_dotenv()
+
+IMPORT_SPOOL_DIR = os.getenv("IMPORT_SPOOL_DIR", os.path.join(os.path.dirname(__file__), "spool", "imports"))
+# true if IMPORT_SPOOL_DIR is shared storage (e.g. NFS/EFS) mounted on every API host
+IMPORT_SPOOL_SHARED = os.getenv("IMPORT_SPOOL_SHARED", "false").lower() == "true"
+SPOOL_HOST = socket.gethostname()
+
+# A running job whose worker hasn't reported progress for this long is
+# considered abandoned and can be claimed by another worker
+IMPORT_JOB_STALE_SECONDS = int(os.getenv("IMPORT_JOB_STALE_SECONDS", "300"))
+IMPORT_WORKER_POLL_INTERVAL = float(os.getenv("IMPORT_WORKER_POLL_INTERVAL", "2"))
+
+# Hours a cancelled or failed job's spooled file is kept for resuming
+IMPORT_SPOOL_KEEP_HOURS = float(os.getenv("IMPORT_SPOOL_KEEP_HOURS", "24"))
+
+# How often an idle worker removes expired spooled files
+IMPORT_SPOOL_SWEEP_SECONDS = 3600
+
+JOB_COLUMNS = (
+    "id", "filename", "path", "spool_host", "status", "total_bytes", "bytes_done", "total", "inserted", "skipped",
+    "rejections", "cancel_requested", "error", "worker_id", "heartbeat_at", "created_at", "started_at", "finished_at",
+    "run_start_bytes", "run_start_rows"
+)
+
+ACTIVE_STATUSES = ("queued", "running")
+RESUMABLE_STATUSES = ("cancelled", "failed")
+
+
+def spool_upload(fileobj) -> tuple[str, int]:
+    """Copy an uploaded file into the import spool. Returns (path, size in bytes)."""
+    os.makedirs(IMPORT_SPOOL_DIR, exist_ok=True)
+    path = os.path.join(IMPORT_SPOOL_DIR, f"{uuid.uuid4().hex}.csv")
+    with open(path, "wb") as out:
+        shutil.copyfileobj(fileobj, out, 1024 * 1024)
+        out.flush()
+        os.fsync(out.fileno())
+    return path, os.path.getsize(path)
+
+
+def remove_spooled(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def create_job(filename: str, path: str, total_bytes: int) -> dict:
+    conn = get_db()
+    cur = conn.cursor()
+
+    try:
+        cur.execute(
+            f"""
+            INSERT INTO import_jobs (filename, path, spool_host, total_bytes) VALUES (%s, %s, %s, %s)
+            RETURNING {', '.join(JOB_COLUMNS)}
+            """,
+            (filename, path, SPOOL_HOST, total_bytes)
+        )
+        job = row_to_dict(JOB_COLUMNS, cur.fetchone())
+        conn.commit()
+        return job
+    finally:
+        cur.close()
+        conn.close()
+
+
+def get_job(job_id: int) -> dict:
+    """Job row plus run_seconds, the time spent in the current (or last) run"""
+    conn = get_db()
+    cur = conn.cursor()
+
+    try:
+        cur.execute(
+            f"""
+            SELECT {', '.join(JOB_COLUMNS)},
+                   EXTRACT(EPOCH FROM COALESCE(finished_at, NOW()) - run_started_at)
+            FROM import_jobs WHERE id = %s
+            """,
+            (job_id,)
+        )
+        row = cur.fetchone()
+        if not row:
+            return None
+        job = row_to_dict(JOB_COLUMNS, row[:-1])
+        job["run_seconds"] = float(row[-1]) if row[-1] is not None else None
+        return job
+    finally:
+        cur.close()
+        conn.close()
+
+
+def spool_is_local(job: dict) -> bool:
+    """Whether this host can read the job's spooled file"""
+    return IMPORT_SPOOL_SHARED or job["spool_host"] == SPOOL_HOST
+
+
+def claim_job(worker_id: str) -> dict:
+    """Claim the oldest queued (or abandoned) job whose file this host can read, or return None"""
+    conn = get_db()
+    cur = conn.cursor()
+
+    try:
+        job = claim_next(
+            cur, "import_jobs", ("id",), JOB_COLUMNS, worker_id, IMPORT_JOB_STALE_SECONDS,
+            # Rates and ETA are measured from where this run starts
+            set_sql=", run_started_at = NOW(), run_start_bytes = bytes_done, run_start_rows = total",
+            where_sql="AND (%s OR spool_host = %s)",
+            where_params=(IMPORT_SPOOL_SHARED, SPOOL_HOST)
+        )
+        conn.commit()
+        return job
+    finally:
+        cur.close()
+        conn.close()
+
+
+def touch_job(job_id: int, worker_id: str) -> bool:
+    """Bump a running job's heartbeat. Returns False if worker_id no longer owns it."""
+    conn = get_db()
+    cur = conn.cursor()
+
+    try:
+        cur.execute(
+            """
+            UPDATE import_jobs SET heartbeat_at = NOW()
+            WHERE id = %s AND worker_id = %s AND status = 'running'
+            RETURNING id
+            """,
+            (job_id, worker_id)
+        )
+        found = cur.fetchone()
+        conn.commit()
+        return found is not None
+    finally:
+        cur.close()
+        conn.close()
+
+
+def record_progress(cur, job_id: int, worker_id: str, bytes_done: int, total: int, inserted: int, skipped: int,
+                    rejections: dict) -> bool:
+    """
+    Update progress. Call before committing the chunk. Returns True if a
+    cancel was requested; raises JobLost if worker_id no longer owns the job.
+    """
+    cur.execute(
+        """
+        UPDATE import_jobs
+        SET bytes_done = %s, total = %s, inserted = %s, skipped = %s, rejections = %s, heartbeat_at = NOW()
+        WHERE id = %s AND worker_id = %s AND status = 'running'
+        RETURNING cancel_requested
+        """,
+        (bytes_done, total, inserted, skipped, Json(rejections), job_id, worker_id)
+    )
+    row = cur.fetchone()
+    if row is None:
+        raise JobLost(f"import job {job_id} was reclaimed or cancelled")
+    return bool(row[0])
+
+
+def finish_job(job_id: int, worker_id: str, status: str, error: str = None) -> bool:
+    """
+    Mark worker_id's running job 'completed', 'cancelled' or 'failed', or put
+    it back to 'queued'. Returns False if the worker no longer owns it.
+    """
+    conn = get_db()
+    cur = conn.cursor()
+
+    try:
+        cur.execute(
+            """
+            UPDATE import_jobs
+            SET status = %s, error = %s, heartbeat_at = NOW(),
+                finished_at = CASE WHEN %s = 'queued' THEN NULL ELSE NOW() END
+            WHERE id = %s AND worker_id = %s AND status = 'running'
+            RETURNING id
+            """,
+            (status, error, status, job_id, worker_id)
+        )
+        found = cur.fetchone()
+        conn.commit()
+        return found is not None
+    finally:
+        cur.close()
+        conn.close()
+
+
+def cancel_job(job_id: int) -> dict:
+    """
+    Request cancellation. Queued (and abandoned) jobs are cancelled at once;
+    a running job stops after its current chunk. Returns None if the job
+    doesn't exist or has already finished.
+    """
+    conn = get_db()
+    cur = conn.cursor()
+
+    try:
+        cur.execute(
+            """
+            UPDATE import_jobs
+            SET cancel_requested = TRUE,
+                status = CASE
+                    WHEN status = 'queued' OR heartbeat_at < NOW() - make_interval(secs => %s) THEN 'cancelled'
+                    ELSE status END,
+                finished_at = CASE
+                    WHEN status = 'queued' OR heartbeat_at < NOW() - make_interval(secs => %s) THEN NOW()
+                    ELSE finished_at END
+            WHERE id = %s AND status IN %s
+            RETURNING id
+            """,
+            (IMPORT_JOB_STALE_SECONDS, IMPORT_JOB_STALE_SECONDS, job_id, ACTIVE_STATUSES)
+        )
+        found = cur.fetchone()
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+    return get_job(job_id) if found else None
+
+
+def resume_job(job_id: int) -> dict:
+    """Queue a cancelled or failed job again; it continues from its last committed chunk"""
+    conn = get_db()
+    cur = conn.cursor()
+
+    try:
+        cur.execute(
+            """
+            UPDATE import_jobs
+            SET status = 'queued', cancel_requested = FALSE, error = NULL, finished_at = NULL
+            WHERE id = %s AND status IN %s
+            RETURNING id
+            """,
+            (job_id, RESUMABLE_STATUSES)
+        )
+        found = cur.fetchone()
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+    return get_job(job_id) if found else None
+
+
+def run_import_job(job: dict, stop: threading.Event = None) -> str:
+    """Import a claimed job from its last committed offset. Returns its new status."""
+    state = {"cancelled": False}
+    previous = job.get("rejections") or {}
+    worker_id = job["worker_id"]
+
+    def on_chunk(cur, result):
+        rejections = dict(previous)
+        for reason, count in result["rejections"].items():
+            rejections[reason] = rejections.get(reason, 0) + count
+        state["cancelled"] = record_progress(
+            cur, job["id"], worker_id, result["offset"],
+            job["total"] + result["total"],
+            job["inserted"] + result["inserted"],
+            job["skipped"] + result["skipped"],
+            rejections
+        )
+        return not state["cancelled"] and not (stop and stop.is_set())
+
+    conn = get_db()
+    try:
+        with Heartbeat(lambda: touch_job(job["id"], worker_id), IMPORT_JOB_STALE_SECONDS / 3):
+            with open(job["path"], "rb") as f:
+                result = import_contacts_csv(conn, f, start_offset=job["bytes_done"], on_chunk=on_chunk)
+    finally:
+        conn.close()
+
+    if state["cancelled"]:
+        status = "cancelled"
+    elif result["stopped"]:
+        # Worker shutting down: hand the job back so it resumes on the next claim
+        status = "queued"
+    else:
+        status = "completed"
+    if not finish_job(job["id"], worker_id, status):
+        raise JobLost(f"import job {job['id']} was reclaimed or cancelled")
+    if status == "completed":
+        remove_spooled(job["path"])
+    return status
+
+
+def sweep_spool() -> int:
+    """Remove this host's spooled files of jobs cancelled or failed too long ago. Returns files removed."""
+    conn = get_db()
+    cur = conn.cursor()
+
+    try:
+        cur.execute(
+            """
+            SELECT path FROM import_jobs
+            WHERE status IN %s AND finished_at < NOW() - make_interval(secs => %s)
+            AND (%s OR spool_host = %s)
+            """,
+            (RESUMABLE_STATUSES, IMPORT_SPOOL_KEEP_HOURS * 3600, IMPORT_SPOOL_SHARED, SPOOL_HOST)
+        )
+        paths = [path for (path,) in cur.fetchall() if os.path.exists(path)]
+    finally:
+        cur.close()
+        conn.close()
+
+    for path in paths:
+        remove_spooled(path)
+    return len(paths)
+
+
+def job_to_dict(job: dict) -> dict:
+    """JSON-friendly job status for API responses, with throughput and ETA"""
+    data = {k: v for k, v in job.items() if k not in ("path", "run_start_bytes", "run_start_rows", "run_seconds")}
+    isoformat_fields(data, ("heartbeat_at", "created_at", "started_at", "finished_at"))
+
+    total_bytes = data.get("total_bytes") or 0
+    bytes_done = data.get("bytes_done") or 0
+    data["progress"] = round(min(bytes_done / total_bytes, 1) * 100, 2) if total_bytes else 0
+
+    # Rates cover the current (or last) run only, so a resumed job isn't
+    # credited with rows imported before it was interrupted
+    seconds = job.get("run_seconds")
+    rows_per_sec = bytes_per_sec = None
+    if seconds and seconds > 0:
+        rows_per_sec = (data["total"] - (job.get("run_start_rows") or 0)) / seconds
+        bytes_per_sec = (bytes_done - (job.get("run_start_bytes") or 0)) / seconds
+    data["rows_per_sec"] = round(rows_per_sec, 1) if rows_per_sec is not None else None
+
+    eta = None
+    if data["status"] == "running" and bytes_per_sec:
+        eta = round(max(total_bytes - bytes_done, 0) / bytes_per_sec, 1)
+    data["eta_seconds"] = eta
+    return data
+
+
+class ImportWorker:
+    """Background thread that drains import_jobs in this process"""
+
+    def __init__(self, poll_interval: float = IMPORT_WORKER_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self.worker_id = worker_identity("imports")
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+        self._sweep_at = 0.0
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="import-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 30.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def wake(self):
+        """Check for jobs now instead of at the next poll"""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job = claim_job(self.worker_id)
+            except Exception as e:
+                print(f"❌ Failed to claim import job: {str(e)}")
+                job = None
+
+            if not job:
+                self._sweep()
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+
+            print(f"🔄 Import job {job['id']} ({job['filename']}) started at byte {job['bytes_done']}")
+            status = run_claimed(
+                f"Import job {job['id']}",
+                lambda: run_import_job(job, self._stop),
+                lambda error: finish_job(job["id"], self.worker_id, "failed", error)
+            )
+            if status:
+                print(f"✅ Import job {job['id']} {status}")
+
+    def _sweep(self):
+        if time.monotonic() < self._sweep_at:
+            return
+        self._sweep_at = time.monotonic() + IMPORT_SPOOL_SWEEP_SECONDS
+        try:
+            removed = sweep_spool()
+            if removed:
+                print(f"🧹 Removed {removed} spooled import files of cancelled or failed jobs")
+        except Exception as e:
+            print(f"❌ Failed to sweep import spool: {str(e)}")
+
+
+import_worker = ImportWorker()
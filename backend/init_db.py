@@ -6,6 +6,8 @@ Reads DB credentials from .env and applies schema.sql
 import os
 import psycopg2
 from dotenv import load_dotenv
+from event_partitions import ensure_partitions
+from stats_rollup import rebuild_rollups
 
 # Load environment variables
 load_dotenv()
@@ -51,6 +53,20 @@ try:
     cur.close()
     
     print("✅ Schema applied successfully!")
+
+    # Monthly partitions for the events table
+    cur = conn.cursor()
+    created = ensure_partitions(cur)
+    conn.commit()
+    cur.close()
+    print(f"✅ Event partitions ready ({len(created)} created)")
+
+    # Stats counters from whatever is already in campaign_sends/events
+    cur = conn.cursor()
+    rebuild_rollups(cur)
+    conn.commit()
+    cur.close()
+    print("✅ Stats counters rebuilt")
     print("\n📊 Verifying events table...")
     
     # Verify
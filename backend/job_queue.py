@@ -0,0 +1,124 @@
+"""
+Shared pieces of the table-backed job queues (send_jobs.py, import_jobs.py).
+
+Work items are rows with a status ('queued', 'running', ...), a worker_id
+and a heartbeat_at that the worker bumps each time it commits progress.
+Workers claim the oldest claimable row with FOR UPDATE SKIP LOCKED, so two
+workers never get the same row. A 'running' row whose heartbeat is older
+than the stale timeout belongs to a worker that died; it is claimed again
+and resumes from the progress committed with its last heartbeat.
+
+Workers only update rows they still own (worker_id and status 'running');
+a worker whose row was reclaimed or cancelled meanwhile gets JobLost and
+stops without touching it.
+"""
+import os
+import socket
+import threading
+import traceback
+
+
+class JobLost(Exception):
+    """The row was reclaimed by another worker or cancelled; stop working on it"""
+
+
+def worker_identity(suffix: str = None) -> str:
+    """host:pid (plus an optional suffix) recorded in worker_id"""
+    identity = f"{socket.gethostname()}:{os.getpid()}"
+    return f"{identity}:{suffix}" if suffix else identity
+
+
+def row_to_dict(columns: tuple, row) -> dict:
+    return dict(zip(columns, row)) if row else None
+
+
+def claim_next(cur, table: str, key_columns: tuple, columns: tuple, worker_id: str, stale_seconds: int,
+               set_sql: str = "", where_sql: str = "", where_params: tuple = ()) -> dict:
+    """
+    Mark the oldest queued (or abandoned) row of table as running for
+    worker_id and return it, or None. set_sql adds assignments
+    (", col = expr"); where_sql adds conditions ("AND ...") on which rows
+    are claimable. The caller commits.
+    """
+    keys = ", ".join(key_columns)
+    cur.execute(
+        f"""
+        UPDATE {table}
+        SET status = 'running',
+            worker_id = %s,
+            heartbeat_at = NOW(),
+            started_at = COALESCE(started_at, NOW()){set_sql}
+        WHERE ({keys}) = (
+            SELECT {keys} FROM {table}
+            WHERE (status = 'queued'
+                   OR (status = 'running' AND heartbeat_at < NOW() - make_interval(secs => %s)))
+            {where_sql}
+            ORDER BY {keys}
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING {', '.join(columns)}
+        """,
+        (worker_id, stale_seconds, *where_params)
+    )
+    return row_to_dict(columns, cur.fetchone())
+
+
+def isoformat_fields(data: dict, keys: tuple) -> dict:
+    """Convert the given timestamp fields to ISO strings (None stays None)"""
+    for key in keys:
+        data[key] = data[key].isoformat() if data.get(key) else None
+    return data
+
+
+class Heartbeat:
+    """
+    Bumps a claimed row's heartbeat from a background thread while the work
+    runs, so slow steps between progress commits (DNS lookups, big merges)
+    don't make it look abandoned. touch() returns False once the row isn't
+    ours any more; lost is set and the thread stops.
+    """
+
+    def __init__(self, touch, interval: float):
+        self.touch = touch
+        self.interval = interval
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name="job-heartbeat", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                if not self.touch():
+                    self.lost.set()
+                    return
+            except Exception as e:
+                # Transient; progress commits still move the heartbeat
+                print(f"⚠️ Heartbeat failed: {str(e)}")
+
+
+def run_claimed(label: str, run, mark_failed):
+    """Run a claimed item, marking it failed if run() raises. Returns run()'s result (None on failure)."""
+    try:
+        return run()
+    except JobLost as e:
+        print(f"⚠️ {label} stopped: {str(e)}")
+        return None
+    except Exception as e:
+        print(f"❌ {label} failed: {str(e)} ({type(e).__name__})")
+        traceback.print_exc()
+        try:
+            mark_failed(str(e))
+        except Exception as db_error:
+            # Stays 'running' and is reclaimed once its heartbeat goes stale
+            print(f"❌ Could not mark {label} failed: {str(db_error)}")
+        return None
@@ -1,9 +1,15 @@
 import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware  # pyright: ignore[reportMissingImports]
 from dotenv import load_dotenv
 
 from database import get_db
+from event_queue import event_buffer
+from event_partitions import maintain_partitions, partition_maintainer
+from tracking_filter import open_filter
+from stats_cache import stats_cache, stats_listener
+from import_jobs import import_worker
 from routes import auth
 from routes import contacts
 from routes import campaigns
@@ -14,7 +20,31 @@ from routes import stats
 
 load_dotenv()
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Make sure this month's and upcoming events partitions exist
+    try:
+        maintain_partitions()
+    except Exception as e:
+        print(f"⚠️ Event partition maintenance failed: {e}")
+    # ...and keep creating them (and applying retention) while the process runs
+    partition_maintainer.start()
+
+    # Background writer for tracking events; flushes what's left on shutdown
+    event_buffer.start()
+    # Drops cached stats when sends, events or webhooks change them
+    stats_listener.start()
+    # Runs queued contact imports; an import in progress is handed back on shutdown
+    import_worker.start()
+    yield
+    import_worker.stop()
+    stats_listener.stop()
+    event_buffer.stop()
+    partition_maintainer.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS (frontend access allowed)
 # For development: allow all origins
@@ -35,7 +65,7 @@ app.add_middleware(
 
 @app.get("/health")
 def check():
-    return {"status": "ok"}
+    return {"status": "ok", "events": event_buffer.stats(), "opens": open_filter.stats(), "stats_cache": stats_cache.stats()}
 
 @app.get("/db-test")
 def db_test():
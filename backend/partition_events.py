@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Migration: Convert the events table to monthly partitions
+
+The old table is renamed to events_unpartitioned, the partitioned events
+table is created from schema.sql and the rows are copied over in one
+transaction. Stop the API first; events_unpartitioned is kept until you
+drop it.
+"""
+import os
+import psycopg2
+from dotenv import load_dotenv
+from event_partitions import ensure_partitions
+
+load_dotenv()
+
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_NAME = os.getenv("DB_NAME", "email_system")
+DB_USER = os.getenv("DB_USER", "postgres")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "changeme")
+DB_PORT = os.getenv("DB_PORT", "5432")
+
+print(f"🔧 Database Migration: Partition the events table by month")
+print(f"📌 Connecting to {DB_USER}@{DB_HOST}:{DB_PORT}/{DB_NAME}...")
+
+try:
+    conn = psycopg2.connect(
+        host=DB_HOST,
+        database=DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        port=DB_PORT
+    )
+    print("✅ Connected!\n")
+
+    cur = conn.cursor()
+
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('events')")
+    row = cur.fetchone()
+    if row and row[0] == "p":
+        print("ℹ️  events is already partitioned, nothing to do")
+        exit(0)
+    if row is None:
+        print("ℹ️  No events table yet, run init_db.py instead")
+        exit(0)
+
+    # Step 1: Move the old table (and the names of its index, sequence and PK) out of the way
+    print("⏳ Step 1: Renaming events to events_unpartitioned...")
+    cur.execute("""
+        SELECT indexname FROM pg_indexes
+        WHERE schemaname = current_schema() AND tablename = 'events' AND indexname <> 'events_pkey'
+    """)
+    for (index_name,) in cur.fetchall():
+        cur.execute(f"DROP INDEX {index_name}")
+    cur.execute("ALTER TABLE events RENAME TO events_unpartitioned")
+    cur.execute("ALTER INDEX IF EXISTS events_pkey RENAME TO events_unpartitioned_pkey")
+    cur.execute("ALTER SEQUENCE IF EXISTS events_id_seq RENAME TO events_unpartitioned_id_seq")
+    print("   ✅ Renamed")
+
+    # Step 2: Create the partitioned table and its indexes
+    print("\n⏳ Step 2: Applying schema.sql...")
+    schema_path = os.path.join(os.path.dirname(__file__), "schema.sql")
+    with open(schema_path, 'r') as f:
+        cur.execute(f.read())
+    print("   ✅ Partitioned events table created")
+
+    # Step 3: Partitions for every month that has events
+    print("\n⏳ Step 3: Creating monthly partitions...")
+    cur.execute("SELECT MIN(created_at)::date FROM events_unpartitioned")
+    oldest = cur.fetchone()[0]
+    created = ensure_partitions(cur, start=oldest)
+    print(f"   ✅ {len(created)} partitions created")
+
+    # Step 4: Copy the rows
+    print("\n⏳ Step 4: Copying events...")
+    cur.execute("""
+        INSERT INTO events (id, campaign_id, contact_email, event_type, metadata, created_at)
+        SELECT id, campaign_id, contact_email, event_type, metadata, COALESCE(created_at, CURRENT_TIMESTAMP)
+        FROM events_unpartitioned
+    """)
+    copied = cur.rowcount
+    cur.execute("SELECT setval('events_id_seq', COALESCE((SELECT MAX(id) FROM events), 0) + 1, false)")
+    print(f"   ✅ {copied} events copied")
+
+    conn.commit()
+    cur.close()
+    conn.close()
+
+    print("\n🎉 Migration complete!")
+    print("📝 Next steps:")
+    print("   1. Restart the backend")
+    print("   2. Check the stats pages, then: DROP TABLE events_unpartitioned;")
+    print("   3. Run python event_partitions.py daily (cron) to create upcoming partitions\n")
+
+except psycopg2.OperationalError as e:
+    print(f"❌ Database connection failed: {e}")
+    exit(1)
+except Exception as e:
+    print(f"❌ Migration failed: {e}")
+    import traceback
+    traceback.print_exc()
+    exit(1)
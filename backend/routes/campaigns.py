@@ -1,9 +1,14 @@
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse
 from database import get_db
+from psycopg2.extras import execute_values
 from routes.unsubscribe import generate_unsubscribe_token
+from routes.tracking import encode_recipient_token, link_token_prefix, OPEN_LINK_INDEX
+from send_jobs import enqueue_job, get_job, job_to_dict
 import os
-import time
 import re
+import threading
+import time
 import base64
 import hashlib
 from dotenv import load_dotenv
@@ -14,31 +19,90 @@ router = APIRouter()
 BASE_URL = os.getenv("BASE_URL", "http://localhost:8000")
 TRACKING_SUBDOMAIN = os.getenv("TRACKING_SUBDOMAIN", "links.yourdomain.com")
 
-# SES rate limits: 14 emails per second (for production tier)
-# We'll be conservative: 10 emails per second = 0.1 seconds per email
-EMAIL_SEND_DELAY = 0.1
+# Verified identities rarely change; cache them instead of hitting SES per request
+SES_IDENTITY_CACHE_TTL = float(os.getenv("SES_IDENTITY_CACHE_TTL", "300"))
 
 
 # ---------------------------------------------------------
 # HELPER FUNCTION: Get Verified Identities
 # ---------------------------------------------------------
-def get_verified_identities():
-    """Get all verified email addresses and domains"""
+def _fetch_verified_identities():
+    """Get all verified email addresses and domains from SES"""
     from ses import ses
-    try:
-        # Get verified emails
-        verified_emails = ses.list_verified_email_addresses()
-        email_list = verified_emails.get('VerifiedEmailAddresses', [])
-        
-        # Get verified domains
-        verified_domains = ses.list_identities(IdentityType='Domain')
-        domain_list = verified_domains.get('Identities', [])
-        
+    # Get verified emails
+    verified_emails = ses.list_verified_email_addresses()
+    email_list = verified_emails.get('VerifiedEmailAddresses', [])
+    
+    # Get verified domains
+    verified_domains = ses.list_identities(IdentityType='Domain')
+    domain_list = verified_domains.get('Identities', [])
+    
+    return {
+        "emails": email_list,
+        "domains": domain_list,
+        "all": email_list + domain_list
+    }
+
+
+class IdentityCache:
+    """
+    Process-wide TTL cache of verified SES identities.
+
+    Only one thread refreshes an expired entry; the others wait for it and
+    reuse its result instead of all calling the SES control-plane API.
+    Failed lookups are not cached.
+    """
+
+    def __init__(self, fetch, ttl: float):
+        self.fetch = fetch
+        self.ttl = ttl
+        self._value = None
+        self._expires_at = 0.0
+        self._fetched_at = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self) -> dict:
+        if self._value is not None and time.monotonic() < self._expires_at:
+            self.hits += 1
+            return self._value
+
+        with self._lock:
+            # Another thread may have refreshed while we waited
+            if self._value is not None and time.monotonic() < self._expires_at:
+                self.hits += 1
+                return self._value
+
+            self.misses += 1
+            value = self.fetch()
+            self._value = value
+            self._fetched_at = time.monotonic()
+            self._expires_at = self._fetched_at + self.ttl
+            return value
+
+    def invalidate(self):
+        with self._lock:
+            self._value = None
+            self._expires_at = 0.0
+
+    def stats(self) -> dict:
+        age = time.monotonic() - self._fetched_at if self._value is not None else None
         return {
-            "emails": email_list,
-            "domains": domain_list,
-            "all": email_list + domain_list
+            "hits": self.hits,
+            "misses": self.misses,
+            "ttl_seconds": self.ttl,
+            "age_seconds": round(age, 1) if age is not None else None
         }
+
+
+identity_cache = IdentityCache(_fetch_verified_identities, SES_IDENTITY_CACHE_TTL)
+
+
+def get_verified_identities():
+    """Get all verified email addresses and domains (cached)"""
+    try:
+        return identity_cache.get()
     except Exception as e:
         print(f"Error getting identities: {str(e)}")
         return {"emails": [], "domains": [], "all": []}
@@ -72,10 +136,17 @@ def is_sender_verified(sender_email: str) -> tuple[bool, str]:
 # HEALTH CHECK / SES VERIFICATION
 # ---------------------------------------------------------
 @router.get("/health/ses")
-def check_ses_status():
-    """Check AWS SES configuration and account status"""
+def check_ses_status(refresh: bool = False):
+    """Check AWS SES configuration and account status
+
+    Pass refresh=true to drop the cached identities (e.g. right after
+    verifying a new sender in the SES console).
+    """
     from ses import ses
     
+    if refresh:
+        identity_cache.invalidate()
+    
     try:
         # Get account sending limits
         account_info = ses.get_account_sending_enabled()
@@ -105,6 +176,7 @@ def check_ses_status():
             "max_send_rate": quota.get('MaxSendRate'),
             "region": os.getenv('AWS_REGION'),
             "has_credentials": bool(os.getenv('AWS_ACCESS_KEY_ID')),
+            "identity_cache": identity_cache.stats(),
             "message": "✅ Ready to send emails" if (verified_emails or verified_domains) else "❌ No verified identities. Please verify at least one email or domain in AWS SES console."
         }
     except Exception as e:
@@ -120,51 +192,112 @@ def check_ses_status():
         }
 
 
-def prepare_email_html(html: str, campaign_id: int, contact_email: str, base_url: str) -> str:
-    """
-    Prepare email HTML by:
-    1. Injecting open tracking pixel
-    2. Rewriting links for click tracking
+# Slots in a compiled template, filled in per recipient
+EMAIL_SLOT = object()
+TOKEN_SLOT = object()
+TRACKING_SLOT = object()
+
+
+class CompiledEmailTemplate:
     """
-    # 1) Inject open tracking pixel
-    tracking_pixel = (
-        f'<img src="{base_url}/api/t/open?campaign_id={campaign_id}&email={contact_email}" '
-        f'width="1" height="1" style="display:none;" />'
-    )
-    
-    if '</body>' in html.lower():
-        html = re.sub(r'</body>', f'{tracking_pixel}\n</body>', html, flags=re.IGNORECASE)
-    else:
-        html += f'\n{tracking_pixel}'
-    
-    # 2) Rewrite links for click tracking
-    def replace_link(match):
-        original_url = match.group(1)
-        # Simple URL encoding
-        tracking_url = (
-            f"{base_url}/api/t/click?campaign_id={campaign_id}&email={contact_email}&url={original_url}"
-        )
-        return f'href="{tracking_url}"'
-    
-    html = re.sub(r'href="(https?://[^"]+)"', replace_link, html, flags=re.IGNORECASE)
-    
-    # 3) Inject unsubscribe link
-    token = generate_unsubscribe_token(contact_email, campaign_id)
-    unsubscribe_link = (
-        f'<div style="text-align:center;margin-top:20px;padding:10px;color:#999;font-size:12px;">'
-        f'<a href="{base_url}/unsubscribe/{token}?email={contact_email}" style="color:#999;">Unsubscribe</a>'
-        f'</div>'
-    )
-    
-    if '</body>' in html.lower():
-        html = re.sub(r'</body>', f'{unsubscribe_link}\n</body>', html, flags=re.IGNORECASE)
-    else:
-        html += f'\n{unsubscribe_link}'
-    
-    return html
+    Campaign HTML split once into static segments and per-recipient slots.
 
+    render() only computes the recipient's unsubscribe and tracking tokens
+    and joins precomputed strings: the open pixel and unsubscribe link go
+    before </body> (or at the end), and each http(s) href is rewritten to a
+    click-tracking URL whose link index is its position in the HTML.
+    """
 
+    def __init__(self, campaign_id: int, parts: list, links: list):
+        self.campaign_id = campaign_id
+        self.parts = parts
+        self.links = links  # Tracked URLs, by link index
+        self.email_slots = [i for i, p in enumerate(parts) if p is EMAIL_SLOT]
+        self.token_slots = [i for i, p in enumerate(parts) if p is TOKEN_SLOT]
+        self.tracking_slots = [i for i, p in enumerate(parts) if p is TRACKING_SLOT]
+
+    def render(self, contact_email: str, token: str = None, tracking_token: str = None) -> str:
+        if token is None:
+            token = generate_unsubscribe_token(contact_email, self.campaign_id)
+        if tracking_token is None:
+            tracking_token = encode_recipient_token(self.campaign_id, contact_email)
+        parts = self.parts[:]
+        for i in self.email_slots:
+            parts[i] = contact_email
+        for i in self.token_slots:
+            parts[i] = token
+        for i in self.tracking_slots:
+            parts[i] = tracking_token
+        return "".join(parts)
+
+
+def compile_email_html(html: str, campaign_id: int, base_url: str) -> CompiledEmailTemplate:
+    """
+    Find the pixel, link and unsubscribe insertion points in the campaign
+    HTML once, and return a template that renders each recipient's email.
+    """
+    pixel = [
+        f'<img src="{base_url}/api/t/o/{link_token_prefix(OPEN_LINK_INDEX)}', TRACKING_SLOT,
+        '" width="1" height="1" style="display:none;" />'
+    ]
+    unsubscribe = [
+        f'<div style="text-align:center;margin-top:20px;padding:10px;color:#999;font-size:12px;">'
+        f'<a href="{base_url}/unsubscribe/', TOKEN_SLOT, '?email=', EMAIL_SLOT,
+        '" style="color:#999;">Unsubscribe</a></div>'
+    ]
 
+    # Insertion points in document order: ("link", start, end, url) / ("body", start, end)
+    points = [
+        ("link", m.start(), m.end(), m.group(1))
+        for m in re.finditer(r'href="(https?://[^"]+)"', html, flags=re.IGNORECASE)
+    ]
+    body_closes = [
+        ("body", m.start(), m.end(), None)
+        for m in re.finditer(r'</body>', html, flags=re.IGNORECASE)
+    ]
+    points = sorted(points + body_closes, key=lambda p: p[1])
+
+    parts = []
+    links = []
+    pos = 0
+    for kind, start, end, url in points:
+        parts.append(html[pos:start])
+        if kind == "link":
+            parts += [f'href="{base_url}/api/t/c/{link_token_prefix(len(links))}', TRACKING_SLOT, '"']
+            links.append(url)
+        else:
+            # Pixel and unsubscribe footer go before every </body>
+            parts += pixel + ["\n"] + unsubscribe + ["\n</body>"]
+        pos = end
+    parts.append(html[pos:])
+
+    if not body_closes:
+        parts += ["\n"] + pixel + ["\n"] + unsubscribe
+
+    # Merge adjacent static strings so render() joins as few pieces as possible
+    merged = []
+    for part in parts:
+        if isinstance(part, str) and merged and isinstance(merged[-1], str):
+            merged[-1] += part
+        elif part != "":
+            merged.append(part)
+
+    return CompiledEmailTemplate(campaign_id, merged, links)
+
+
+def register_campaign_links(cur, campaign_id: int, links: list):
+    """Store the campaign's tracked URLs so click tokens can resolve them (idempotent)"""
+    if not links:
+        return
+    execute_values(
+        cur,
+        """
+        INSERT INTO campaign_links (campaign_id, link_index, url)
+        VALUES %s
+        ON CONFLICT (campaign_id, link_index) DO NOTHING
+        """,
+        [(campaign_id, i, url) for i, url in enumerate(links)]
+    )
 
 
 # ---------------------------------------------------------
@@ -185,6 +318,10 @@ def create_campaign(subject: str, sender: str, html: str):
     )
 
     camp_id = cur.fetchone()[0]
+
+    # Register tracked links once, so click tokens resolve to a link id
+    template = compile_email_html(html, camp_id, BASE_URL)
+    register_campaign_links(cur, camp_id, template.links)
     conn.commit()
 
     cur.close()
@@ -232,8 +369,11 @@ def send_test_email(campaign_id: int, test_email: str):
             "suggestion": "Use one of the verified identities as the sender, or verify the sender email in AWS SES console"
         }
     
-    # Prepare HTML with tracking
-    prepared_html = prepare_email_html(html, campaign_id, test_email, BASE_URL)
+    # Prepare HTML with tracking (links registered for campaigns created before the link registry)
+    template = compile_email_html(html, campaign_id, BASE_URL)
+    register_campaign_links(cur, campaign_id, template.links)
+    conn.commit()
+    prepared_html = template.render(test_email)
 
     try:
         print(f"\n🔍 SENDING TEST EMAIL:")
@@ -278,37 +418,39 @@ def send_test_email(campaign_id: int, test_email: str):
 
 
 # ---------------------------------------------------------
-# 3) SEND CAMPAIGN (SES batch send with rate limiting)
+# 3) SEND CAMPAIGN (queued as a background send job)
 # ---------------------------------------------------------
 @router.post("/campaign/send")
-def send_campaign(campaign_id: int):
-    from ses import ses
-    
+def send_campaign(campaign_id: int, shards: int = None):
+    """Queue a campaign send. The send itself runs in send_worker.py.
+
+    shards splits the audience so that many workers can send it in parallel
+    (defaults to SEND_JOB_SHARDS).
+    """
     conn = get_db()
     cur = conn.cursor()
 
     # Get campaign info
     cur.execute(
-        "SELECT subject, sender, html FROM campaigns WHERE id = %s",
+        "SELECT sender FROM campaigns WHERE id = %s",
         (campaign_id,)
     )
     camp = cur.fetchone()
 
+    cur.close()
+    conn.close()
+
     if not camp:
-        cur.close()
-        conn.close()
         return {"error": "Campaign not found"}
 
-    subject, sender, html = camp
+    sender = camp[0]
 
-    # ✅ VALIDATE SENDER BEFORE SENDING
+    # ✅ VALIDATE SENDER BEFORE QUEUEING
     is_verified, verification_message = is_sender_verified(sender)
     
     if not is_verified:
         print(f"\n⚠️ SENDER VERIFICATION FAILED:")
         print(f"   {verification_message}")
-        cur.close()
-        conn.close()
         return {
             "error": "Sender email not verified",
             "message": verification_message,
@@ -316,113 +458,27 @@ def send_campaign(campaign_id: int):
             "suggestion": "Use one of the verified identities as the sender, or verify the sender email in AWS SES console"
         }
 
-    # Get active contacts (not unsubscribed, not in suppressions)
-    cur.execute(
-        """
-        SELECT c.email FROM contacts c
-        WHERE c.unsubscribed = FALSE
-        AND NOT EXISTS (
-            SELECT 1 FROM suppressions s WHERE s.email = c.email
-        )
-        """
-    )
-    contacts = cur.fetchall()
-
-    sent = 0
-    failed = 0
-    total = len(contacts)
-    
-    print(f"\n📧 STARTING CAMPAIGN SEND:")
-    print(f"   Campaign ID: {campaign_id}")
-    print(f"   Subject: {subject}")
-    print(f"   From: {sender}")
-    print(f"   Total Contacts: {total}")
-    print(f"   AWS Region: {os.getenv('AWS_REGION')}\n")
-
-    # Process in batches with rate limiting
-    for (email,) in contacts:
-        try:
-            # Check if already sent (avoid duplicates)
-            cur.execute(
-                """
-                SELECT id FROM campaign_sends 
-                WHERE campaign_id = %s AND contact_email = %s
-                """,
-                (campaign_id, email)
-            )
-            if cur.fetchone():
-                continue  # Skip if already sent
-            
-            # Prepare HTML with tracking
-            prepared_html = prepare_email_html(html, campaign_id, email, BASE_URL)
-
-            # Send email via SES
-            response = ses.send_email(
-                Source=sender,
-                Destination={"ToAddresses": [email]},
-                Message={
-                    "Subject": {"Data": subject},
-                    "Body": {
-                        "Html": {"Data": prepared_html}
-                    }
-                }
-            )
-            
-            # Get message ID from response
-            message_id = response.get("MessageId")
-            print(f"✅ Sent to {email} (MessageId: {message_id})")
-            
-            # Record send into campaign_sends table
-            cur.execute(
-                """
-                INSERT INTO campaign_sends (campaign_id, contact_email, message_id, delivered)
-                VALUES (%s, %s, %s, TRUE)
-                """,
-                (campaign_id, email, message_id)
-            )
-            conn.commit()
-            sent += 1
-            
-            # Rate limiting: wait between sends
-            if sent < total:  # Don't wait after last email
-                time.sleep(EMAIL_SEND_DELAY)
-                
-        except Exception as e:
-            print(f"❌ Failed to send to {email}: {str(e)} ({type(e).__name__})")
-            failed += 1
-            
-            # Record failed send into campaign_sends table
-            cur.execute(
-                """
-                INSERT INTO campaign_sends (campaign_id, contact_email, delivered, bounce_type)
-                VALUES (%s, %s, FALSE, %s)
-                ON CONFLICT (campaign_id, contact_email) DO NOTHING
-                """,
-                (campaign_id, email, "soft" if "bounce" in str(e).lower() else None)
-            )
-            conn.commit()
-            
-            # Still rate limit even on failure
-            if (sent + failed) < total:
-                time.sleep(EMAIL_SEND_DELAY)
-            
-            continue
-
-    cur.close()
-    conn.close()
-    
-    print(f"\n📊 CAMPAIGN SEND COMPLETE:")
-    print(f"   Sent: {sent}/{total}")
-    print(f"   Failed: {failed}/{total}\n")
+    job, created = enqueue_job(campaign_id, shards)
+    print(f"📥 Campaign {campaign_id} send {'queued' if created else 'already in progress'} (job {job['id']})")
 
     return {
-        "status": "completed",
-        "total_sent": sent,
-        "total_failed": failed,
-        "total_contacts": total
+        "status": job["status"],
+        "job_id": job["id"],
+        "campaign_id": campaign_id,
+        "shards": job["shard_count"],
+        "message": "Send queued" if created else "A send for this campaign is already queued or running"
     }
 
 
+@router.get("/campaign/send/{job_id}")
+def get_send_status(job_id: int):
+    """Get progress of a campaign send job"""
+    job = get_job(job_id)
+    if not job:
+        return JSONResponse(status_code=404, content={"error": "Send job not found"})
+    return job_to_dict(job)
+
+
 # ---------------------------------------------------------
 # 4) LIST ALL CAMPAIGNS
 # ---------------------------------------------------------
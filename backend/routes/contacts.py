@@ -1,45 +1,74 @@
+import os
 from fastapi import APIRouter, UploadFile, File
-import pandas as pd
-from database import get_db
+from fastapi.responses import JSONResponse
+from contact_import import read_header, ImportFormatError
+from import_jobs import (
+    spool_upload, remove_spooled, spool_is_local, create_job, get_job, cancel_job, resume_job, job_to_dict,
+    import_worker
+)
 
 router = APIRouter()
 
+# Sync handler: copying the upload to the spool blocks on disk, so it runs
+# in the threadpool. The import itself runs in the background (import_jobs.py).
 @router.post("/contacts/upload")
-async def upload_contacts(file: UploadFile = File(...)):
+def upload_contacts(file: UploadFile = File(...)):
     print(f"📤 CSV Upload Started: {file.filename}")
-    
-    df = pd.read_csv(file.file)
-    total_rows = len(df)
-    print(f"📊 CSV File Read: {total_rows} rows found")
-    
-    conn = get_db()
-    cur = conn.cursor()
-
-    inserted = 0
-    skipped = 0
-
-    print(f"🔄 Processing contacts...")
-    for index, row in df.iterrows():
-        try:
-            cur.execute(
-                "INSERT INTO contacts (email, name) VALUES (%s, %s) ON CONFLICT (email) DO NOTHING",
-                (row["email"], row.get("name", None))
-            )
-            if cur.rowcount > 0:
-                inserted += 1
-            else:
-                skipped += 1
-        except Exception as e:
-            print(f"❌ Error inserting row {index}: {str(e)}")
-            skipped += 1
-
-    conn.commit()
-    cur.close()
-    conn.close()
-
-    print(f"✅ Upload Complete!")
-    print(f"   ✓ Inserted: {inserted} contacts")
-    print(f"   ⚠ Skipped: {skipped} contacts (duplicates or errors)")
-    print(f"   📈 Total processed: {total_rows} rows\n")
-
-    return {"status": "uploaded", "inserted": inserted, "skipped": skipped, "total": total_rows}
+
+    path = None
+    try:
+        path, size = spool_upload(file.file)
+
+        # Reject files without an email column now rather than in the job
+        with open(path, "rb") as f:
+            read_header(f)
+
+        job = create_job(file.filename, path, size)
+    except ImportFormatError as e:
+        remove_spooled(path)
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except Exception as e:
+        if path:
+            remove_spooled(path)
+        print(f"❌ Upload failed: {str(e)}")
+        return JSONResponse(status_code=500, content={"error": "Failed to queue contact import", "details": str(e)})
+
+    import_worker.wake()
+    print(f"📥 Import job {job['id']} queued ({size / 1024:.2f} KB)")
+
+    return {"status": "queued", "job_id": job["id"], "total_bytes": size}
+
+
+@router.get("/contacts/import/{job_id}")
+def get_import_status(job_id: int):
+    """Progress of a contact import job: rows imported, rows/sec and ETA"""
+    job = get_job(job_id)
+    if not job:
+        return JSONResponse(status_code=404, content={"error": "Import job not found"})
+    return job_to_dict(job)
+
+
+@router.post("/contacts/import/{job_id}/cancel")
+def cancel_import(job_id: int):
+    """Stop an import after its current chunk; contacts already imported are kept"""
+    job = cancel_job(job_id)
+    if not job:
+        return JSONResponse(status_code=409, content={"error": "Import job not found or already finished"})
+    return job_to_dict(job)
+
+
+@router.post("/contacts/import/{job_id}/resume")
+def resume_import(job_id: int):
+    """Continue a cancelled or failed import from its last committed chunk"""
+    job = get_job(job_id)
+    if not job:
+        return JSONResponse(status_code=404, content={"error": "Import job not found"})
+    # Only checkable on the host holding the file; elsewhere that host's worker reports it
+    if spool_is_local(job) and not os.path.exists(job["path"]):
+        return JSONResponse(status_code=409, content={"error": "The uploaded file is no longer available"})
+
+    job = resume_job(job_id)
+    if not job:
+        return JSONResponse(status_code=409, content={"error": "Only cancelled or failed imports can be resumed"})
+    import_worker.wake()
+    return job_to_dict(job)
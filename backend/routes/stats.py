@@ -1,47 +1,100 @@
-from fastapi import APIRouter
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Query
+from fastapi.responses import JSONResponse, StreamingResponse
+from datetime import datetime, timedelta
+import queue
+import threading
+import zlib
 from database import get_db
+from hll import HyperLogLog
+from stats_cache import stats_cache
 
 router = APIRouter()
 
 
-@router.get("/stats/dashboard")
-def get_dashboard_stats():
-    """Get dashboard statistics"""
-    conn = get_db()
-    cur = conn.cursor()
+# Sends, bounces and engagement come from the counter tables kept up to date
+# by the writers (see stats_rollup.py), so these are single-row lookups no
+# matter how much history there is. Dashboard opens/clicks are the sum of
+# each campaign's unique openers/clickers.
+DASHBOARD_STATS_SQL = """
+    SELECT
+        (SELECT COUNT(*) FROM campaigns),
+        ct.contacts, ct.active_contacts,
+        g.sent, g.delivered, g.unique_opens, g.unique_clicks
+    FROM global_stats g, (
+        SELECT COUNT(*) AS contacts,
+               COUNT(*) FILTER (WHERE unsubscribed = FALSE) AS active_contacts
+        FROM contacts
+    ) ct
+    WHERE g.id = 1
+"""
 
-    try:
-        # Total campaigns
-        cur.execute("SELECT COUNT(*) FROM campaigns")
-        total_campaigns = cur.fetchone()[0]
+CAMPAIGN_STATS_SQL = """
+    SELECT COALESCE(s.sent, 0), COALESCE(s.delivered, 0), COALESCE(s.bounces, 0),
+           COALESCE(s.unique_opens, 0), COALESCE(s.unique_clicks, 0)
+    FROM campaigns ca
+    LEFT JOIN campaign_stats s ON s.campaign_id = ca.id
+    WHERE ca.id = %s
+"""
 
-        # Total contacts
-        cur.execute("SELECT COUNT(*) FROM contacts")
-        total_contacts = cur.fetchone()[0]
 
-        # Active contacts (not unsubscribed)
-        cur.execute("SELECT COUNT(*) FROM contacts WHERE unsubscribed = FALSE")
-        active_contacts = cur.fetchone()[0]
+def _merge_sketch_rows(rows) -> dict:
+    """Merge (key, sketch bytes) rows into {key: distinct count}"""
+    merged = {}
+    for key, data in rows:
+        sketch = HyperLogLog.from_bytes(data)
+        if key in merged:
+            merged[key].merge(sketch)
+        else:
+            merged[key] = sketch
+    return {key: sketch.count() for key, sketch in merged.items()}
 
-        # Total emails sent
-        cur.execute("SELECT COUNT(*) FROM campaign_sends")
-        total_sent = cur.fetchone()[0]
 
-        # Total delivered (sent and not bounced)
-        cur.execute("""
-            SELECT COUNT(*) FROM campaign_sends 
-            WHERE delivered = TRUE OR (delivered = FALSE AND bounce_type IS NULL)
-        """)
-        total_delivered = cur.fetchone()[0]
+def _approximate_uniques(cur, campaign_id: int = None) -> tuple:
+    """
+    (openers, clickers) from the HyperLogLog sketches. Without campaign_id
+    they are summed over campaigns, like the exact dashboard counters.
+    """
+    sql = "SELECT campaign_id, event_type, sketch FROM campaign_sketches WHERE bucket = '-infinity'"
+    if campaign_id is None:
+        cur.execute(sql)
+    else:
+        cur.execute(sql + " AND campaign_id = %s", (campaign_id,))
+    counts = _merge_sketch_rows(((cid, event_type), data) for cid, event_type, data in cur.fetchall())
+    opens = sum(n for (_, event_type), n in counts.items() if event_type == "open")
+    clicks = sum(n for (_, event_type), n in counts.items() if event_type == "click")
+    return opens, clicks
 
-        # Total opens
-        cur.execute("SELECT COUNT(DISTINCT contact_email) FROM events WHERE event_type = 'open'")
-        total_opens = cur.fetchone()[0]
 
-        # Total clicks
-        cur.execute("SELECT COUNT(DISTINCT contact_email) FROM events WHERE event_type = 'click'")
-        total_clicks = cur.fetchone()[0]
+def _approximate_distinct_contacts(cur) -> tuple:
+    """Estimated distinct contacts who opened / clicked any campaign (sketches merged across campaigns)"""
+    cur.execute("SELECT event_type, sketch FROM campaign_sketches WHERE bucket = '-infinity'")
+    counts = _merge_sketch_rows(cur.fetchall())
+    return counts.get("open", 0), counts.get("click", 0)
+
+
+@router.get("/stats/dashboard")
+def get_dashboard_stats(approximate: bool = False):
+    """
+    Get dashboard statistics. With approximate=true, opens/clicks are
+    estimated from sketches (about 1% error per campaign), and
+    distinct_openers/distinct_clickers estimate the contacts who opened or
+    clicked any campaign.
+    """
+    return stats_cache.get_or_compute(("dashboard", approximate), lambda: _compute_dashboard_stats(approximate))
+
+
+def _compute_dashboard_stats(approximate: bool = False):
+    conn = get_db()
+    cur = conn.cursor()
+
+    try:
+        cur.execute(DASHBOARD_STATS_SQL)
+        (total_campaigns, total_contacts, active_contacts,
+         total_sent, total_delivered, total_opens, total_clicks) = cur.fetchone()
+        extra = {}
+        if approximate:
+            total_opens, total_clicks = _approximate_uniques(cur)
+            extra["distinct_openers"], extra["distinct_clickers"] = _approximate_distinct_contacts(cur)
 
         # Calculate rates
         open_rate = (total_opens / total_delivered * 100) if total_delivered > 0 else 0
@@ -56,7 +109,9 @@ def get_dashboard_stats():
             "opens": total_opens,
             "clicks": total_clicks,
             "open_rate": round(open_rate, 2),
-            "click_rate": round(click_rate, 2)
+            "click_rate": round(click_rate, 2),
+            "approximate": approximate,
+            **extra
         }
 
     except Exception as e:
@@ -77,55 +132,25 @@ def get_dashboard_stats():
 
 
 @router.get("/stats/campaign/{campaign_id}")
-def get_campaign_stats(campaign_id: int):
-    """Get statistics for a specific campaign"""
+def get_campaign_stats(campaign_id: int, approximate: bool = False):
+    """Get statistics for a specific campaign (opens/clicks estimated from sketches with approximate=true)"""
+    return stats_cache.get_or_compute(
+        ("campaign", campaign_id, approximate), lambda: _compute_campaign_stats(campaign_id, approximate)
+    )
+
+
+def _compute_campaign_stats(campaign_id: int, approximate: bool = False):
     conn = get_db()
     cur = conn.cursor()
 
     try:
-        # Check if campaign exists
-        cur.execute("SELECT id FROM campaigns WHERE id = %s", (campaign_id,))
-        if not cur.fetchone():
+        cur.execute(CAMPAIGN_STATS_SQL, (campaign_id,))
+        row = cur.fetchone()
+        if not row:
             return JSONResponse(status_code=404, content={"error": "Campaign not found"})
-
-        # Total sent
-        cur.execute(
-            "SELECT COUNT(*) FROM campaign_sends WHERE campaign_id = %s",
-            (campaign_id,)
-        )
-        sent = cur.fetchone()[0]
-
-        # Total delivered
-        cur.execute(
-            """
-            SELECT COUNT(*) FROM campaign_sends 
-            WHERE campaign_id = %s 
-            AND (delivered = TRUE OR (delivered = FALSE AND bounce_type IS NULL))
-            """,
-            (campaign_id,)
-        )
-        delivered = cur.fetchone()[0]
-
-        # Total opens
-        cur.execute(
-            "SELECT COUNT(DISTINCT contact_email) FROM events WHERE campaign_id = %s AND event_type = 'open'",
-            (campaign_id,)
-        )
-        opens = cur.fetchone()[0]
-
-        # Total clicks
-        cur.execute(
-            "SELECT COUNT(DISTINCT contact_email) FROM events WHERE campaign_id = %s AND event_type = 'click'",
-            (campaign_id,)
-        )
-        clicks = cur.fetchone()[0]
-
-        # Bounces
-        cur.execute(
-            "SELECT COUNT(*) FROM campaign_sends WHERE campaign_id = %s AND bounce_type IS NOT NULL",
-            (campaign_id,)
-        )
-        bounces = cur.fetchone()[0]
+        sent, delivered, bounces, opens, clicks = row
+        if approximate:
+            opens, clicks = _approximate_uniques(cur, campaign_id)
 
         open_rate = (opens / delivered * 100) if delivered > 0 else 0
         click_rate = (clicks / delivered * 100) if delivered > 0 else 0
@@ -138,7 +163,8 @@ def get_campaign_stats(campaign_id: int):
             "clicks": clicks,
             "bounces": bounces,
             "open_rate": round(open_rate, 2),
-            "click_rate": round(click_rate, 2)
+            "click_rate": round(click_rate, 2),
+            "approximate": approximate
         }
 
     except Exception as e:
@@ -154,3 +180,292 @@ def get_campaign_stats(campaign_id: int):
             conn.close()
         except Exception:
             pass
+
+
+@router.get("/stats/campaign/{campaign_id}/links")
+def get_campaign_link_stats(campaign_id: int):
+    """Get click counts for each registered link of a campaign"""
+    conn = get_db()
+    cur = conn.cursor()
+
+    try:
+        cur.execute(
+            """
+            SELECT l.id, l.link_index, l.url,
+                   COUNT(e.id) AS clicks,
+                   COUNT(DISTINCT e.contact_email) AS unique_clicks
+            FROM campaign_links l
+            LEFT JOIN events e
+              ON e.campaign_id = l.campaign_id
+             AND e.event_type = 'click'
+             AND (e.metadata->>'link_id')::integer = l.id
+            WHERE l.campaign_id = %s
+            GROUP BY l.id, l.link_index, l.url
+            ORDER BY l.link_index
+            """,
+            (campaign_id,)
+        )
+        links = [
+            {"link_id": row[0], "link_index": row[1], "url": row[2], "clicks": row[3], "unique_clicks": row[4]}
+            for row in cur.fetchall()
+        ]
+
+        return {"campaign_id": campaign_id, "links": links}
+
+    except Exception as e:
+        print(f"Error in get_campaign_link_stats({campaign_id}): {e}")
+        return JSONResponse(status_code=500, content={"error": "Failed to fetch link stats", "details": str(e)})
+
+    finally:
+        try:
+            cur.close()
+        except Exception:
+            pass
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+TIMESERIES_INTERVALS = ("minute", "hour", "day")
+
+# Cursors are moved back by this much, so buckets updated by transactions
+# that were still open when the cursor was taken are returned next time
+TIMESERIES_CURSOR_OVERLAP = timedelta(seconds=5)
+
+# Periods touched since the cursor, each re-summed from its minute buckets
+TIMESERIES_SQL = """
+    WITH changed AS (
+        SELECT DISTINCT date_trunc(%(interval)s, bucket) AS period
+        FROM campaign_stats_buckets
+        WHERE campaign_id = %(campaign_id)s AND updated_at > %(since)s
+    )
+    SELECT date_trunc(%(interval)s, b.bucket) AS period,
+           SUM(b.sends), SUM(b.bounces), SUM(b.opens), SUM(b.clicks)
+    FROM campaign_stats_buckets b
+    WHERE b.campaign_id = %(campaign_id)s
+    AND date_trunc(%(interval)s, b.bucket) IN (SELECT period FROM changed)
+    GROUP BY 1
+    ORDER BY 1 DESC
+    LIMIT %(limit)s
+"""
+
+
+@router.get("/stats/campaign/{campaign_id}/timeseries")
+def get_campaign_timeseries(campaign_id: int, interval: str = "minute", since: str = None, limit: int = 1440,
+                            approximate: bool = False):
+    """
+    Sends, bounces, opens and clicks per minute, hour or day.
+
+    Pass the returned cursor as since= to get only the periods that changed
+    (new or updated) since the previous call. With approximate=true (hour or
+    day only), each point also has the estimated distinct openers and
+    clickers in that period, merged from the hourly sketches.
+    """
+    if interval not in TIMESERIES_INTERVALS:
+        return JSONResponse(status_code=400, content={"error": f"interval must be one of {', '.join(TIMESERIES_INTERVALS)}"})
+    if approximate and interval == "minute":
+        return JSONResponse(status_code=400, content={"error": "approximate needs interval=hour or interval=day"})
+    try:
+        since_at = datetime.fromisoformat(since) if since else datetime.min
+    except ValueError:
+        return JSONResponse(status_code=400, content={"error": "Invalid since cursor"})
+    limit = max(1, min(limit, 10000))
+
+    conn = get_db()
+    cur = conn.cursor()
+
+    try:
+        cur.execute("SELECT id, LOCALTIMESTAMP FROM campaigns WHERE id = %s", (campaign_id,))
+        row = cur.fetchone()
+        if not row:
+            return JSONResponse(status_code=404, content={"error": "Campaign not found"})
+        now = row[1]
+
+        cur.execute(TIMESERIES_SQL, {
+            "interval": interval, "campaign_id": campaign_id, "since": since_at, "limit": limit
+        })
+        rows = list(reversed(cur.fetchall()))
+        points = [
+            {"t": period.isoformat(), "sends": sends, "bounces": bounces, "opens": opens, "clicks": clicks}
+            for period, sends, bounces, opens, clicks in rows
+        ]
+
+        if approximate and rows:
+            cur.execute(
+                """
+                SELECT date_trunc(%s, bucket), event_type, sketch FROM campaign_sketches
+                WHERE campaign_id = %s AND bucket <> '-infinity'
+                AND date_trunc(%s, bucket) = ANY(%s)
+                """,
+                (interval, campaign_id, interval, [row[0] for row in rows])
+            )
+            uniques = _merge_sketch_rows(((period, event_type), data) for period, event_type, data in cur.fetchall())
+            for point, row in zip(points, rows):
+                point["unique_opens"] = uniques.get((row[0], "open"), 0)
+                point["unique_clicks"] = uniques.get((row[0], "click"), 0)
+
+        return {
+            "campaign_id": campaign_id,
+            "interval": interval,
+            "points": points,
+            "cursor": (now - TIMESERIES_CURSOR_OVERLAP).isoformat()
+        }
+
+    except Exception as e:
+        print(f"Error in get_campaign_timeseries({campaign_id}): {e}")
+        return JSONResponse(status_code=500, content={"error": "Failed to fetch campaign timeseries", "details": str(e)})
+
+    finally:
+        try:
+            cur.close()
+        except Exception:
+            pass
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+# Per-recipient results: the send row plus a summary of its opens and clicks.
+# Ordered by the (campaign_id, contact_email) unique index and joined per row,
+# so Postgres streams rows out from the start instead of sorting or hashing
+# the whole campaign first.
+EXPORT_SQL = """
+    SELECT cs.contact_email AS email, cs.message_id, cs.sent_at, cs.delivered, cs.bounce_type,
+           cs.complaint, cs.open_count, e.first_open_at, e.first_click_at, COALESCE(e.clicks, 0) AS clicks
+    FROM campaign_sends cs
+    LEFT JOIN LATERAL (
+        SELECT MIN(created_at) FILTER (WHERE event_type = 'open') AS first_open_at,
+               MIN(created_at) FILTER (WHERE event_type = 'click') AS first_click_at,
+               COUNT(*) FILTER (WHERE event_type = 'click') AS clicks
+        FROM events ev
+        WHERE ev.campaign_id = cs.campaign_id AND ev.contact_email = cs.contact_email
+        AND ev.event_type IN ('open', 'click')
+    ) e ON TRUE
+    WHERE cs.campaign_id = %s
+    ORDER BY cs.contact_email
+"""
+
+EXPORT_FORMATS = {
+    "csv": ("COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true)", "text/csv"),
+    # CSV mode with quote/delimiter characters that row_to_json never emits
+    # unescaped: each line is the JSON as-is (text mode would double backslashes)
+    "ndjson": (
+        "COPY (SELECT row_to_json(t) FROM ({query}) t) TO STDOUT WITH (FORMAT csv, QUOTE e'\\x01', DELIMITER e'\\x02')",
+        "application/x-ndjson"
+    ),
+}
+
+# COPY output chunks buffered between Postgres and the client
+EXPORT_QUEUE_CHUNKS = 64
+
+
+class _QueueWriter:
+    """File-like target for copy_expert that hands chunks to the response"""
+
+    def __init__(self, chunks: queue.Queue, cancelled: threading.Event):
+        self.chunks = chunks
+        self.cancelled = cancelled
+
+    def write(self, data):
+        # Blocks while the client is slower than Postgres (constant memory)
+        while True:
+            if self.cancelled.is_set():
+                raise IOError("Export cancelled")
+            try:
+                self.chunks.put(bytes(data), timeout=1)
+                return len(data)
+            except queue.Full:
+                continue
+
+
+def _stream_copy(conn, copy_sql: str, use_gzip: bool):
+    """Run COPY ... TO STDOUT in a thread and yield its output as it arrives"""
+    chunks = queue.Queue(maxsize=EXPORT_QUEUE_CHUNKS)
+    cancelled = threading.Event()
+    done = object()
+
+    def produce():
+        cur = conn.cursor()
+        try:
+            cur.copy_expert(copy_sql, _QueueWriter(chunks, cancelled))
+        except Exception as e:
+            if not cancelled.is_set():
+                print(f"Error streaming export: {e}")
+                chunks.put(e)
+        finally:
+            try:
+                cur.close()
+                conn.close()
+            except Exception:
+                pass
+            if not cancelled.is_set():
+                chunks.put(done)
+
+    threading.Thread(target=produce, name="stats-export", daemon=True).start()
+
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if use_gzip else None
+    finished = False
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is done:
+                finished = True
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            if compressor:
+                chunk = compressor.compress(chunk)
+                if not chunk:
+                    continue
+            yield chunk
+        if compressor:
+            yield compressor.flush()
+    finally:
+        # Client went away: stop the COPY and unblock the producer
+        if not finished:
+            cancelled.set()
+            try:
+                conn.cancel()
+            except Exception:
+                pass
+            while not chunks.empty():
+                chunks.get_nowait()
+
+
+@router.get("/stats/campaign/{campaign_id}/export")
+def export_campaign_results(campaign_id: int, format: str = "csv", use_gzip: bool = Query(False, alias="gzip")):
+    """Stream per-recipient send results and engagement as CSV or NDJSON (optionally gzipped)"""
+    if format not in EXPORT_FORMATS:
+        return JSONResponse(status_code=400, content={"error": f"format must be one of {', '.join(EXPORT_FORMATS)}"})
+
+    conn = get_db()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT id FROM campaigns WHERE id = %s", (campaign_id,))
+        exists = cur.fetchone() is not None
+        query = cur.mogrify(EXPORT_SQL, (campaign_id,)).decode()
+        cur.close()
+        # COPY runs in its own transaction, so the export is one consistent snapshot
+        conn.rollback()
+    except Exception as e:
+        conn.close()
+        print(f"Error in export_campaign_results({campaign_id}): {e}")
+        return JSONResponse(status_code=500, content={"error": "Failed to export campaign", "details": str(e)})
+
+    if not exists:
+        conn.close()
+        return JSONResponse(status_code=404, content={"error": "Campaign not found"})
+
+    copy_template, media_type = EXPORT_FORMATS[format]
+    filename = f"campaign-{campaign_id}.{format}"
+    if use_gzip:
+        media_type = "application/gzip"
+        filename += ".gz"
+
+    return StreamingResponse(
+        _stream_copy(conn, copy_template.format(query=query), use_gzip),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
@@ -1,9 +1,86 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, Header
 from fastapi.responses import Response, RedirectResponse
-from database import get_db
+from starlette.concurrency import run_in_threadpool
+from database import pooled_db
+from event_queue import event_buffer, valid_event
+from tracking_filter import open_filter, classify_user_agent, TRACKING_IGNORE_BOTS
+from routes.unsubscribe import SECRET_KEY
+import base64
+import binascii
+import hashlib
+import hmac
+import os
+import struct
+import threading
+from collections import OrderedDict
 
 router = APIRouter()
 
+# (campaign_id, link_index) -> (link_id, url) entries kept in memory
+LINK_CACHE_SIZE = int(os.getenv("LINK_CACHE_SIZE", "10000"))
+
+TRACKING_TOKEN_VERSION = 1
+
+# Link index used in open-pixel tokens
+OPEN_LINK_INDEX = 0xFFFFFF
+
+# Longest redirect target accepted by the legacy /t/click endpoint
+MAX_URL_LENGTH = 2048
+
+
+# ---------------------------------------------------------
+# Signed tracking tokens
+# ---------------------------------------------------------
+# Token bytes: link index (3) | version (1) | campaign id (4) | signature (8) | email
+# base64url without padding. The link index fills exactly one base64
+# group, so a token is link_token_prefix(index) + encode_recipient_token():
+# the recipient part is computed once per email and shared by every link.
+def _sign(payload: bytes) -> bytes:
+    return hmac.new(SECRET_KEY.encode(), b"track:" + payload, hashlib.sha256).digest()[:8]
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def encode_recipient_token(campaign_id: int, contact_email: str) -> str:
+    """Signed campaign + recipient part of a tracking token"""
+    header = struct.pack(">BI", TRACKING_TOKEN_VERSION, campaign_id)
+    email_bytes = contact_email.encode()
+    return _b64(header + _sign(header + email_bytes) + email_bytes)
+
+
+def link_token_prefix(link_index: int) -> str:
+    return _b64(link_index.to_bytes(3, "big"))
+
+
+def make_tracking_token(campaign_id: int, contact_email: str, link_index: int = OPEN_LINK_INDEX) -> str:
+    return link_token_prefix(link_index) + encode_recipient_token(campaign_id, contact_email)
+
+
+def decode_tracking_token(token: str):
+    """Return (campaign_id, contact_email, link_index), or None if invalid"""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+    except (binascii.Error, ValueError):
+        return None
+    if len(raw) < 16:
+        return None
+
+    link_index = int.from_bytes(raw[:3], "big")
+    version, campaign_id = struct.unpack(">BI", raw[3:8])
+    signature, email_bytes = raw[8:16], raw[16:]
+    if version != TRACKING_TOKEN_VERSION or not hmac.compare_digest(signature, _sign(raw[3:8] + email_bytes)):
+        return None
+
+    try:
+        email = email_bytes.decode()
+    except UnicodeDecodeError:
+        return None
+    if not valid_event(campaign_id, email):
+        return None
+    return campaign_id, email, link_index
+
 # 1x1 transparent GIF (for open tracking pixel)
 GIF_1x1 = (
     b"GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!"
@@ -12,45 +89,142 @@ GIF_1x1 = (
 )
 
 
+# ---------------------------------------------------------
+# Link registry lookup (LRU cached)
+# ---------------------------------------------------------
+class LinkCache:
+    """Thread-safe LRU of (campaign_id, link_index) -> (link_id, url)"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+link_cache = LinkCache(LINK_CACHE_SIZE)
+
+
+def load_campaign_link(campaign_id: int, link_index: int):
+    """Look a link up in campaign_links and cache it. Returns (link_id, url) or None."""
+    # Cache misses happen on the click path, so reuse pooled connections
+    with pooled_db() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                "SELECT id, url FROM campaign_links WHERE campaign_id = %s AND link_index = %s",
+                (campaign_id, link_index)
+            )
+            row = cur.fetchone()
+        finally:
+            cur.close()
+
+    if not row:
+        return None
+    link_cache.put((campaign_id, link_index), (row[0], row[1]))
+    return row[0], row[1]
+
+
+def record_open(campaign_id: int, email: str, user_agent: str):
+    """Queue the first open per recipient; repeats only bump the open counter"""
+    kind, proxy = classify_user_agent(user_agent)
+    if kind == "bot" and TRACKING_IGNORE_BOTS:
+        open_filter.count_bot()
+        return
+
+    event_buffer.count_open(campaign_id, email)
+    if open_filter.first_open(campaign_id, email):
+        metadata = {"proxy": proxy} if proxy else None
+        if not event_buffer.enqueue(campaign_id, email, "open", metadata):
+            # Dropped: let the next pixel load try again
+            open_filter.forget(campaign_id, email)
+
+
+def record_click(campaign_id: int, email: str, user_agent: str, metadata: dict = None):
+    """Queue a click unless it came from a link scanner"""
+    kind, _ = classify_user_agent(user_agent)
+    if kind == "bot" and TRACKING_IGNORE_BOTS:
+        open_filter.count_bot()
+        return
+    event_buffer.enqueue(campaign_id, email, "click", metadata)
+
+
+# The handlers are async: they only hand the event to the in-memory buffer
+# (a non-blocking put), so they run on the event loop without taking a
+# threadpool slot or a database connection.
+@router.get("/t/o/{token}")
+async def track_open_token(token: str, user_agent: str = Header(None)):
+    """Track email open from a signed tracking token"""
+    decoded = decode_tracking_token(token)
+    if decoded:
+        campaign_id, email, _ = decoded
+        record_open(campaign_id, email, user_agent)
+
+    return Response(content=GIF_1x1, media_type="image/gif")
+
+
+@router.get("/t/c/{token}")
+async def track_click_token(token: str, user_agent: str = Header(None)):
+    """Track link click from a signed tracking token and redirect to the registered link"""
+    decoded = decode_tracking_token(token)
+    if not decoded:
+        raise HTTPException(status_code=404, detail="Link not found")
+    campaign_id, email, link_index = decoded
+
+    link = link_cache.get((campaign_id, link_index))
+    if link is None:
+        # Cache miss: the DB lookup runs in the threadpool, off the event loop
+        link = await run_in_threadpool(load_campaign_link, campaign_id, link_index)
+        if link is None:
+            raise HTTPException(status_code=404, detail="Link not found")
+    link_id, url = link
+
+    record_click(campaign_id, email, user_agent, {"link_id": link_id})
+    return RedirectResponse(url=url, status_code=302)
+
+
+# Legacy query-string endpoints, for emails sent before signed tokens
 @router.get("/t/open")
-def track_open(campaign_id: int, email: str):
+async def track_open(campaign_id: int, email: str, user_agent: str = Header(None)):
     """Track email open by returning a 1x1 pixel"""
-    try:
-        conn = get_db()
-        cur = conn.cursor()
-        
-        # Record open event
-        cur.execute(
-            "INSERT INTO events (campaign_id, contact_email, event_type) VALUES (%s, %s, 'open')",
-            (campaign_id, email)
-        )
-        conn.commit()
-        cur.close()
-        conn.close()
-    except Exception as e:
-        print(f"Error tracking open: {e}")
+    if not valid_event(campaign_id, email):
+        raise HTTPException(status_code=400, detail="Invalid campaign_id or email")
+
+    # Record open event (written to the DB in batches in the background)
+    record_open(campaign_id, email, user_agent)
     
-    # Always return the pixel (even if DB insert fails)
+    # Always return the pixel (even if the event is dropped)
     return Response(content=GIF_1x1, media_type="image/gif")
 
 
 @router.get("/t/click")
-def track_click(campaign_id: int, email: str, url: str):
+async def track_click(campaign_id: int, email: str, url: str, user_agent: str = Header(None)):
     """Track link click and redirect to original URL"""
-    try:
-        conn = get_db()
-        cur = conn.cursor()
-        
-        # Record click event
-        cur.execute(
-            "INSERT INTO events (campaign_id, contact_email, event_type) VALUES (%s, %s, 'click')",
-            (campaign_id, email)
-        )
-        conn.commit()
-        cur.close()
-        conn.close()
-    except Exception as e:
-        print(f"Error tracking click: {e}")
+    if not valid_event(campaign_id, email):
+        raise HTTPException(status_code=400, detail="Invalid campaign_id or email")
+    if len(url) > MAX_URL_LENGTH or "\x00" in url:
+        raise HTTPException(status_code=400, detail="Invalid url")
+
+    # Record click event (written to the DB in batches in the background)
+    record_click(campaign_id, email, user_agent)
     
     # Redirect to original URL
     return RedirectResponse(url=url, status_code=302)
@@ -1,5 +1,7 @@
 from fastapi import APIRouter, Request, HTTPException
 from database import get_db
+from stats_cache import notify_stats_changed
+from stats_rollup import add_counts, add_bucket_counts
 import json
 
 router = APIRouter()
@@ -22,11 +24,12 @@ async def ses_webhook(request: Request):
                 if message.get("notificationType") == "Bounce":
                     bounce = message.get("bounce", {})
                     bounce_type = "hard" if bounce.get("bounceType") == "Permanent" else "soft"
+                    message_id = message.get("mail", {}).get("messageId")
                     
                     for recipient in bounce.get("bouncedRecipients", []):
                         email = recipient.get("emailAddress")
                         if email:
-                            _handle_bounce(email, bounce_type)
+                            _handle_bounce(email, bounce_type, message_id)
                 
                 # Handle complaint
                 elif message.get("notificationType") == "Complaint":
@@ -42,11 +45,12 @@ async def ses_webhook(request: Request):
             if body["notificationType"] == "Bounce":
                 bounce = body.get("bounce", {})
                 bounce_type = "hard" if bounce.get("bounceType") == "Permanent" else "soft"
+                message_id = body.get("mail", {}).get("messageId")
                 
                 for recipient in bounce.get("bouncedRecipients", []):
                     email = recipient.get("emailAddress")
                     if email:
-                        _handle_bounce(email, bounce_type)
+                        _handle_bounce(email, bounce_type, message_id)
             
             elif body["notificationType"] == "Complaint":
                 complaint = body.get("complaint", {})
@@ -64,7 +68,7 @@ async def ses_webhook(request: Request):
         return {"status": "error", "message": str(e)}
 
 
-def _handle_bounce(email: str, bounce_type: str):
+def _handle_bounce(email: str, bounce_type: str, message_id: str = None):
     """Handle bounce - add to suppressions and mark contact as unsubscribed"""
     conn = get_db()
     cur = conn.cursor()
@@ -96,7 +100,22 @@ def _handle_bounce(email: str, bounce_type: str):
                 """,
                 (email, f'{{"bounce_type": "{bounce_type}"}}')
             )
+
+        # Mark the campaign send as bounced (it was counted as delivered until now)
+        if message_id:
+            cur.execute(
+                """
+                UPDATE campaign_sends SET bounce_type = %s, delivered = FALSE
+                WHERE message_id = %s AND contact_email = %s AND bounce_type IS NULL
+                RETURNING campaign_id, date_trunc('minute', LOCALTIMESTAMP)
+                """,
+                (bounce_type, message_id, email)
+            )
+            bounced = cur.fetchall()
+            add_counts(cur, {campaign_id: {"delivered": -1, "bounces": 1} for campaign_id, _ in bounced})
+            add_bucket_counts(cur, {(campaign_id, minute): {"bounces": 1} for campaign_id, minute in bounced})
         
+        notify_stats_changed(cur)
         conn.commit()
     except Exception as e:
         conn.rollback()
@@ -138,6 +157,7 @@ def _handle_complaint(email: str):
             (email,)
         )
         
+        notify_stats_changed(cur)
         conn.commit()
     except Exception as e:
         conn.rollback()
@@ -25,21 +25,91 @@ CREATE TABLE IF NOT EXISTS campaign_sends (
     id SERIAL PRIMARY KEY,
     campaign_id INTEGER REFERENCES campaigns(id) ON DELETE CASCADE,
     contact_email VARCHAR(255) REFERENCES contacts(email) ON DELETE CASCADE,
+    message_id VARCHAR(255), -- SES MessageId
     sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     delivered BOOLEAN DEFAULT FALSE,
     bounce_type VARCHAR(50), -- 'hard', 'soft', null
     complaint BOOLEAN DEFAULT FALSE,
+    open_count INTEGER NOT NULL DEFAULT 0, -- Every pixel load (events keeps only the first open)
     UNIQUE(campaign_id, contact_email)
 );
 
+-- Older databases were created before these columns were added
+ALTER TABLE campaign_sends ADD COLUMN IF NOT EXISTS message_id VARCHAR(255);
+ALTER TABLE campaign_sends ADD COLUMN IF NOT EXISTS open_count INTEGER NOT NULL DEFAULT 0;
+
 -- Events table for tracking opens, clicks, etc.
+-- Partitioned by month on created_at; partitions (events_YYYY_MM and
+-- events_default) are created by event_partitions.py, which also drops or
+-- detaches expired months. Databases created before partitioning are
+-- converted with partition_events.py.
 CREATE TABLE IF NOT EXISTS events (
-    id SERIAL PRIMARY KEY,
+    id BIGSERIAL,
     campaign_id INTEGER REFERENCES campaigns(id) ON DELETE CASCADE,
     contact_email VARCHAR(255) REFERENCES contacts(email) ON DELETE CASCADE,
     event_type VARCHAR(50) NOT NULL, -- 'open', 'click', 'bounce', 'complaint'
     metadata JSONB, -- For storing click URLs, bounce reasons, etc.
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- Campaign links table (tracked URLs; click tokens carry the link index)
+CREATE TABLE IF NOT EXISTS campaign_links (
+    id SERIAL PRIMARY KEY,
+    campaign_id INTEGER REFERENCES campaigns(id) ON DELETE CASCADE,
+    link_index INTEGER NOT NULL, -- Position of the link in the campaign HTML
+    url TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(campaign_id, link_index)
+);
+
+-- Stats counters, updated incrementally by the send pipeline, the tracking
+-- writer and the SES webhooks; rebuilt from the raw tables by stats_rollup.py
+CREATE TABLE IF NOT EXISTS campaign_stats (
+    campaign_id INTEGER PRIMARY KEY REFERENCES campaigns(id) ON DELETE CASCADE,
+    sent INTEGER NOT NULL DEFAULT 0,
+    delivered INTEGER NOT NULL DEFAULT 0,
+    bounces INTEGER NOT NULL DEFAULT 0,
+    unique_opens INTEGER NOT NULL DEFAULT 0,
+    unique_clicks INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Totals across all campaigns (a single row)
+CREATE TABLE IF NOT EXISTS global_stats (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    sent BIGINT NOT NULL DEFAULT 0,
+    delivered BIGINT NOT NULL DEFAULT 0,
+    bounces BIGINT NOT NULL DEFAULT 0,
+    unique_opens BIGINT NOT NULL DEFAULT 0,
+    unique_clicks BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+INSERT INTO global_stats (id) VALUES (1) ON CONFLICT (id) DO NOTHING;
+
+-- Per-minute activity per campaign, for the time-series endpoint (hours and
+-- days are summed from these). opens counts first opens, clicks every click.
+CREATE TABLE IF NOT EXISTS campaign_stats_buckets (
+    campaign_id INTEGER REFERENCES campaigns(id) ON DELETE CASCADE,
+    bucket TIMESTAMP NOT NULL, -- Start of the minute
+    sends INTEGER NOT NULL DEFAULT 0,
+    bounces INTEGER NOT NULL DEFAULT 0,
+    opens INTEGER NOT NULL DEFAULT 0,
+    clicks INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, -- Drives the "since" cursor
+    PRIMARY KEY (campaign_id, bucket)
+);
+
+-- HyperLogLog sketches (hll.py) of the recipients who opened/clicked, per
+-- hour and for the whole campaign (bucket = '-infinity'), for approximate
+-- distinct counts that can be merged across buckets and campaigns
+CREATE TABLE IF NOT EXISTS campaign_sketches (
+    campaign_id INTEGER REFERENCES campaigns(id) ON DELETE CASCADE,
+    event_type VARCHAR(50) NOT NULL, -- 'open', 'click'
+    bucket TIMESTAMP NOT NULL, -- Start of the hour, or '-infinity' for the campaign total
+    sketch BYTEA NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (campaign_id, event_type, bucket)
 );
 
 -- Suppressions table for bounces and complaints
@@ -60,11 +130,87 @@ CREATE TABLE IF NOT EXISTS unsubscribe_tokens (
     used_at TIMESTAMP
 );
 
+-- Send jobs table (background campaign sends, drained by send_worker.py)
+CREATE TABLE IF NOT EXISTS send_jobs (
+    id SERIAL PRIMARY KEY,
+    campaign_id INTEGER REFERENCES campaigns(id) ON DELETE CASCADE,
+    status VARCHAR(50) NOT NULL DEFAULT 'queued', -- 'queued', 'running', 'completed', 'quota_exhausted', 'failed'
+    shard_count INTEGER NOT NULL DEFAULT 1,
+    error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+-- Send job shards (audience split by hash of contacts.email; each claimed by one worker)
+CREATE TABLE IF NOT EXISTS send_job_shards (
+    job_id INTEGER REFERENCES send_jobs(id) ON DELETE CASCADE,
+    shard INTEGER NOT NULL,
+    status VARCHAR(50) NOT NULL DEFAULT 'queued', -- 'queued', 'running', 'completed', 'quota_exhausted', 'failed'
+    total INTEGER DEFAULT 0,
+    sent INTEGER DEFAULT 0,
+    failed INTEGER DEFAULT 0,
+    last_email VARCHAR(255), -- Resume cursor: last recipient committed (audience is ordered by email)
+    error TEXT,
+    worker_id VARCHAR(255),
+    heartbeat_at TIMESTAMP,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP,
+    PRIMARY KEY (job_id, shard)
+);
+
+-- Contact import jobs (uploads spooled to disk, imported in the background by import_jobs.py)
+CREATE TABLE IF NOT EXISTS import_jobs (
+    id SERIAL PRIMARY KEY,
+    filename VARCHAR(255),
+    path TEXT NOT NULL, -- Spooled upload, removed on completion (IMPORT_SPOOL_KEEP_HOURS after cancel/failure)
+    spool_host VARCHAR(255), -- Host whose disk holds the spooled upload
+    status VARCHAR(50) NOT NULL DEFAULT 'queued', -- 'queued', 'running', 'completed', 'cancelled', 'failed'
+    total_bytes BIGINT DEFAULT 0,
+    bytes_done BIGINT DEFAULT 0, -- Resume cursor: file offset after the last committed chunk
+    total INTEGER DEFAULT 0,
+    inserted INTEGER DEFAULT 0,
+    skipped INTEGER DEFAULT 0,
+    rejections JSONB DEFAULT '{}', -- Skipped rows by reason: {"invalid_syntax": 12, "duplicate": 40, ...}
+    cancel_requested BOOLEAN DEFAULT FALSE,
+    error TEXT,
+    worker_id VARCHAR(255),
+    heartbeat_at TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP,
+    run_started_at TIMESTAMP, -- Start of the current run (rows/sec and ETA are per run)
+    run_start_bytes BIGINT DEFAULT 0,
+    run_start_rows INTEGER DEFAULT 0
+);
+
+-- Add columns to existing import_jobs tables
+ALTER TABLE import_jobs ADD COLUMN IF NOT EXISTS rejections JSONB DEFAULT '{}';
+ALTER TABLE import_jobs ADD COLUMN IF NOT EXISTS spool_host VARCHAR(255);
+
 -- Indexes for performance
 CREATE INDEX IF NOT EXISTS idx_campaign_sends_campaign_id ON campaign_sends(campaign_id);
 CREATE INDEX IF NOT EXISTS idx_campaign_sends_contact_email ON campaign_sends(contact_email);
-CREATE INDEX IF NOT EXISTS idx_events_campaign_id ON events(campaign_id);
+CREATE INDEX IF NOT EXISTS idx_campaign_sends_message_id ON campaign_sends(message_id);
+CREATE INDEX IF NOT EXISTS idx_events_campaign_type ON events(campaign_id, event_type);
 CREATE INDEX IF NOT EXISTS idx_events_contact_email ON events(contact_email);
-CREATE INDEX IF NOT EXISTS idx_events_event_type ON events(event_type);
-CREATE INDEX IF NOT EXISTS idx_events_created_at ON events(created_at);
+-- Events are appended in time order, so a BRIN index covers time ranges at a fraction of a B-tree's size
+CREATE INDEX IF NOT EXISTS idx_events_created_at_brin ON events USING brin (created_at);
+-- First open/click lookups when events are ingested
+DROP INDEX IF EXISTS idx_events_first_open;
+CREATE INDEX IF NOT EXISTS idx_events_campaign_contact ON events(campaign_id, contact_email, event_type);
+CREATE INDEX IF NOT EXISTS idx_events_click_link ON events(campaign_id, ((metadata->>'link_id')::integer)) WHERE event_type = 'click';
+CREATE INDEX IF NOT EXISTS idx_campaign_stats_buckets_updated ON campaign_stats_buckets(campaign_id, updated_at);
 CREATE INDEX IF NOT EXISTS idx_contacts_unsubscribed ON contacts(unsubscribed);
+-- Contacts are unique regardless of email case. Databases that already hold
+-- case duplicates get this index from dedupe_contact_emails.py instead.
+DO $$
+BEGIN
+    IF to_regclass('idx_contacts_email_lower') IS NULL
+       AND NOT EXISTS (SELECT 1 FROM contacts GROUP BY lower(email) HAVING COUNT(*) > 1) THEN
+        CREATE UNIQUE INDEX idx_contacts_email_lower ON contacts (lower(email));
+    END IF;
+END $$;
+CREATE INDEX IF NOT EXISTS idx_send_jobs_campaign_status ON send_jobs(campaign_id, status);
+CREATE INDEX IF NOT EXISTS idx_send_job_shards_status ON send_job_shards(status);
+CREATE INDEX IF NOT EXISTS idx_import_jobs_status ON import_jobs(status);
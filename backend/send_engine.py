@@ -0,0 +1,303 @@
+"""
+Concurrent send engine for campaign delivery.
+
+SES calls are fanned out over a pool of worker threads and paced by a
+token bucket sized from the account's real SES quota (MaxSendRate and
+Max24HourSend), instead of a fixed sleep between sends.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Number of SES calls allowed in flight at once
+SEND_CONCURRENCY = int(os.getenv("SEND_CONCURRENCY", "20"))
+
+# Optional hard cap on emails/sec (0 = use the account's MaxSendRate)
+SEND_RATE_LIMIT = float(os.getenv("SEND_RATE_LIMIT", "0"))
+
+# Fallback rate when the quota can't be read (SES sandbox default is 1/s,
+# production accounts start at 14/s)
+DEFAULT_SEND_RATE = 10.0
+
+# AIMD rate control: on SES throttling the rate is multiplied by
+# SEND_AIMD_DECREASE; every second without throttling it grows by
+# SEND_AIMD_INCREASE emails/sec, up to the starting rate
+SEND_AIMD_DECREASE = float(os.getenv("SEND_AIMD_DECREASE", "0.5"))
+SEND_AIMD_INCREASE = float(os.getenv("SEND_AIMD_INCREASE", "1"))
+SEND_MIN_RATE = 1.0
+
+# Throttled recipients are retried this many times before being deferred
+# to the next run of the job (they are never recorded as failed)
+SEND_THROTTLE_MAX_RETRIES = int(os.getenv("SEND_THROTTLE_MAX_RETRIES", "20"))
+
+# AccountThrottled / AccountDailyQuotaExceeded are SendBulkTemplatedEmail's
+# per-destination statuses for the same conditions
+THROTTLING_ERROR_CODES = {
+    "Throttling", "ThrottlingException", "MaxSendRateExceeded", "TooManyRequestsException", "AccountThrottled"
+}
+DAILY_QUOTA_ERROR_CODES = {"AccountDailyQuotaExceeded"}
+
+# Returned instead of a result for recipients that were not attempted to completion
+DEFERRED = object()
+
+
+class TokenBucket:
+    """Thread-safe token bucket. acquire() blocks until a token is available."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity is not None else max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self._last
+        self._last = now
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+
+    def acquire(self, tokens: float = 1.0):
+        # A request bigger than the bucket (e.g. a 50-recipient bulk call at
+        # 14/s) waits for a full bucket and then goes into debt, which later
+        # callers pay back before they get a token
+        needed = min(tokens, self.capacity)
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                if self._tokens >= needed:
+                    self._tokens -= tokens
+                    return
+                delay = (needed - self._tokens) / self.rate
+            time.sleep(delay)
+
+    def set_rate(self, rate: float):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = float(rate)
+            self.capacity = max(1.0, self.rate)
+            self._tokens = min(self._tokens, self.capacity)
+
+
+def _error_code(error) -> str:
+    response = getattr(error, "response", None) or {}
+    return response.get("Error", {}).get("Code")
+
+
+def is_daily_quota_error(error) -> bool:
+    """SES reports an exhausted 24h quota as Throttling too, but waiting won't help"""
+    return (_error_code(error) in DAILY_QUOTA_ERROR_CODES
+            or "daily message quota exceeded" in str(error).lower())
+
+
+def is_throttling_error(error) -> bool:
+    if is_daily_quota_error(error):
+        return False
+    return (_error_code(error) in THROTTLING_ERROR_CODES
+            or "maximum sending rate exceeded" in str(error).lower())
+
+
+class RateController:
+    """
+    Additive-increase / multiplicative-decrease control of a TokenBucket's
+    rate, so sending runs at the highest rate SES accepts at the moment.
+    """
+
+    def __init__(self, bucket: TokenBucket, max_rate: float,
+                 decrease: float = None, increase: float = None, min_rate: float = SEND_MIN_RATE):
+        self.bucket = bucket
+        self.max_rate = float(max_rate)
+        self.min_rate = min(float(min_rate), self.max_rate)
+        self.decrease = decrease if decrease is not None else SEND_AIMD_DECREASE
+        self.increase = increase if increase is not None else SEND_AIMD_INCREASE
+        self._last_change = time.monotonic()
+        self._lock = threading.Lock()
+        self.throttles = 0
+
+    @property
+    def rate(self) -> float:
+        return self.bucket.rate
+
+    def set_max_rate(self, max_rate: float):
+        with self._lock:
+            self.max_rate = float(max_rate)
+            self.min_rate = min(self.min_rate, self.max_rate)
+            # Lowering takes effect now; raising is reached by additive increase
+            if self.bucket.rate > self.max_rate:
+                self.bucket.set_rate(self.max_rate)
+
+    def on_success(self):
+        with self._lock:
+            now = time.monotonic()
+            if self.bucket.rate >= self.max_rate or now - self._last_change < 1.0:
+                return
+            self._last_change = now
+            self.bucket.set_rate(min(self.max_rate, self.bucket.rate + self.increase))
+
+    def on_throttle(self):
+        with self._lock:
+            self.throttles += 1
+            now = time.monotonic()
+            # Requests already in flight get throttled together; back off at most once a second
+            if now - self._last_change < 1.0:
+                return
+            self._last_change = now
+            new_rate = max(self.min_rate, self.bucket.rate * self.decrease)
+            self.bucket.set_rate(new_rate)
+            print(f"🐢 SES throttling, send rate reduced to {new_rate:.1f} emails/sec")
+
+
+def get_send_limits(ses_client) -> dict:
+    """Read MaxSendRate and the remaining 24h allowance from SES"""
+    try:
+        quota = ses_client.get_send_quota()
+        max_rate = float(quota.get("MaxSendRate") or DEFAULT_SEND_RATE)
+        max_24h = quota.get("Max24HourSend")
+        sent_24h = quota.get("SentLast24Hours") or 0
+
+        # Max24HourSend of -1 means the account has no daily cap
+        remaining = None
+        if max_24h is not None and max_24h >= 0:
+            remaining = max(0, int(max_24h - sent_24h))
+    except Exception as e:
+        print(f"⚠️ Could not read SES send quota, using {DEFAULT_SEND_RATE}/s: {str(e)}")
+        max_rate = DEFAULT_SEND_RATE
+        remaining = None
+
+    rate = max_rate
+    if SEND_RATE_LIMIT > 0:
+        rate = min(rate, SEND_RATE_LIMIT)
+
+    return {"max_send_rate": max_rate, "rate": rate, "remaining_24h": remaining}
+
+
+class SendEngine:
+    """
+    Run send_fn for every recipient on a worker pool.
+
+    With batch_size=1, send_fn(recipient) returns a message id or raises.
+    With batch_size>1, recipients are grouped and send_fn(batch) returns a
+    list of (message_id, error) pairs in batch order, so one API call can
+    cover several recipients; the bucket is charged one token per recipient.
+
+    SES throttling errors don't count as failures: the rate controller backs
+    off and the recipients are retried. Recipients that still can't be sent
+    (retries used up, or the 24h quota ran out mid-run) are deferred - they
+    get no on_result call, so the job picks them up again next run.
+
+    send_fn runs in worker threads and should only do the SES call (plus any
+    pure CPU work like rendering). on_result(recipient, message_id, error) is
+    always called per recipient from the thread that called run(), so it can
+    safely use a single DB connection.
+    """
+
+    def __init__(self, send_fn, rate: float, concurrency: int = SEND_CONCURRENCY,
+                 max_sends: int = None, batch_size: int = 1):
+        self.send_fn = send_fn
+        self.bucket = TokenBucket(rate)
+        self.controller = RateController(self.bucket, max_rate=rate)
+        self.concurrency = max(1, concurrency)
+        self.max_sends = max_sends
+        self.batch_size = max(1, batch_size)
+        self._daily_quota_hit = threading.Event()
+
+    def set_max_rate(self, rate: float):
+        """Change the rate ceiling, e.g. when the account rate is shared by more workers"""
+        self.controller.set_max_rate(rate)
+
+    def _call(self, items):
+        if self.batch_size == 1:
+            try:
+                return [(self.send_fn(items[0]), None)]
+            except Exception as e:
+                return [(None, e)]
+
+        try:
+            return self.send_fn(items)
+        except Exception as e:
+            return [(None, e)] * len(items)
+
+    def _send(self, batch):
+        results = [DEFERRED] * len(batch)
+        pending = list(range(len(batch)))
+        attempts = 0
+
+        while pending and attempts <= SEND_THROTTLE_MAX_RETRIES:
+            if self._daily_quota_hit.is_set():
+                break
+
+            self.bucket.acquire(len(pending))
+            outcomes = self._call([batch[i] for i in pending])
+            attempts += 1
+
+            retry = []
+            for i, (message_id, error) in zip(pending, outcomes):
+                if error is not None and is_daily_quota_error(error):
+                    self._daily_quota_hit.set()
+                elif error is not None and is_throttling_error(error):
+                    retry.append(i)
+                else:
+                    results[i] = (message_id, error)
+
+            if retry:
+                self.controller.on_throttle()
+            else:
+                self.controller.on_success()
+            pending = retry
+
+        return batch, results
+
+    def _drain(self, done, on_result, stats):
+        for future in done:
+            batch, results = future.result()
+            for recipient, result in zip(batch, results):
+                if result is DEFERRED:
+                    # Left unrecorded so the next run of the job picks it up
+                    stats["deferred"] += 1
+                    continue
+                message_id, error = result
+                if error is None:
+                    stats["sent"] += 1
+                else:
+                    stats["failed"] += 1
+                on_result(recipient, message_id, error)
+
+    def _batches(self, recipients, stats):
+        batch = []
+        submitted = 0
+        for recipient in recipients:
+            if self._daily_quota_hit.is_set() or (self.max_sends is not None and submitted >= self.max_sends):
+                stats["quota_exhausted"] = True
+                break
+            batch.append(recipient)
+            submitted += 1
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def run(self, recipients, on_result) -> dict:
+        stats = {"sent": 0, "failed": 0, "deferred": 0, "quota_exhausted": False}
+        in_flight = set()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            for batch in self._batches(recipients, stats):
+                # Keep a bounded queue so a huge audience isn't materialized as futures
+                if len(in_flight) >= self.concurrency * 2:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    self._drain(done, on_result, stats)
+
+                in_flight.add(pool.submit(self._send, batch))
+
+            done, _ = wait(in_flight)
+            self._drain(done, on_result, stats)
+
+        if self._daily_quota_hit.is_set():
+            stats["quota_exhausted"] = True
+        stats["throttles"] = self.controller.throttles
+        stats["final_rate"] = self.bucket.rate
+        return stats
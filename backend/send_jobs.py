@@ -0,0 +1,246 @@
+"""
+Durable campaign send jobs backed by the send_jobs and send_job_shards tables.
+
+POST /campaign/send enqueues a job and returns immediately. The job's
+audience is split into shards (by a hash of contacts.email), and each
+send_worker.py process claims one shard at a time with FOR UPDATE SKIP
+LOCKED, so adding workers spreads a campaign across processes and nodes.
+
+Shard progress (sent/failed counts and the last committed recipient) is
+written in the same transaction as the campaign_sends rows, so a crashed
+worker's shard can be picked up again and resumed from exactly where it
+stopped.
+"""
+import os
+from database import get_db
+from job_queue import row_to_dict, claim_next, isoformat_fields
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# A running shard whose worker hasn't reported progress for this long is
+# considered abandoned and can be claimed by another worker
+SEND_JOB_STALE_SECONDS = int(os.getenv("SEND_JOB_STALE_SECONDS", "300"))
+
+# Default number of shards per send job (1 = a single worker sends it all)
+SEND_JOB_SHARDS = int(os.getenv("SEND_JOB_SHARDS", "1"))
+MAX_SEND_JOB_SHARDS = 64
+
+JOB_COLUMNS = ("id", "campaign_id", "status", "shard_count", "error", "created_at", "started_at", "finished_at")
+SHARD_COLUMNS = (
+    "job_id", "shard", "status", "total", "sent", "failed", "last_email",
+    "error", "worker_id", "heartbeat_at", "started_at", "finished_at"
+)
+
+# Shard states that still have work to do
+ACTIVE_STATUSES = ("queued", "running")
+
+
+def enqueue_job(campaign_id: int, shard_count: int = None) -> tuple[dict, bool]:
+    """Queue a send job for a campaign. Returns (job, created).
+
+    If the campaign already has a queued or running job, that job is returned
+    instead of queueing a second one.
+    """
+    shard_count = max(1, min(shard_count or SEND_JOB_SHARDS, MAX_SEND_JOB_SHARDS))
+
+    conn = get_db()
+    cur = conn.cursor()
+
+    try:
+        # Serialize enqueues for the same campaign
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (campaign_id,))
+
+        cur.execute(
+            f"""
+            SELECT {', '.join(JOB_COLUMNS)} FROM send_jobs
+            WHERE campaign_id = %s AND status IN %s
+            ORDER BY id LIMIT 1
+            """,
+            (campaign_id, ACTIVE_STATUSES)
+        )
+        existing = cur.fetchone()
+        if existing:
+            conn.commit()
+            return row_to_dict(JOB_COLUMNS, existing), False
+
+        cur.execute(
+            f"""
+            INSERT INTO send_jobs (campaign_id, shard_count) VALUES (%s, %s)
+            RETURNING {', '.join(JOB_COLUMNS)}
+            """,
+            (campaign_id, shard_count)
+        )
+        job = row_to_dict(JOB_COLUMNS, cur.fetchone())
+        cur.execute(
+            """
+            INSERT INTO send_job_shards (job_id, shard)
+            SELECT %s, generate_series(0, %s - 1)
+            """,
+            (job["id"], shard_count)
+        )
+        conn.commit()
+        return job, True
+    finally:
+        cur.close()
+        conn.close()
+
+
+def get_job(job_id: int) -> dict:
+    """Job with its shards and progress summed across them"""
+    conn = get_db()
+    cur = conn.cursor()
+
+    try:
+        cur.execute(
+            f"SELECT {', '.join(JOB_COLUMNS)} FROM send_jobs WHERE id = %s",
+            (job_id,)
+        )
+        job = row_to_dict(JOB_COLUMNS, cur.fetchone())
+        if not job:
+            return None
+
+        cur.execute(
+            f"""
+            SELECT {', '.join(SHARD_COLUMNS)} FROM send_job_shards
+            WHERE job_id = %s ORDER BY shard
+            """,
+            (job_id,)
+        )
+        job["shards"] = [row_to_dict(SHARD_COLUMNS, row) for row in cur.fetchall()]
+        for key in ("total", "sent", "failed"):
+            job[key] = sum(shard[key] or 0 for shard in job["shards"])
+        return job
+    finally:
+        cur.close()
+        conn.close()
+
+
+def claim_shard(worker_id: str) -> dict:
+    """Claim the oldest queued (or abandoned) shard, or return None.
+
+    The returned dict also carries the job's campaign_id and shard_count.
+    """
+    conn = get_db()
+    cur = conn.cursor()
+
+    try:
+        shard = claim_next(
+            cur, "send_job_shards", ("job_id", "shard"), SHARD_COLUMNS, worker_id, SEND_JOB_STALE_SECONDS
+        )
+        if not shard:
+            conn.commit()
+            return None
+
+        cur.execute(
+            """
+            UPDATE send_jobs
+            SET status = 'running', started_at = COALESCE(started_at, NOW())
+            WHERE id = %s
+            RETURNING campaign_id, shard_count
+            """,
+            (shard["job_id"],)
+        )
+        shard["campaign_id"], shard["shard_count"] = cur.fetchone()
+        conn.commit()
+        return shard
+    finally:
+        cur.close()
+        conn.close()
+
+
+def set_shard_total(cur, job_id: int, shard: int, total: int):
+    cur.execute(
+        "UPDATE send_job_shards SET total = %s, heartbeat_at = NOW() WHERE job_id = %s AND shard = %s",
+        (total, job_id, shard)
+    )
+
+
+def record_shard_progress(cur, job_id: int, shard: int, sent: int, failed: int, last_email: str):
+    """Update progress counters. Call before committing the matching campaign_sends rows."""
+    cur.execute(
+        """
+        UPDATE send_job_shards
+        SET sent = %s, failed = %s, last_email = %s, heartbeat_at = NOW()
+        WHERE job_id = %s AND shard = %s
+        """,
+        (sent, failed, last_email, job_id, shard)
+    )
+
+
+def count_running_shards(cur) -> int:
+    """Shards currently sending across all workers (they share the SES rate)"""
+    cur.execute(
+        """
+        SELECT COUNT(*) FROM send_job_shards
+        WHERE status = 'running' AND heartbeat_at >= NOW() - make_interval(secs => %s)
+        """,
+        (SEND_JOB_STALE_SECONDS,)
+    )
+    return cur.fetchone()[0]
+
+
+def finish_shard(job_id: int, shard: int, status: str, error: str = None) -> str:
+    """Mark a shard 'completed', 'quota_exhausted' or 'failed'.
+
+    When it was the job's last active shard the job is finished too, and its
+    final status is returned; otherwise returns None.
+    """
+    conn = get_db()
+    cur = conn.cursor()
+
+    try:
+        # Lock the job row so only one worker finalizes it
+        cur.execute("SELECT id FROM send_jobs WHERE id = %s FOR UPDATE", (job_id,))
+
+        cur.execute(
+            """
+            UPDATE send_job_shards
+            SET status = %s, error = %s, finished_at = NOW(), heartbeat_at = NOW()
+            WHERE job_id = %s AND shard = %s
+            """,
+            (status, error, job_id, shard)
+        )
+
+        cur.execute("SELECT status, error FROM send_job_shards WHERE job_id = %s", (job_id,))
+        shards = cur.fetchall()
+
+        job_status = None
+        if not any(s in ACTIVE_STATUSES for s, _ in shards):
+            statuses = {s for s, _ in shards}
+            if "failed" in statuses:
+                job_status = "failed"
+            elif "quota_exhausted" in statuses:
+                job_status = "quota_exhausted"
+            else:
+                job_status = "completed"
+            job_error = next((e for _, e in shards if e), None)
+
+            cur.execute(
+                """
+                UPDATE send_jobs
+                SET status = %s, error = %s, finished_at = NOW()
+                WHERE id = %s AND status IN %s
+                """,
+                (job_status, job_error, job_id, ACTIVE_STATUSES)
+            )
+
+        conn.commit()
+        return job_status
+    finally:
+        cur.close()
+        conn.close()
+
+
+def job_to_dict(job: dict) -> dict:
+    """JSON-friendly job status for API responses"""
+    data = isoformat_fields(dict(job), ("created_at", "started_at", "finished_at"))
+    data["shards"] = [
+        isoformat_fields(dict(shard), ("heartbeat_at", "started_at", "finished_at"))
+        for shard in data.get("shards", [])
+    ]
+
+    processed = (data.get("sent") or 0) + (data.get("failed") or 0)
+    data["processed"] = processed
+    data["progress"] = round(processed / data["total"] * 100, 2) if data.get("total") else 0
+    return data
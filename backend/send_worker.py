@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Background send worker - drains campaign send job shards from send_job_shards.
+
+Run one or more of these alongside the API (on one or several machines):
+    python send_worker.py              # one worker process
+    python send_worker.py 4            # four worker processes
+"""
+import os
+import sys
+import time
+from multiprocessing import Process
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from campaign_sender import run_campaign_send
+from send_jobs import claim_shard, finish_shard
+from job_queue import worker_identity, run_claimed
+
+POLL_INTERVAL = float(os.getenv("SEND_WORKER_POLL_INTERVAL", "2"))
+SEND_WORKER_PROCESSES = int(os.getenv("SEND_WORKER_PROCESSES", "1"))
+
+
+def work():
+    worker_id = worker_identity()
+    print(f"📮 Send Worker {worker_id} - Waiting for jobs")
+
+    try:
+        while True:
+            try:
+                shard = claim_shard(worker_id)
+            except Exception as e:
+                print(f"❌ Failed to claim job: {str(e)}")
+                time.sleep(POLL_INTERVAL)
+                continue
+
+            if not shard:
+                time.sleep(POLL_INTERVAL)
+                continue
+
+            label = f"job {shard['job_id']} shard {shard['shard'] + 1}/{shard['shard_count']}"
+            print(f"🔄 {worker_id} claimed {label} (campaign {shard['campaign_id']})")
+            run_claimed(
+                label,
+                lambda: run_campaign_send(shard),
+                lambda error: finish_shard(shard["job_id"], shard["shard"], "failed", error)
+            )
+    except KeyboardInterrupt:
+        print(f"👋 Send worker {worker_id} stopped")
+
+
+def main():
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else SEND_WORKER_PROCESSES
+
+    print("\n" + "="*60)
+    print(f"📮 Send Worker - Starting {processes} process(es)")
+    print("="*60 + "\n")
+
+    if processes <= 1:
+        work()
+        return
+
+    workers = [Process(target=work) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+if __name__ == "__main__":
+    main()
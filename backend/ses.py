@@ -1,5 +1,6 @@
 import os
 import boto3
+from botocore.config import Config
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -8,5 +9,10 @@ ses = boto3.client(
     "ses",
     region_name=os.getenv("AWS_REGION", "us-east-1"),
     aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID", ""),
-    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY", "")
+    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY", ""),
+    # Optional: point at a local SES stand-in (benchmarks/fake_ses.py)
+    endpoint_url=os.getenv("SES_ENDPOINT_URL") or None,
+    # One pooled HTTP connection per concurrent send worker (botocore defaults to 10)
+    config=Config(max_pool_connections=max(10, int(os.getenv("SEND_CONCURRENCY", "20"))))
 )
+
@@ -0,0 +1,122 @@
+"""
+Response cache for the stats endpoints.
+
+Stats responses are cached per process for STATS_CACHE_TTL seconds. Writers
+that change the numbers (send result flushes, tracking event batches, SES
+webhooks) call notify_stats_changed() in their transaction; the resulting
+Postgres NOTIFY reaches every API process, whose StatsListener thread drops
+the affected entries. The TTL only matters if notifications are missed.
+"""
+import os
+import select
+import threading
+import time
+from database import get_db
+from dotenv import load_dotenv
+
+load_dotenv()
+
+STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", "30"))
+
+STATS_CHANNEL = "stats_changed"
+
+
+def notify_stats_changed(cur, campaign_id: int = None):
+    """Queue a stats invalidation; delivered when the current transaction commits"""
+    cur.execute("SELECT pg_notify(%s, %s)", (STATS_CHANNEL, "" if campaign_id is None else str(campaign_id)))
+
+
+class StatsCache:
+    def __init__(self, ttl: float = STATS_CACHE_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        # Bumped on every invalidation, so a result computed before it isn't stored after it
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, key, compute):
+        """Cached value for key, or compute() it. Results that are JSONResponse errors aren't cached."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+
+        value = compute()
+        if isinstance(value, dict):
+            with self._lock:
+                if self._generation == generation:
+                    self._entries[key] = (time.monotonic() + self.ttl, value)
+        return value
+
+    def invalidate(self, campaign_id: int = None):
+        """Drop the dashboard and the campaign's entries (every entry if campaign_id is None)"""
+        with self._lock:
+            self._generation += 1
+            if campaign_id is None:
+                self._entries.clear()
+                return
+            for key in list(self._entries):
+                if key[0] == "dashboard" or (len(key) > 1 and key[1] == campaign_id):
+                    del self._entries[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class StatsListener:
+    """Background LISTEN on the stats channel that invalidates a StatsCache"""
+
+    def __init__(self, cache: StatsCache):
+        self.cache = cache
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="stats-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = get_db()
+                conn.autocommit = True
+                cur = conn.cursor()
+                cur.execute(f"LISTEN {STATS_CHANNEL}")
+                # Anything may have changed while we weren't listening
+                self.cache.invalidate()
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        payload = conn.notifies.pop(0).payload
+                        self.cache.invalidate(int(payload) if payload else None)
+            except Exception as e:
+                print(f"Stats listener error: {e}")
+                self._stop.wait(5)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+
+stats_cache = StatsCache()
+stats_listener = StatsListener(stats_cache)
@@ -0,0 +1,247 @@
+"""
+Incrementally maintained stats counters.
+
+campaign_stats (one row per campaign) and global_stats (a single row) hold
+sent, delivered, bounced, unique open and unique click counts. The writers
+add their deltas in the same transaction as the rows they insert:
+campaign_sender.py for sends, event_queue.py for opens and clicks, and the
+SES webhooks for bounces. The stats endpoints read these rows instead of
+aggregating campaign_sends and events. The same writers also add per-minute
+deltas to campaign_stats_buckets (add_bucket_counts) for the time series,
+and the tracking writer merges HyperLogLog sketches of openers/clickers into
+campaign_sketches (merge_sketches) for approximate distinct counts.
+
+Counters can drift (e.g. two API processes recording the same first open at
+once), so rebuild the totals from the raw tables now and then (the per-minute
+buckets are not rebuilt, bounce times aren't kept anywhere else):
+
+    python stats_rollup.py              # every campaign
+    python stats_rollup.py 42           # one campaign
+"""
+import sys
+from datetime import datetime
+from psycopg2 import Binary
+from psycopg2.extras import execute_values
+from database import get_db
+from hll import HyperLogLog
+from stats_cache import notify_stats_changed
+
+COUNTERS = ("sent", "delivered", "bounces", "unique_opens", "unique_clicks")
+BUCKET_COUNTERS = ("sends", "bounces", "opens", "clicks")
+
+# Raw aggregates, used to rebuild the counters
+CAMPAIGN_COUNTS_SQL = """
+    SELECT ca.id, s.sent, s.delivered, s.bounces, e.unique_opens, e.unique_clicks
+    FROM campaigns ca
+    CROSS JOIN LATERAL (
+        SELECT COUNT(*) AS sent,
+               COUNT(*) FILTER (WHERE delivered = TRUE OR (delivered = FALSE AND bounce_type IS NULL)) AS delivered,
+               COUNT(*) FILTER (WHERE bounce_type IS NOT NULL) AS bounces
+        FROM campaign_sends
+        WHERE campaign_id = ca.id
+    ) s
+    CROSS JOIN LATERAL (
+        SELECT COUNT(DISTINCT contact_email) FILTER (WHERE event_type = 'open') AS unique_opens,
+               COUNT(DISTINCT contact_email) FILTER (WHERE event_type = 'click') AS unique_clicks
+        FROM events
+        WHERE campaign_id = ca.id AND event_type IN ('open', 'click')
+    ) e
+"""
+
+
+def add_counts(cur, deltas: dict):
+    """
+    Add {campaign_id: {counter: delta}} to campaign_stats and the totals to
+    global_stats. Rows are locked in campaign_id order, global row last, so
+    concurrent writers can't deadlock.
+    """
+    rows = []
+    totals = dict.fromkeys(COUNTERS, 0)
+    for campaign_id in sorted(deltas):
+        delta = deltas[campaign_id]
+        values = [delta.get(name, 0) for name in COUNTERS]
+        if not any(values):
+            continue
+        rows.append((campaign_id, *values))
+        for name, value in zip(COUNTERS, values):
+            totals[name] += value
+    if not rows:
+        return
+
+    execute_values(
+        cur,
+        """
+        INSERT INTO campaign_stats (campaign_id, sent, delivered, bounces, unique_opens, unique_clicks)
+        VALUES %s
+        ON CONFLICT (campaign_id) DO UPDATE SET
+            sent = campaign_stats.sent + EXCLUDED.sent,
+            delivered = campaign_stats.delivered + EXCLUDED.delivered,
+            bounces = campaign_stats.bounces + EXCLUDED.bounces,
+            unique_opens = campaign_stats.unique_opens + EXCLUDED.unique_opens,
+            unique_clicks = campaign_stats.unique_clicks + EXCLUDED.unique_clicks,
+            updated_at = CURRENT_TIMESTAMP
+        """,
+        rows,
+        page_size=len(rows)
+    )
+    cur.execute(
+        """
+        UPDATE global_stats SET
+            sent = sent + %s, delivered = delivered + %s, bounces = bounces + %s,
+            unique_opens = unique_opens + %s, unique_clicks = unique_clicks + %s,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = 1
+        """,
+        tuple(totals[name] for name in COUNTERS)
+    )
+
+
+def add_bucket_counts(cur, deltas: dict):
+    """Add {(campaign_id, minute): {counter: delta}} to campaign_stats_buckets"""
+    rows = []
+    for key in sorted(deltas):
+        values = [deltas[key].get(name, 0) for name in BUCKET_COUNTERS]
+        if any(values):
+            rows.append((*key, *values))
+    if not rows:
+        return
+
+    execute_values(
+        cur,
+        """
+        INSERT INTO campaign_stats_buckets (campaign_id, bucket, sends, bounces, opens, clicks)
+        VALUES %s
+        ON CONFLICT (campaign_id, bucket) DO UPDATE SET
+            sends = campaign_stats_buckets.sends + EXCLUDED.sends,
+            bounces = campaign_stats_buckets.bounces + EXCLUDED.bounces,
+            opens = campaign_stats_buckets.opens + EXCLUDED.opens,
+            clicks = campaign_stats_buckets.clicks + EXCLUDED.clicks,
+            updated_at = CURRENT_TIMESTAMP
+        """,
+        rows,
+        page_size=len(rows)
+    )
+
+
+# NULL bucket means the whole-campaign sketch
+SKETCH_KEY_TEMPLATE = "(%s::integer, %s, COALESCE(%s::timestamp, '-infinity'::timestamp))"
+
+
+def merge_sketches(cur, sketches: dict):
+    """Merge {(campaign_id, event_type, hour or None): HyperLogLog} into campaign_sketches"""
+    if not sketches:
+        return
+    keys = sorted(sketches, key=lambda k: (k[0], k[1], k[2] or datetime.min))
+
+    # Read-merge-write: one writer at a time, so concurrent flushes can't
+    # overwrite each other's registers
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext('campaign_sketches'))")
+    stored = execute_values(
+        cur,
+        """
+        SELECT s.campaign_id, s.event_type,
+               CASE WHEN s.bucket = '-infinity' THEN NULL ELSE s.bucket END, s.sketch
+        FROM campaign_sketches s
+        JOIN (VALUES %s) AS v(campaign_id, event_type, bucket)
+          ON s.campaign_id = v.campaign_id AND s.event_type = v.event_type AND s.bucket = v.bucket
+        """,
+        keys,
+        template=SKETCH_KEY_TEMPLATE,
+        fetch=True
+    )
+    stored = {(cid, event_type, bucket): sketch for cid, event_type, bucket, sketch in stored}
+
+    rows = []
+    for key in keys:
+        merged = HyperLogLog.from_bytes(sketches[key].to_bytes())
+        if key in stored:
+            merged.merge(HyperLogLog.from_bytes(stored[key]))
+        rows.append((*key, Binary(merged.to_bytes())))
+
+    execute_values(
+        cur,
+        """
+        INSERT INTO campaign_sketches (campaign_id, event_type, bucket, sketch)
+        VALUES %s
+        ON CONFLICT (campaign_id, event_type, bucket) DO UPDATE SET
+            sketch = EXCLUDED.sketch,
+            updated_at = CURRENT_TIMESTAMP
+        """,
+        rows,
+        template="(%s::integer, %s, COALESCE(%s::timestamp, '-infinity'::timestamp), %s)"
+    )
+
+
+def rebuild_rollups(cur, campaign_id: int = None) -> list:
+    """Recompute counters from campaign_sends and events. Returns campaigns whose counters had drifted."""
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext('stats_rollup'))")
+
+    # Lock the counter rows first (same order as add_counts). Writers that
+    # commit before this are in both the raw tables and the counters; writers
+    # still open wait here and add their deltas on top of the rebuilt values.
+    cur.execute(
+        "SELECT campaign_id, sent, delivered, bounces, unique_opens, unique_clicks FROM campaign_stats"
+        + ("" if campaign_id is None else " WHERE campaign_id = %s")
+        + " ORDER BY campaign_id FOR UPDATE",
+        () if campaign_id is None else (campaign_id,)
+    )
+    stored = {row[0]: row[1:] for row in cur.fetchall()}
+    cur.execute("SELECT 1 FROM global_stats WHERE id = 1 FOR UPDATE")
+
+    if campaign_id is None:
+        cur.execute(CAMPAIGN_COUNTS_SQL)
+    else:
+        cur.execute(CAMPAIGN_COUNTS_SQL + " WHERE ca.id = %s", (campaign_id,))
+    actual = {row[0]: row[1:] for row in cur.fetchall()}
+    drifted = sorted(cid for cid, counts in actual.items() if stored.get(cid, (0,) * len(COUNTERS)) != counts)
+
+    if actual:
+        execute_values(
+            cur,
+            """
+            INSERT INTO campaign_stats (campaign_id, sent, delivered, bounces, unique_opens, unique_clicks)
+            VALUES %s
+            ON CONFLICT (campaign_id) DO UPDATE SET
+                sent = EXCLUDED.sent,
+                delivered = EXCLUDED.delivered,
+                bounces = EXCLUDED.bounces,
+                unique_opens = EXCLUDED.unique_opens,
+                unique_clicks = EXCLUDED.unique_clicks,
+                updated_at = CURRENT_TIMESTAMP
+            """,
+            [(cid, *actual[cid]) for cid in sorted(actual)]
+        )
+
+    # The global row is the sum of the campaign rows
+    cur.execute("""
+        UPDATE global_stats g SET
+            sent = t.sent, delivered = t.delivered, bounces = t.bounces,
+            unique_opens = t.unique_opens, unique_clicks = t.unique_clicks,
+            updated_at = CURRENT_TIMESTAMP
+        FROM (
+            SELECT COALESCE(SUM(sent), 0) AS sent, COALESCE(SUM(delivered), 0) AS delivered,
+                   COALESCE(SUM(bounces), 0) AS bounces, COALESCE(SUM(unique_opens), 0) AS unique_opens,
+                   COALESCE(SUM(unique_clicks), 0) AS unique_clicks
+            FROM campaign_stats
+        ) t
+        WHERE g.id = 1
+    """)
+    return drifted
+
+
+if __name__ == "__main__":
+    target = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        drifted = rebuild_rollups(cur, target)
+        notify_stats_changed(cur, target)
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+
+    if drifted:
+        print(f"🔧 Rebuilt stats counters, {len(drifted)} campaigns had drifted: {drifted[:20]}")
+    else:
+        print("✅ Stats counters match the raw tables")
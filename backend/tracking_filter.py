@@ -0,0 +1,136 @@
+"""
+Filtering of tracking hits before they reach the event buffer.
+
+Mail clients and image proxies load the open pixel many times per
+recipient. OpenFilter remembers who already opened a campaign, so only the
+first open is written to the events table; later loads just bump the
+per-recipient open counter. Hits from link scanners and other bots are
+recognised by user agent and not recorded at all.
+"""
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Campaigns whose openers are kept in memory (least recently opened are evicted;
+# the events insert still skips repeat opens for them, see event_queue.py)
+OPEN_FILTER_MAX_CAMPAIGNS = int(os.getenv("OPEN_FILTER_MAX_CAMPAIGNS", "100"))
+# Openers kept across all campaigns (about 70 bytes each). Past this the least
+# recently opened campaigns are dropped; a false "first open" only costs an
+# insert that the events writer's NOT EXISTS check skips.
+OPEN_FILTER_MAX_ENTRIES = int(os.getenv("OPEN_FILTER_MAX_ENTRIES", "1000000"))
+
+# Drop opens/clicks from scanners and crawlers instead of recording them
+TRACKING_IGNORE_BOTS = os.getenv("TRACKING_IGNORE_BOTS", "true").lower() == "true"
+
+# Image proxies fetch the pixel when the recipient opens the email, so their
+# hits are real opens (recorded with the proxy name in the event metadata)
+IMAGE_PROXIES = [
+    ("GoogleImageProxy", "gmail"),
+    ("YahooMailProxy", "yahoo"),
+    ("Outlook-iOS", "outlook"),
+    ("ms-office", "outlook"),
+]
+
+# Security gateways, link checkers and HTTP libraries
+BOT_PATTERN = re.compile(
+    r"bot\b|bot/|crawl|spider|slurp|bingpreview|headless|phantomjs|"
+    r"curl/|wget/|python-requests|python-urllib|aiohttp|go-http-client|java/|okhttp|libwww|"
+    r"barracuda|mimecast|proofpoint|messagelabs|symantec|forcepoint|trendmicro|sophos|cisco|fortinet",
+    re.IGNORECASE
+)
+
+
+def classify_user_agent(user_agent: str):
+    """Return ("proxy", name), ("bot", None) or (None, None) for a client"""
+    if not user_agent:
+        return None, None
+    for marker, name in IMAGE_PROXIES:
+        if marker in user_agent:
+            return "proxy", name
+    if BOT_PATTERN.search(user_agent):
+        return "bot", None
+    return None, None
+
+
+def _email_key(email: str) -> int:
+    # 64-bit digest instead of the address keeps the sets small; collisions
+    # within one campaign's openers are negligible
+    return int.from_bytes(hashlib.blake2b(email.lower().encode(), digest_size=8).digest(), "big")
+
+
+class OpenFilter:
+    """Thread-safe set of (campaign, recipient) pairs that already opened"""
+
+    def __init__(self, max_campaigns: int = OPEN_FILTER_MAX_CAMPAIGNS,
+                 max_entries: int = OPEN_FILTER_MAX_ENTRIES):
+        self.max_campaigns = max_campaigns
+        self.max_entries = max_entries
+        self._campaigns = OrderedDict()
+        self._entries = 0
+        self._lock = threading.Lock()
+        self.first_opens = 0
+        self.repeat_opens = 0
+        self.bot_hits = 0
+
+    def first_open(self, campaign_id: int, email: str) -> bool:
+        """Mark an open. Returns True only the first time a recipient opens the campaign."""
+        key = _email_key(email)
+        with self._lock:
+            seen = self._campaigns.get(campaign_id)
+            if seen is None:
+                seen = self._campaigns[campaign_id] = set()
+                while len(self._campaigns) > self.max_campaigns:
+                    self._entries -= len(self._campaigns.popitem(last=False)[1])
+            else:
+                self._campaigns.move_to_end(campaign_id)
+
+            if key in seen:
+                self.repeat_opens += 1
+                return False
+            seen.add(key)
+            self._entries += 1
+            if self._entries > self.max_entries:
+                self._evict(seen)
+            self.first_opens += 1
+            return True
+
+    def _evict(self, current: set):
+        """Drop least recently opened campaigns until the entry budget fits (lock held)"""
+        while self._entries > self.max_entries and len(self._campaigns) > 1:
+            # The current campaign was just moved to the end, so it's never first
+            self._entries -= len(self._campaigns.popitem(last=False)[1])
+        if self._entries > self.max_entries:
+            # A single campaign bigger than the budget starts over
+            self._entries -= len(current)
+            current.clear()
+
+    def forget(self, campaign_id: int, email: str):
+        """Undo first_open, e.g. when the event couldn't be queued"""
+        with self._lock:
+            seen = self._campaigns.get(campaign_id)
+            key = _email_key(email)
+            if seen is not None and key in seen:
+                seen.remove(key)
+                self._entries -= 1
+
+    def count_bot(self):
+        with self._lock:
+            self.bot_hits += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "campaigns": len(self._campaigns),
+                "recipients": self._entries,
+                "first_opens": self.first_opens,
+                "repeat_opens": self.repeat_opens,
+                "bot_hits": self.bot_hits
+            }
+
+
+open_filter = OpenFilter()
@@ -1,4 +1,4 @@
-import { useState } from "react";
+import { useEffect, useRef, useState } from "react";
 import api from "../../utils/axios";
 import Tooltip from "../common/Tooltip";
 import HelpIcon from "../common/HelpIcon";
@@ -8,6 +8,71 @@ function UploadContacts() {
   const [msg, setMsg] = useState("");
   const [loading, setLoading] = useState(false);
   const [result, setResult] = useState(null);
+  const pollRef = useRef(null);
+
+  const FINISHED = ["completed", "cancelled", "failed"];
+
+  useEffect(() => () => clearTimeout(pollRef.current), []);
+
+  // Poll the import job until it finishes
+  const pollJob = async (jobId) => {
+    try {
+      const res = await api.get(`/contacts/import/${jobId}`);
+      setResult(res.data);
+
+      if (!FINISHED.includes(res.data.status)) {
+        pollRef.current = setTimeout(() => pollJob(jobId), 1000);
+        return;
+      }
+
+      console.log(`✅ Import job ${jobId} ${res.data.status}`);
+      console.log(`   ✓ Inserted: ${res.data.inserted} contacts`);
+      console.log(`   ⚠ Skipped: ${res.data.skipped || 0} contacts`);
+      console.log(`   📈 Total processed: ${res.data.total || 0} rows`);
+
+      if (res.data.status === "completed") {
+        setMsg("✅ Import completed!");
+      } else if (res.data.status === "cancelled") {
+        setMsg("❌ Import cancelled. Contacts imported so far were kept.");
+      } else {
+        setMsg(`❌ Import failed: ${res.data.error || "unknown error"}`);
+      }
+      setLoading(false);
+    } catch (error) {
+      console.error("❌ Failed to get import status:", error);
+      pollRef.current = setTimeout(() => pollJob(jobId), 3000);
+    }
+  };
+
+  const cancel = async () => {
+    if (!result?.id) return;
+    try {
+      const res = await api.post(`/contacts/import/${result.id}/cancel`);
+      setResult(res.data);
+    } catch (error) {
+      console.error("❌ Cancel failed:", error.response?.data || error.message);
+    }
+  };
+
+  const resume = async () => {
+    if (!result?.id) return;
+    try {
+      const res = await api.post(`/contacts/import/${result.id}/resume`);
+      setResult(res.data);
+      setMsg("");
+      setLoading(true);
+      pollJob(result.id);
+    } catch (error) {
+      console.error("❌ Resume failed:", error.response?.data || error.message);
+      setMsg(`❌ ${error.response?.data?.error || "Resume failed"}`);
+    }
+  };
+
+  const formatEta = (seconds) => {
+    if (seconds === null || seconds === undefined) return "—";
+    if (seconds < 60) return `${Math.round(seconds)}s`;
+    return `${Math.floor(seconds / 60)}m ${Math.round(seconds % 60)}s`;
+  };
 
   const upload = async () => {
     if (!file) {
@@ -32,19 +97,14 @@ function UploadContacts() {
         fd
       );
 
-      console.log("✅ Upload successful!");
-      console.log(`   ✓ Inserted: ${res.data.inserted} contacts`);
-      console.log(`   ⚠ Skipped: ${res.data.skipped || 0} contacts`);
-      console.log(`   📈 Total processed: ${res.data.total || 0} rows`);
+      console.log(`✅ Upload successful, import job #${res.data.job_id} queued`);
 
-      setResult(res.data);
-      setMsg(`✅ Uploaded successfully!`);
       setFile(null);
+      pollJob(res.data.job_id);
     } catch (error) {
       console.error("❌ Upload failed:", error);
       console.error("Error details:", error.response?.data || error.message);
-      setMsg("❌ Upload failed. Please check console for details.");
-    } finally {
+      setMsg(`❌ Upload failed. ${error.response?.data?.error || "Please check console for details."}`);
       setLoading(false);
     }
   };
@@ -63,7 +123,7 @@ function UploadContacts() {
               <label className="block text-sm font-semibold text-gray-700">
               Select CSV File
             </label>
-              <Tooltip content="CSV file must contain 'email' column. Optional: 'name' column. Maximum file size: 10MB" position="top">
+              <Tooltip content="CSV file must contain 'email' column. Optional: 'name' column. Large files are imported in the background" position="top">
                 <HelpIcon />
               </Tooltip>
             </div>
@@ -119,9 +179,21 @@ function UploadContacts() {
             <div className="bg-blue-50 border border-blue-200 rounded-lg p-4 sm:p-6 animate-in fade-in slide-in-from-bottom-2 duration-300">
               <div className="flex items-center gap-2 mb-3">
                 <span className="text-blue-600 text-lg">📊</span>
-                <h3 className="font-semibold text-blue-900 text-sm sm:text-base">Upload Results</h3>
+                <h3 className="font-semibold text-blue-900 text-sm sm:text-base">Import #{result.id} ({result.status})</h3>
+              </div>
+              <div className="w-full bg-white rounded-full h-2.5 mb-3">
+                <div
+                  className="bg-blue-600 h-2.5 rounded-full transition-all duration-300"
+                  style={{ width: `${result.progress || 0}%` }}
+                />
               </div>
               <div className="space-y-2.5 text-sm">
+                <div className="flex justify-between items-center p-2 bg-white rounded">
+                  <span className="text-blue-700 font-medium">Speed / ETA:</span>
+                  <span className="font-bold text-blue-900">
+                    {result.rows_per_sec ?? "—"} rows/s · {formatEta(result.eta_seconds)}
+                  </span>
+                </div>
                 <div className="flex justify-between items-center p-2 bg-white rounded">
                   <span className="text-blue-700 font-medium">Total Processed:</span>
                   <span className="font-bold text-blue-900">{result.total}</span>
@@ -134,7 +206,37 @@ function UploadContacts() {
                   <span className="text-yellow-700 font-medium">⚠ Skipped (duplicates/invalid):</span>
                   <span className="font-bold text-yellow-900">{result.skipped || 0}</span>
                 </div>
+                {result.rejections && Object.keys(result.rejections).length > 0 && (
+                  <div className="p-2 bg-white rounded">
+                    <span className="text-gray-700 font-medium">Skipped by reason:</span>
+                    <ul className="mt-1 space-y-1">
+                      {Object.entries(result.rejections).map(([reason, count]) => (
+                        <li key={reason} className="flex justify-between text-gray-600">
+                          <span>{reason.replace(/_/g, " ")}</span>
+                          <span className="font-medium">{count}</span>
+                        </li>
+                      ))}
+                    </ul>
+                  </div>
+                )}
               </div>
+              {(result.status === "queued" || result.status === "running") && (
+                <button
+                  onClick={cancel}
+                  disabled={result.cancel_requested}
+                  className="mt-3 text-sm text-red-700 hover:text-red-800 font-medium disabled:opacity-50"
+                >
+                  {result.cancel_requested ? "Cancelling..." : "Cancel import"}
+                </button>
+              )}
+              {(result.status === "cancelled" || result.status === "failed") && (
+                <button
+                  onClick={resume}
+                  className="mt-3 text-sm text-blue-700 hover:text-blue-800 font-medium"
+                >
+                  Resume import
+                </button>
+              )}
             </div>
           )}
 
@@ -143,7 +245,7 @@ function UploadContacts() {
             disabled={!file || loading}
             className="w-full bg-blue-600 hover:bg-blue-700 text-white font-medium py-2.5 px-6 rounded-lg transition-all duration-200 disabled:opacity-50 disabled:cursor-not-allowed shadow-sm hover:shadow-md text-sm sm:text-base"
           >
-            {loading ? "Uploading..." : "Upload CSV"}
+            {loading ? (result ? "Importing..." : "Uploading...") : "Upload CSV"}
           </button>
 
           <div className="bg-blue-50 border border-blue-100 rounded-lg p-3 sm:p-4">
@@ -155,8 +257,8 @@ function UploadContacts() {
                   <li>Required column: <code className="bg-white px-1.5 py-0.5 rounded text-xs font-mono">email</code></li>
                   <li>Optional column: <code className="bg-white px-1.5 py-0.5 rounded text-xs font-mono">name</code></li>
                   <li>First row should contain column headers</li>
-                  <li>Email addresses must be valid format</li>
-                  <li>Duplicate emails will be automatically skipped</li>
+                  <li>Invalid email addresses are skipped and reported by reason</li>
+                  <li>Duplicate emails (case-insensitive) will be automatically skipped</li>
                 </ul>
               </div>
             </div>
@@ -33,7 +33,11 @@ export default function CampaignList() {
       const res = await api.post("/campaign/send", null, {
         params: { campaign_id: id }
       });
-      setMessage(`✅ Campaign sent successfully! Total sent: ${res.data.total_sent}`);
+      if (res.data.error) {
+        setMessage(`❌ ${res.data.message || res.data.error}`);
+      } else {
+        setMessage(`✅ Campaign queued for sending (job #${res.data.job_id})`);
+      }
       setTimeout(() => setMessage(""), 5000);
     } catch (error) {
       setMessage("❌ Failed to send campaign");